@@ -7,38 +7,36 @@
 #       - name of the TestPlan (e.g. "BSP/QEMU master branch")
 #       - name of the TestPlan's product (e.g. "BSPs")
 #       - version (e.g "1.8")
+#
+# Optional positional argument:
+#       - file listing the test cases the Test Plan plans, one per line. Those
+#         a Test Run of the plan has no result for are counted as idle.
+#         python manage.py plan_testcases adds test cases to an existing plan.
 
 import os, sys
 import django
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "customreports/"))
-os.environ["DJANGO_SETTINGS_MODULE"] = "customreports.settings"
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "customreports.settings")
 
 django.setup()
 
-from charts.models import TestPlanForm
+from charts import ingest
 
 try:
     name = str(sys.argv[1])
     product = str(sys.argv[2])
     product_version = str(sys.argv[3])
+    testcases_file = sys.argv[4] if len(sys.argv) > 4 else None
 except IndexError, NameError:
-    print "Usage: add_testplan \"<name>\" \"<product>\" \"<product_version>\""
+    print "Usage: add_testplan \"<name>\" \"<product>\" \"<product_version>\" [<testcases_file>]"
     print "Example: python add_testplan.py \"BSP/QEMU master branch\" \"BSPs\" \"1.8\""
     sys.exit(1)
 
 
-testplan = {
-    'name' : name,
-    'product' : product,
-    'product_version' : product_version
-    }
-
-testplan_form = TestPlanForm(data=testplan)
-
-if testplan_form.is_valid():
-    testplan_obj = testplan_form.save()
+try:
+    ingest.add_testplan(name, product, product_version, testcases_file=testcases_file or None)
     print "TestPlan saved"
-else:
-    print 'Error: TestPlan json is not valid'
+except ingest.IngestError, e:
+    print 'Error: %s' % e
     sys.exit(1)
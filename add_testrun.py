@@ -19,20 +19,47 @@
 #       - hardware architecture (e.g "x86")
 #       - device on which the Test Run executed (e.g. "Atom-PC")
 #
+# Optional positional arguments:
+#       - file listing the packages installed on the image, one per line
+#       - file listing the services running on the target
+#       - directory of files to attach to the Test Run, files in its
+#         sub-directories are attached to the Test Case named after them
+# Pass "" to skip an optional argument.
+#
+# With --follow, the log is read while it is still being written and results
+# are saved as they appear, until it doesn't grow for a while (or Ctrl-C).
+# A log file of "-" is read from the standard input.
+#
+# Logs are bitbake's text output, JUnit XML, subunit v2 or JSON lines (see
+# charts/parsers.py), guessed from the log's extension (.xml, .subunit, .json
+# or .jsonl) unless --format=<text|junit|subunit|json> is given.
+#
 # It currently handles only two types of Test Plans: OE-Core and BSP.
 # It chooses the corresponding Test Plan by checking the value of the "target"
 # parameters.
+#
+# The ingest_daemon command imports Test Runs without the start-up cost of
+# this script, see queue_ingest.py.
 
 import os, sys
 import django
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "customreports/"))
-os.environ["DJANGO_SETTINGS_MODULE"] = "customreports.settings"
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "customreports.settings")
 
 django.setup()
 
-from charts.models import TestPlan, TestRunForm, TestCaseResultForm
-from django.shortcuts import get_object_or_404
+from charts import ingest
+
+follow = '--follow' in sys.argv
+if follow:
+    sys.argv.remove('--follow')
+
+log_format = None
+for arg in sys.argv[1:]:
+    if arg.startswith('--format='):
+        log_format = arg[len('--format='):]
+        sys.argv.remove(arg)
 
 try:
     log_file = str(sys.argv[1])
@@ -46,17 +73,16 @@ try:
     image_type = str(sys.argv[9])
     hw_arch = str(sys.argv[10])
     hw = str(sys.argv[11])
+    packages_file = sys.argv[12] if len(sys.argv) > 12 else None
+    services_file = sys.argv[13] if len(sys.argv) > 13 else None
+    attachments_dir = sys.argv[14] if len(sys.argv) > 14 else None
 
 except IndexError, NameError:
-    print "Usage: add_testrun <log_file> \"<version>\" \"<release>\" \"<test_type>\" \"<poky_commit>\" \"<poky_branch>\" \"<start_date>\" \"<target>\" \"<image_type>\" \"<hw_arch>\" \"<hw>\""
+    print "Usage: add_testrun [--follow] [--format=<format>] <log_file> \"<version>\" \"<release>\" \"<test_type>\" \"<poky_commit>\" \"<poky_branch>\" \"<start_date>\" \"<target>\" \"<image_type>\" \"<hw_arch>\" \"<hw>\" [<packages_file> [<services_file> [<attachments_dir>]]]"
     print "Example: python add_testrun.py results.log \"1.8\" \"1.8_rc1\" \"Weekly\" \"29812e61736a95f1de64b3e9ebbb9c646ebd28dd\" \"master\" \"2015-05-15 11:39:23\" \"genericx86\" \"core-image-sato\" \"x86_64\" \"NUC\""
     print "<start_date> _must_ respect the format in the example. <test_type> _must_ be either \"Weekly\" or \"Full Pass\""
     sys.exit(1)
 
-errors_log = open('errors.log', 'w')
-
-testrun_obj = None
-
 testrun = {
     'version' : version,
     'release' : release,
@@ -70,81 +96,14 @@ testrun = {
     'hw' : hw
     }
 
-testrun_form = TestRunForm(data=testrun)
-
-if testrun_form.is_valid():
-    testrun_obj = testrun_form.save(commit=False)
-    if target in ["AB-Centos", "AB-Fedora", "AB-Opensuse", "AB-Ubuntu"]:
-        # then Test Plan is "OE-Core"
-        testrun_obj.testplan = get_object_or_404(TestPlan, name="OE-Core master branch")
-    else:
-        # then Test Plan is "BSP"
-        testrun_obj.testplan = get_object_or_404(TestPlan, name="BSP/QEMU master branch")
-    testrun_obj.save()
-    print "TestRun saved"
-else:
-    print 'Error: TestRun json is not valid. Exiting ...'
-    errors_log.write('Error: TestRun json is not valid. Exiting ...\n')
-    errors_log.close()
-    sys.exit(1)
-
-
-test_list = []
-test_list_string = ""
-test_id = result = msg = ""
+errors_log = open('errors.log', 'w')
 
-if not os.path.isfile(log_file):
-    print "Error: Cannot find log file"
-    testrun_obj.delete()
-    print 'Test Run deleted. Exiting ...'
-    errors_log.write('Error: Cannot find log file. Exiting ...\n')
-    errors_log.close()
+try:
+    ingest.add_testrun(log_file, testrun, packages_file=packages_file or None, services_file=services_file or None,
+                       attachments_dir=attachments_dir or None, follow=follow, log_format=log_format)
+except ingest.IngestError, e:
+    print 'Error: %s. Exiting ...' % e
+    errors_log.write('Error: %s. Exiting ...\n' % e)
     sys.exit(1)
-
-# Parse the log_file and create new instances of Test Case Results
-with open(log_file, 'r') as content_file:
-    content = content_file.read()
-
-    content = content.split("\n")
-
-    for i in xrange(len(content) - 1):
-        msg = ""
-        if (": PASSED" in content[i]) or (": FAILED" in content[i]):
-            content[i] = content[i].split(" - Testcase ")[1]
-            test_id = content[i].split(":")[0].lower().replace(" ", "")
-            result = content[i].split(":")[1].lower().replace(" ", "")
-            if result == "failed":
-                for j in range(i + 2, len(content) - 1):
-                    if (" - Testcase " not in content[j]) and (content[j] != ""):
-                        msg += content[j] + "\n"
-                    else:
-                        break
-
-                msg = msg.replace('\"', '\\\"')
-                msg = msg.replace('\\\\', '(double backslash)')
-                msg = msg.replace('\\_', ' ')
-                msg = msg.strip('\\\\')
-                msg = msg.replace('\\n\\n_', '\\n')
-                msg = msg.replace('\t', ' ')
-
-            testcaseresult = {
-                "testcase_id" : test_id,
-                "result" : result,
-                "message" : msg
-                }
-
-            testcaseresult_form = TestCaseResultForm(data=testcaseresult)
-            if testcaseresult_form.is_valid():
-                testcaseresult_obj = testcaseresult_form.save(commit=False)
-                testcaseresult_obj.testrun = testrun_obj
-                testcaseresult_obj.save()
-            else:
-                print 'Error: A TestCaseResult json is not valid'
-                testrun_obj.delete()
-                print 'Test Run deleted. Exiting ...'
-                errors_log.write('Error: A TestCaseResult json is not valid. Exiting ...\n')
-                errors_log.close()
-                sys.exit(1)
-
+finally:
     errors_log.close()
-    print "All TestCaseResults saved. Done"
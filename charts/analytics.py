@@ -0,0 +1,145 @@
+"""
+Trend series of the charts, computed on NumPy arrays so that charts over tens
+of thousands of Test Runs are built quickly and sent to the browser at a
+size it can draw.
+"""
+
+import numpy as np
+
+# Points a chart is downsampled to
+MAX_POINTS = 500
+
+# Points the rolling pass rate and the moving average are computed over
+WINDOW = 10
+
+# Smallest change of pass rate, between the WINDOW points before and after
+# a point, that makes it a change point
+CHANGE_THRESHOLD = 0.1
+
+def rolling_sum(values, window):
+    """ Sum of each value and the window - 1 values before it, fewer at the start """
+
+    sums = np.cumsum(values, dtype=float)
+    sums[window:] = sums[window:] - sums[:-window]
+    return sums
+
+def moving_average(values, window=WINDOW):
+    """ Mean of each value and the window - 1 values before it """
+
+    values = np.asarray(values, dtype=float)
+    return rolling_sum(values, window) / np.minimum(np.arange(1, len(values) + 1), window)
+
+def pass_rate(passed, failed):
+    """ passed / (passed + failed), 0 where there are no results """
+
+    total = np.asarray(passed, dtype=float) + failed
+    return np.divide(passed, total, out=np.zeros_like(total), where=total > 0)
+
+def rolling_pass_rate(passed, failed, window=WINDOW):
+    """ Pass rate of the results of each point and the window - 1 points before it """
+
+    return pass_rate(rolling_sum(passed, window), rolling_sum(failed, window))
+
+def change_points(passed, failed, window=WINDOW, threshold=CHANGE_THRESHOLD):
+    """ Returns the sorted indexes where the pass rate of the window points
+        starting there differs by at least threshold from the one of the
+        window points before. Points closer than window to a larger change
+        are left out.
+    """
+
+    n = len(passed)
+    if n < 2 * window:
+        return np.array([], dtype=int)
+
+    passed = np.concatenate(([0], np.cumsum(passed, dtype=float)))
+    failed = np.concatenate(([0], np.cumsum(failed, dtype=float)))
+
+    # Split points k with window points on both sides: before is [k - window, k), after [k, k + window)
+    k = np.arange(window, n - window + 1)
+    before = pass_rate(passed[k] - passed[k - window], failed[k] - failed[k - window])
+    after = pass_rate(passed[k + window] - passed[k], failed[k + window] - failed[k])
+    shift = np.abs(after - before)
+
+    found = []
+    for i in np.argsort(-shift, kind='mergesort'):
+        if shift[i] < threshold:
+            break
+        if all(abs(k[i] - point) >= window for point in found):
+            found.append(k[i])
+
+    return np.array(sorted(found), dtype=int)
+
+def lttb(y, points=MAX_POINTS):
+    """ Returns the indexes of at most points values of y, chosen with the
+        Largest-Triangle-Three-Buckets algorithm so that the downsampled
+        series keeps the shape of the full one. Values are evenly spaced.
+    """
+
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    # points - 2 buckets between the first and the last value, which are always kept
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    selected = np.empty(points, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        if i == points - 3:
+            next_x, next_y = n - 1, y[-1]
+        else:
+            next_x, next_y = (edges[i + 1] + edges[i + 2] - 1) / 2.0, y[edges[i + 1]:edges[i + 2]].mean()
+
+        x = np.arange(start, end)
+        area = np.abs((a - next_x) * (y[start:end] - y[a]) - (a - x) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+def trend(passed, failed, points=MAX_POINTS, window=WINDOW):
+    """ Computes the trend of a series of pass and fail counts. Returns a dict of:
+        - index: indexes of the points to draw, at most points plus the change points
+        - rolling_rate: rolling pass rate of every point
+        - average_failed: moving average of the fails of every point
+        - change_points: indexes where the pass rate changes
+    """
+
+    passed = np.asarray(passed, dtype=float)
+    failed = np.asarray(failed, dtype=float)
+    changes = change_points(passed, failed, window)
+
+    return {
+        'index' : np.union1d(lttb(pass_rate(passed, failed), points), changes),
+        'rolling_rate' : rolling_pass_rate(passed, failed, window),
+        'average_failed' : moving_average(failed, window),
+        'change_points' : changes,
+    }
+
+def chart_rows(labels, links, passed, failed, points=MAX_POINTS, window=WINDOW):
+    """ Returns the rows of a trend chart, see charts/js/trend.js, as lists of
+        [label, link, passes, fails, average fails, rolling pass rate %, change]
+        where change is a text for change points and None elsewhere.
+    """
+
+    if not len(labels):
+        return []
+
+    series = trend(passed, failed, points, window)
+    index = series['index']
+    changes = set(series['change_points'].tolist())
+    rate = series['rolling_rate']
+
+    rows = zip(np.asarray(labels, dtype=object)[index].tolist(),
+               np.asarray(links, dtype=object)[index].tolist(),
+               np.asarray(passed, dtype=int)[index].tolist(),
+               np.asarray(failed, dtype=int)[index].tolist(),
+               np.round(series['average_failed'][index], 2).tolist(),
+               np.round(rate[index] * 100, 2).tolist(),
+               [('%+.0f%%' % ((rate[min(i + window - 1, len(rate) - 1)] - rate[i - 1]) * 100) if i in changes else None)
+                for i in index.tolist()])
+
+    return [list(row) for row in rows]
@@ -0,0 +1,132 @@
+"""
+Archival of the Test Case Results of old releases. The results of each Test
+Run are moved out of the results table into one compressed row of
+ArchivedTestRun, the Test Runs, their counters and the rollups stay. Pages
+of archived Test Runs read their results from the archive.
+"""
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+import datetime
+import json
+import operator
+import zlib
+
+from .models import TestCase, TestRun, TestCaseResult, ArchivedTestRun
+
+# Test Case Result fields stored in the archive
+FIELDS = ('id', 'testcase_id', 'result', 'message', 'started_on', 'finished_on', 'attachments', 'comments',
+          'signature_id')
+
+DATE_FIELDS = ('started_on', 'finished_on')
+
+class ArchivedResults(list):
+    """ Test Case Results read from the archive, with the parts of the
+        QuerySet API the tables use """
+
+    model = TestCaseResult
+
+    def order_by(self, *fields):
+        results = ArchivedResults(self)
+        # Stable sorts, least significant field first
+        for field in reversed(fields):
+            results.sort(key=operator.attrgetter(field.lstrip('-').replace('__', '.')), reverse=field.startswith('-'))
+        return results
+
+    def count(self):
+        return len(self)
+
+def encode(rows):
+    lines = []
+    for row in rows:
+        row = dict(zip(FIELDS, row))
+        for field in DATE_FIELDS:
+            if row[field] is not None:
+                row[field] = row[field].isoformat()
+        lines.append(json.dumps(row, sort_keys=True))
+    return zlib.compress("\n".join(lines), 9)
+
+def decode(archived):
+    """ Returns the Test Case Results of an ArchivedTestRun, unsaved """
+
+    # Databases return buffers for binary fields
+    data = zlib.decompress(bytes(archived.results))
+    results = ArchivedResults()
+    for line in data.split("\n") if data else []:
+        row = json.loads(line)
+        for field in DATE_FIELDS:
+            if row[field] is not None:
+                row[field] = parse_datetime(row[field])
+        results.append(TestCaseResult(testrun_id=archived.testrun_id, **row))
+
+    # Test cases of all the results in one query
+    testcases = TestCase.objects.in_bulk(set(result.testcase_id for result in results))
+    for result in results:
+        result.testcase = testcases[result.testcase_id]
+    return results
+
+def archive_testrun(testrun):
+    """ Moves the results of a Test Run to the archive. Returns how many
+        there were, None if the Test Run already is archived. """
+
+    with transaction.atomic():
+        if ArchivedTestRun.objects.filter(pk=testrun.pk).exists():
+            return None
+
+        results = TestCaseResult.objects.filter(testrun=testrun)
+        rows = list(results.order_by('id').values_list(*FIELDS))
+        ArchivedTestRun.objects.create(testrun=testrun, results=encode(rows),
+                                       first_result_id=rows[0][0] if rows else 0,
+                                       last_result_id=rows[-1][0] if rows else 0)
+        results.delete()
+
+    return len(rows)
+
+def restore_testrun(testrun):
+    """ Moves the results of an archived Test Run back, with their ids """
+
+    with transaction.atomic():
+        archived = ArchivedTestRun.objects.select_for_update().filter(pk=testrun.pk).first()
+        if archived is None:
+            return None
+
+        results = decode(archived)
+        for result in results:
+            result.version = testrun.version
+        TestCaseResult.objects.bulk_create(results, batch_size=1000)
+        archived.delete()
+
+    return len(results)
+
+def expired_releases(days):
+    """ Releases whose newest Test Run started more than days ago """
+
+    limit = timezone.now() - datetime.timedelta(days=days)
+    return list(TestRun.objects.order_by().values('release').annotate(newest=Max('start_date'))
+                .filter(newest__lt=limit).order_by('release').values_list('release', flat=True))
+
+def results_of(testrun_id):
+    """ Returns the archived results of a Test Run, None if it is not archived """
+
+    archived = ArchivedTestRun.objects.filter(pk=testrun_id).first()
+    return decode(archived) if archived else None
+
+def failed_results_of(testrun_ids):
+    """ Returns {Test Run id: [failed results]} for the archived ones among testrun_ids """
+
+    failed = {}
+    for archived in ArchivedTestRun.objects.filter(testrun__in=testrun_ids):
+        failed[archived.testrun_id] = [result for result in decode(archived) if result.result == 'failed']
+    return failed
+
+def get_result(result_id):
+    """ Returns an archived Test Case Result given its id, None if there is none """
+
+    candidates = ArchivedTestRun.objects.filter(first_result_id__lte=result_id, last_result_id__gte=result_id)
+    for archived in candidates:
+        for result in decode(archived):
+            if result.id == result_id:
+                return result
+    return None
@@ -0,0 +1,227 @@
+"""
+Files attached to Test Runs and their Test Cases, such as logs and
+screenshots. Files are stored once under ATTACHMENT_ROOT, named after the
+SHA-256 of their content, and are streamed to clients without being read in
+memory whole.
+"""
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+import datetime
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+import time
+
+from .models import Attachment, TestCaseAttachment
+from . import catalog
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Seconds before an unused attachment or temporary file is pruned, an import
+# may be about to attach it or still be writing it
+PRUNE_AFTER = 60*60
+
+def path_of(digest):
+    return os.path.join(settings.ATTACHMENT_ROOT, digest[:2], digest[2:4], digest)
+
+def _lock(digest, size, content_type):
+    """ Returns the Attachment of a digest, added if needed, locked until the
+        end of the transaction so that prune leaves it alone """
+
+    while True:
+        attachment = Attachment.objects.select_for_update().filter(digest=digest).first()
+        if attachment is not None:
+            attachment.last_used = timezone.now()
+            attachment.save(update_fields=['last_used'])
+            return attachment
+        try:
+            with transaction.atomic():
+                return Attachment.objects.create(digest=digest, size=size,
+                                                 content_type=content_type or 'application/octet-stream')
+        except IntegrityError:
+            # Added meanwhile by another import, locked on the next try
+            continue
+
+def store_file(source, content_type=None):
+    """ Stores the content of a file object, or the file at the given path,
+        and returns its Attachment. Content stored before is not written
+        again. The Attachment stays locked until the end of the caller's
+        transaction, if any. """
+
+    if isinstance(source, basestring):
+        with open(source, 'rb') as source_file:
+            return store_file(source_file, content_type or mimetypes.guess_type(source)[0])
+
+    tmp_dir = os.path.join(settings.ATTACHMENT_ROOT, 'tmp')
+    if not os.path.isdir(tmp_dir):
+        os.makedirs(tmp_dir)
+
+    digest = hashlib.sha256()
+    size = 0
+    tmp = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+    try:
+        with tmp:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                size += len(chunk)
+                tmp.write(chunk)
+
+        digest = digest.hexdigest()
+        path = path_of(digest)
+        with transaction.atomic():
+            # With the row locked, the file can't be pruned between this check and its use
+            attachment = _lock(digest, size, content_type)
+            if os.path.exists(path):
+                os.remove(tmp.name)
+            else:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                # Atomic, readers never see a partial file
+                os.rename(tmp.name, path)
+    except:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+        raise
+
+    return attachment
+
+def attach(testrun, path, testcase_id=None, name=None):
+    """ Attaches the file at path to a Test Run, or to one of its Test Cases
+        given by its id in the catalog, replacing the attachment of the same
+        name """
+
+    with transaction.atomic():
+        # Locked until it is linked, see prune
+        attachment = store_file(path)
+        testcase_attachment, created = TestCaseAttachment.objects.update_or_create(
+            testrun=testrun, testcase_id=testcase_id, name=name or os.path.basename(path),
+            defaults={'attachment' : attachment})
+    return testcase_attachment
+
+def attach_directory(testrun, directory, lower_case=False):
+    """ Attaches the files of a directory to a Test Run, those in sub-directories
+        to the Test Case named after the directory. With lower_case, directory
+        names match test cases whatever their case, as the test cases of text
+        logs are lower case (see parsers.parse_text). Returns how many files
+        there were. """
+
+    entries = sorted(os.listdir(directory))
+    testcases = [entry for entry in entries if os.path.isdir(os.path.join(directory, entry))]
+    ids = catalog.get_ids([entry.lower() if lower_case else entry for entry in testcases])
+
+    count = 0
+    for entry in entries:
+        path = os.path.join(directory, entry)
+        if entry in testcases:
+            for name in sorted(os.listdir(path)):
+                if os.path.isfile(os.path.join(path, name)):
+                    attach(testrun, os.path.join(path, name), testcase_id=ids[entry.lower() if lower_case else entry])
+                    count += 1
+        elif os.path.isfile(path):
+            attach(testrun, path)
+            count += 1
+    return count
+
+def prune(older_than=PRUNE_AFTER):
+    """ Deletes the stored files no Test Run refers to anymore and that
+        weren't used for older_than seconds, and the temporary files imports
+        left that are as old. Returns how many stored files there were. """
+
+    used_before = timezone.now() - datetime.timedelta(seconds=older_than)
+    unused = Attachment.objects.filter(testcaseattachment__isnull=True, last_used__lt=used_before)
+    count = 0
+    for attachment_id in list(unused.values_list('pk', flat=True)):
+        with transaction.atomic():
+            # Locked first, so that it can't be stored or attached again until it is gone
+            attachment = Attachment.objects.select_for_update().filter(pk=attachment_id, last_used__lt=used_before).first()
+            if attachment is None or TestCaseAttachment.objects.filter(attachment=attachment).exists():
+                continue
+            attachment.delete()
+            if os.path.exists(path_of(attachment.digest)):
+                os.remove(path_of(attachment.digest))
+        count += 1
+
+    tmp_dir = os.path.join(settings.ATTACHMENT_ROOT, 'tmp')
+    if os.path.isdir(tmp_dir):
+        for name in os.listdir(tmp_dir):
+            path = os.path.join(tmp_dir, name)
+            try:
+                if os.path.getmtime(path) < time.time() - older_than:
+                    os.remove(path)
+            except OSError:
+                # Renamed into place or removed by store_file meanwhile
+                continue
+
+    return count
+
+def read_chunks(path, start, length):
+    with open(path, 'rb') as stored:
+        stored.seek(start)
+        while length > 0:
+            chunk = stored.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def get_range(header, size):
+    """ Returns (start, length) of a single range Range header, None to send
+        the whole file and False if the range can't be satisfied """
+
+    match = RANGE.match(header.strip()) if header else None
+    if match is None:
+        # Missing, malformed or multiple ranges, which are allowed to be ignored
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # The last bytes
+        length = min(int(last), size)
+        return (size - length, length) if length else False
+
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or last < first:
+        return False
+    return first, last - first + 1
+
+def serve(request, testcase_attachment):
+    """ Streams an attachment, supporting conditional and range requests """
+
+    attachment = testcase_attachment.attachment
+    etag = '"%s"' % attachment.digest
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    if etag in [tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+
+    # A range of an other version of the file is no use to the client
+    if_range = request.META.get('HTTP_IF_RANGE')
+    byte_range = get_range(request.META.get('HTTP_RANGE'), attachment.size) if if_range in (None, etag) else None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % attachment.size
+        return response
+
+    start, length = byte_range or (0, attachment.size)
+    response = StreamingHttpResponse(read_chunks(path_of(attachment.digest), start, length),
+                                     status=206 if byte_range else 200, content_type=attachment.content_type)
+    if byte_range:
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, start + length - 1, attachment.size)
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Content-Disposition'] = 'inline; filename="%s"' % testcase_attachment.name.replace('"', '')
+    return response
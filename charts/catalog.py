@@ -0,0 +1,46 @@
+"""
+Catalog of test cases. Test Case Results refer to their test case by an
+integer key rather than repeating its name, and Test Plans list the test
+cases they plan, so that the ones a Test Run didn't run are counted as idle
+by difference instead of being stored as idle results.
+"""
+
+from django.db import IntegrityError, transaction
+
+from .models import TestCase
+
+MAX_NAME_LENGTH = TestCase._meta.get_field('name').max_length
+
+# Names looked up per query, SQLite allows few parameters
+CHUNK_SIZE = 500
+
+def _lookup(names):
+    names = sorted(names)
+    ids = {}
+    for start in range(0, len(names), CHUNK_SIZE):
+        ids.update(TestCase.objects.filter(name__in=names[start:start + CHUNK_SIZE]).values_list('name', 'id'))
+    return ids
+
+def get_ids(names):
+    """ Returns {name: id} of test cases, adding the ones not in the catalog yet """
+
+    ids = _lookup(set(names))
+    missing = set(names) - set(ids)
+    if missing:
+        try:
+            with transaction.atomic():
+                TestCase.objects.bulk_create([TestCase(name=name) for name in sorted(missing)])
+        except IntegrityError:
+            # Some were added meanwhile by another import
+            for name in missing:
+                TestCase.objects.get_or_create(name=name)
+        ids.update(_lookup(missing))
+
+    return ids
+
+def plan(testplan, names):
+    """ Adds test cases to the ones a Test Plan plans """
+
+    ids = sorted(set(get_ids(names).values()))
+    for start in range(0, len(ids), CHUNK_SIZE):
+        testplan.testcases.add(*ids[start:start + CHUNK_SIZE])
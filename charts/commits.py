@@ -0,0 +1,69 @@
+"""
+The poky commit a test case started failing on in a plan-environment.
+Results are ordered by the start of their Test Run, so each lookup is a
+range over the history of one test case (see the index of TestCaseResult)
+rather than a scan of all results, and commits are ordered by their first
+Test Run in the plan-environment (see CommitRollup). Archived results are
+not looked at.
+"""
+
+from django.db.models import Q, Sum
+
+from .models import TestCaseResult, CommitRollup
+
+RESULT_FIELDS = ('testrun_id', 'testrun__poky_commit', 'testrun__poky_branch', 'testrun__start_date', 'result')
+
+def history(testcase, testplan, target, hw):
+    return TestCaseResult.objects.filter(testcase__name=testcase, testrun__testplan_id=testplan, testrun__target=target,
+                                         testrun__hw=hw)
+
+def _describe(row):
+    testrun, commit, branch, start_date, result = row
+    return {'testrun' : testrun, 'commit' : commit, 'branch' : branch, 'start_date' : start_date.isoformat(),
+            'result' : result}
+
+def _latest(results):
+    return results.order_by('-testrun__start_date', '-testrun_id').values_list(*RESULT_FIELDS).first()
+
+def suspects(testplan, target, hw, after, until):
+    """ Commits first tested in the plan-environment after the after date, up
+        to the until date, with their results there """
+
+    commits = []
+    rollups = CommitRollup.objects.filter(testplan_id=testplan, target=target, hw=hw, first_seen__lte=until)
+    if after is not None:
+        rollups = rollups.filter(first_seen__gt=after)
+    for commit, branch, first_seen, result, count in (rollups.order_by('first_seen', 'poky_commit')
+                                                      .values_list('poky_commit', 'poky_branch', 'first_seen', 'result')
+                                                      .annotate(Sum('count'))):
+        if not commits or commits[-1]['commit'] != commit or commits[-1]['branch'] != branch:
+            commits.append({'commit' : commit, 'branch' : branch, 'first_seen' : first_seen.isoformat(), 'counts' : {}})
+        commits[-1]['counts'][result] = count
+    return commits
+
+def find_first_bad(testcase, testplan, target, hw):
+    """ Returns {'last_good': result, 'first_bad': result, 'suspects':
+        [commit]} for a test case whose latest result in the
+        plan-environment is a failure, with first_bad None if it passes.
+        Returns None if it has no passed or failed result there. """
+
+    results = history(testcase, testplan, target, hw)
+    latest = _latest(results.filter(result__in=('passed', 'failed')))
+    if latest is None:
+        return None
+    if latest[-1] == 'passed':
+        return {'last_good' : _describe(latest), 'first_bad' : None, 'suspects' : []}
+
+    last_good = _latest(results.filter(result='passed'))
+    failures = results.filter(result='failed')
+    if last_good is not None:
+        testrun, start_date = last_good[0], last_good[3]
+        failures = failures.filter(Q(testrun__start_date__gt=start_date) |
+                                   Q(testrun__start_date=start_date, testrun_id__gt=testrun))
+    first_bad = failures.order_by('testrun__start_date', 'testrun_id').values_list(*RESULT_FIELDS).first()
+
+    return {
+        'last_good' : last_good and _describe(last_good),
+        'first_bad' : _describe(first_bad),
+        'suspects' : suspects(testplan, target, hw, last_good and last_good[3], first_bad[3]),
+    }
@@ -0,0 +1,189 @@
+"""
+Synthetic data for benchmarks and tests. Everything is derived from a seed,
+so the same arguments always generate the same dataset.
+"""
+
+from django.db import transaction
+from django.utils import timezone
+import collections
+import datetime
+import random
+
+from .models import TestPlan, TestRun, TestCaseResult
+from . import catalog
+from . import signatures
+from . import rollups
+from . import reports
+from . import partitions
+from . import inventory
+
+# (test plan, target, image type, hw arch, hw)
+PLAN_ENVS = (
+    ('BSP/QEMU master branch', 'genericx86', 'core-image-sato', 'x86', 'NUC'),
+    ('BSP/QEMU master branch', 'genericx86-64', 'core-image-sato-sdk', 'x86_64', 'NUC'),
+    ('BSP/QEMU master branch', 'qemux86', 'core-image-minimal', 'x86', 'qemux86'),
+    ('BSP/QEMU master branch', 'qemuarm', 'core-image-sato', 'arm', 'qemuarm'),
+    ('BSP/QEMU master branch', 'beaglebone', 'core-image-sato', 'arm', 'beaglebone'),
+    ('BSP/QEMU master branch', 'edgerouter', 'core-image-minimal', 'mips64', 'edgerouter'),
+    ('OE-Core master branch', 'AB-Ubuntu', 'core-image-sato', 'x86_64', 'AB-Ubuntu'),
+    ('OE-Core master branch', 'AB-Fedora', 'core-image-sato', 'x86_64', 'AB-Fedora'),
+    ('OE-Core master branch', 'AB-Centos', 'core-image-sato', 'x86_64', 'AB-Centos'),
+    ('OE-Core master branch', 'AB-Opensuse', 'core-image-sato', 'x86_64', 'AB-Opensuse'),
+)
+
+# Failures seen in real oeqa logs, the placeholders change between
+# occurrences the same way they do in real logs
+FAILURES = (
+    ('dmesg', 'test_dmesg', 12,
+     'self.assertEqual(status, 1, msg = "Error messages in dmesg log: %s" % output)',
+     'AssertionError: 0 != 1 : Error messages in dmesg log: [    {ktime}] ACPI Error: [CAPB] Namespace lookup failure, '
+     'AE_ALREADY_EXISTS (20141107/dsfield-211)\n[    {ktime}] ACPI Error: Method parse/execution failed [\\_SB_.PCI0._OSC] '
+     '(Node {addr}), AE_ALREADY_EXISTS (20141107/psparse-536)'),
+    ('xorg', 'test_xorg_logfile', 29,
+     'self.assertEqual(status, 0, msg = "Errors in Xorg log: %s" % output)',
+     'AssertionError: 1 != 0 : Errors in Xorg log: [    {ktime}] (EE) open /dev/fb0: No such file or directory'),
+    ('parselogs', 'test_parselogs', 240,
+     'self.assertEqual(errcount, 0, msg=self.msg)',
+     'AssertionError: 6 != 0 : No ignore list found for this machine, using default'),
+    ('connman', 'test_connmand_running', 28,
+     'self.assertEqual(status, 0, msg="No connmand process, ps output: %s" % self.target.run(oeRuntimeTest.pscmd)[1])',
+     'AssertionError: 1 != 0 : No connmand process, ps output: PID USER VSZ STAT COMMAND\n    1 root {pid} S init [5]'),
+    ('smart', 'test_smart_install', 77,
+     'self.smart(\'install -y psplash-default\')',
+     'AssertionError: 1 != 0 : Cannot fetch repository metadata from http://{host}:{port}/rpm/repodata at {time}'),
+    ('ssh', 'test_ssh', 12,
+     '(status, output) = self.target.run(\'uname -a\')',
+     'SSHTimeout: Process killed - no output for 300 seconds. Total running time: {seconds} seconds.'),
+)
+
+# Packages of the images, with the version they start at
+PACKAGES = (
+    ('base-files', '3.0.14'), ('base-passwd', '3.5.29'), ('bash', '4.3.30'), ('busybox', '1.23.1'),
+    ('connman', '1.27'), ('dbus-1', '1.8.18'), ('dropbear', '2015.67'), ('glib-2.0', '2.42.1'),
+    ('gtk+', '2.24.25'), ('kernel-3.19.2', '3.19.2'), ('libc6', '2.21'), ('libgcc1', '4.9.2'),
+    ('libstdc++6', '4.9.2'), ('libx11-6', '1.6.3'), ('libxml2', '2.9.2'), ('matchbox-wm', '1.2.1'),
+    ('openssl', '1.0.2a'), ('psplash-default', '0.1'), ('python', '2.7.9'), ('rpm', '5.4.14'),
+    ('smartpm', '1.4.1'), ('systemd', '219'), ('udev', '182'), ('xserver-xorg', '1.16.4'),
+)
+
+SERVICES = ('connmand', 'dbus-daemon', 'dropbear', 'matchbox-window-manager', 'psplash', 'udevd', 'Xorg')
+
+def package_list(release_index):
+    """ The packages installed on images of a release, a few get a new version each release """
+
+    lines = []
+    for name, version in PACKAGES:
+        bumps = sum(1 for i in range(release_index) if random.Random('%s %d' % (name, i)).random() < 0.2)
+        lines.append('%s - %s-r%d' % (name, version, bumps))
+    return "\n".join(lines)
+
+TRACEBACK = '''Traceback (most recent call last):
+  File "/work/{job}/runtime/{target}/poky/meta/lib/oeqa/utils/decorators.py", line {line1}, in wrapped_f
+    return func(*args)
+  File "/work/{job}/runtime/{target}/poky/meta/lib/oeqa/utils/decorators.py", line {line2}, in wrapped_f
+    return f(*args)
+  File "/work/{job}/runtime/{target}/poky/meta/lib/oeqa/runtime/{module}.py", line {line}, in {function}
+    {statement}
+{error}
+'''
+
+def failure_message(rng, target):
+    """ Returns a random, realistic failure message """
+
+    module, function, line, statement, error = rng.choice(FAILURES)
+    details = {
+        'ktime' : '%.6f' % rng.uniform(0, 10),
+        'addr' : '%08x' % rng.getrandbits(32),
+        'pid' : rng.randint(1000, 9999),
+        'host' : '192.168.7.%d' % rng.randint(1, 254),
+        'port' : rng.randint(1024, 65535),
+        'time' : '%02d:%02d:%02d' % (rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59)),
+        'seconds' : rng.randint(300, 3600),
+    }
+
+    return TRACEBACK.format(job=rng.choice(['weekly', 'nightly', 'fullpass']), target=target,
+                            line1=rng.choice([100, 101]), line2=rng.choice([88, 89]), module=module,
+                            line=line, function=function, statement=statement, error=error.format(**details))
+
+def testcase_ids(count):
+    """ Test case ids as found in Testopia, mostly numbers with a few names """
+
+    return [('test_case_%d' % i) if i % 50 == 0 else str(100 + i) for i in range(count)]
+
+def generate(versions=2, releases=3, plan_envs=4, runs=2, testcases=100, failure_rate=0.05, seed=0):
+    """ Creates versions x releases x plan_envs x runs Test Runs, each with
+        testcases Test Case Results. Returns the number of Test Runs created.
+    """
+
+    rng = random.Random(seed)
+    cases = testcase_ids(testcases)
+    # Some test cases are a lot flakier than others
+    flakiness = dict((case, failure_rate * rng.choice([0, 0, 0.5, 1, 1, 2, 5])) for case in cases)
+
+    testplans = {}
+    for name in set(env[0] for env in PLAN_ENVS):
+        testplans[name], created = TestPlan.objects.get_or_create(
+            name=name, defaults={'product' : name.split()[0], 'product_version' : '1.0'})
+        catalog.plan(testplans[name], cases)
+    ids = catalog.get_ids(cases)
+
+    start = timezone.now().replace(microsecond=0) - datetime.timedelta(days=14 * versions * releases)
+    created = 0
+
+    for v in range(versions):
+        version = '1.%d' % (8 + v)
+        partitions.ensure_partition(version)
+        for r in range(releases):
+            release = '%s_M%d.rc1' % (version, r + 1)
+            commit = '%040x' % rng.getrandbits(160)
+            release_start = start + datetime.timedelta(days=14 * (v * releases + r))
+            packages = package_list(v * releases + r)
+
+            with transaction.atomic():
+                for e, (testplan, target, image_type, hw_arch, hw) in enumerate(PLAN_ENVS[:plan_envs]):
+                    for n in range(runs):
+                        testrun = TestRun.objects.create(
+                            testplan=testplans[testplan], version=version, release=release,
+                            test_type=rng.choice(['Weekly', 'Full Pass']), poky_commit=commit, poky_branch='master',
+                            start_date=release_start + datetime.timedelta(hours=e, minutes=n * 10),
+                            target=target, image_type=image_type, hw_arch=hw_arch, hw=hw)
+                        created += 1
+
+                        results = []
+                        counts = collections.Counter()
+                        for case in cases:
+                            if rng.random() < flakiness[case]:
+                                message = failure_message(rng, target)
+                                results.append(TestCaseResult(
+                                    testrun=testrun, version=version, testcase_id=ids[case], result='failed', message=message,
+                                    signature=signatures.index_failure(message, testrun.start_date)))
+                            else:
+                                results.append(TestCaseResult(testrun=testrun, version=version, testcase_id=ids[case],
+                                                              result='passed'))
+                            counts[results[-1].result] += 1
+                        TestCaseResult.objects.bulk_create(results, batch_size=1000)
+                        for result in TestRun.COUNTERS:
+                            setattr(testrun, result, counts[result])
+                        testrun.save(update_fields=TestRun.COUNTERS)
+                        rollups.add_testrun(testrun)
+                        reports.add_testrun(testrun)
+                        # Runs on minimal images don't start the graphical services
+                        inventory.store(testrun, packages=packages, services="\n".join(
+                            service for service in SERVICES if 'minimal' not in image_type or service in ('dropbear', 'udevd')))
+
+    return created
+
+def write_log(path, testcases=1000, failure_rate=0.05, seed=0):
+    """ Writes a bitbake test log, in the format add_testrun.py parses """
+
+    rng = random.Random(seed)
+    clock = datetime.datetime(2015, 5, 15, 10, 0, 0)
+
+    with open(path, 'w') as log:
+        for case in testcase_ids(testcases):
+            clock += datetime.timedelta(seconds=rng.randint(0, 30))
+            prefix = '%s - bitbake-worker - RESULTS - Testcase %s:' % (clock.strftime('%H:%M:%S'), case)
+            if rng.random() < failure_rate:
+                log.write('%s FAILED\n%s\n%s\n' % (prefix, prefix, failure_message(rng, 'genericx86')))
+            else:
+                log.write('%s PASSED\n' % prefix)
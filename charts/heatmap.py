@@ -0,0 +1,55 @@
+"""
+Pass rates of every release of a version for every plan-environment, the
+(Test Plan, target, hw) rows of the Test Report table, computed in one
+grouped query over the counters of the Test Runs.
+"""
+
+from django.db.models import Min, Sum
+
+from .models import TestRun, percentage
+
+def color(passed, whole):
+    """ Background of a cell, from red for no passes to green for all passing """
+
+    hue = 120 * passed / float(whole) if whole else 0
+    return 'hsl(%d, 65%%, 75%%)' % hue
+
+def build(version):
+    """ Returns (releases, rows) for a version. Releases are ordered by their
+        first Test Run. Each row is a dict of the plan-environment with the
+        cells of its releases, None where it wasn't run. """
+
+    releases = {}
+    cells = {}
+    names = {}
+    for release, testplan, name, target, hw, first, passed, failed, blocked, idle in (
+            TestRun.objects.filter(version=version).order_by()
+            .values_list('release', 'testplan', 'testplan__name', 'target', 'hw')
+            .annotate(Min('start_date'), *[Sum(result) for result in TestRun.COUNTERS])):
+        releases[release] = min(first, releases.get(release, first))
+        names[testplan] = name
+        total = passed + failed + blocked + idle
+        run = total - idle
+        cells[(testplan, target, hw, release)] = {
+            'passed' : passed,
+            'failed' : failed,
+            'total' : total,
+            'run' : run,
+            'abs_passed' : percentage(passed, total),
+            'relative_passed' : percentage(passed, run),
+            'color' : color(passed, run),
+        }
+
+    releases = sorted(releases, key=lambda release: (releases[release], release))
+    rows = []
+    for plan_env in sorted(set(key[:3] for key in cells), key=lambda key: (names[key[0]], key[1], key[2])):
+        testplan, target, hw = plan_env
+        rows.append({
+            'testplan' : testplan,
+            'testplan_name' : names[testplan],
+            'target' : target,
+            'hw' : hw,
+            'cells' : [(release, cells.get(plan_env + (release,))) for release in releases],
+        })
+
+    return releases, rows
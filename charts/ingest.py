@@ -0,0 +1,291 @@
+"""
+Import of Test Plans, and of Test Runs with the results of their test log,
+shared by add_testplan.py, add_testrun.py and the ingest_daemon command.
+Logs are parsed as they are read (see charts/parsers.py), so that logs still
+being written can be followed. Results are saved in batches which update the
+counters of the Test Run, the rollups and the data version of the release,
+so pages show a run's progress while it is imported.
+"""
+
+from django.db import transaction
+from django.db.models import F
+import collections
+import os
+import sys
+import time
+
+from .models import TestPlan, TestRun, TestCaseResult, TestPlanForm, TestRunForm, TestCaseResultForm
+from . import attachments
+from . import catalog
+from . import inventory
+from . import jobs
+from . import pagecache
+from . import reports
+from . import parsers
+from . import partitions
+from . import rollups
+from . import signatures
+
+# Results saved at once, and longest time results wait to be saved
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 5
+
+# How often a followed log is checked for new lines, and how long it may not
+# grow before the run is considered over
+POLL_INTERVAL = 1
+IDLE_TIMEOUT = 15 * 60
+
+# Targets whose runs belong to the OE-Core Test Plan, the others are BSP runs
+OE_CORE_TARGETS = ("AB-Centos", "AB-Fedora", "AB-Opensuse", "AB-Ubuntu")
+OE_CORE_TESTPLAN = "OE-Core master branch"
+BSP_TESTPLAN = "BSP/QEMU master branch"
+
+# Test Plans by name, they are never renamed
+_testplans = {}
+
+class IngestError(Exception):
+    pass
+
+class InvalidResult(IngestError):
+    pass
+
+def tail(path, poll_interval=POLL_INTERVAL, idle_timeout=IDLE_TIMEOUT):
+    """ Yields the lines of a growing file as they are completed, or None
+        every poll_interval while it doesn't grow. Follows the file when it
+        is rotated or truncated, and stops after idle_timeout seconds
+        without new lines. """
+
+    log = open(path, 'r')
+    inode = os.fstat(log.fileno()).st_ino
+    partial = ""
+    last_line = time.time()
+
+    try:
+        while True:
+            partial += log.readline()
+            if partial.endswith("\n"):
+                yield partial
+                partial = ""
+                last_line = time.time()
+                continue
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Rotated and not created again yet
+                stat = None
+
+            if stat is not None and stat.st_ino != inode:
+                # Rotated, the old file was read to its end
+                log.close()
+                log = open(path, 'r')
+                inode = os.fstat(log.fileno()).st_ino
+                if partial:
+                    yield partial
+                    partial = ""
+                continue
+
+            if stat is not None and stat.st_size < log.tell():
+                # Truncated in place, what is in it now is new
+                log.seek(0)
+                partial = ""
+                continue
+
+            if idle_timeout is not None and time.time() - last_line > idle_timeout:
+                return
+
+            yield None
+            time.sleep(poll_interval)
+    finally:
+        log.close()
+
+class Importer(object):
+    """ Saves the results of a Test Run in batches. Each batch is added to the
+        counters of the run and to the rollups, and invalidates the pages of
+        its release. Idle results are not saved, the test cases are added to
+        the Test Plan and counted as idle once the run is imported. """
+
+    def __init__(self, testrun, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.testrun = testrun
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.planned = set()
+        self.flushed_at = time.time()
+        self.count = 0
+
+    def add(self, test_id, result, message):
+        if not test_id or len(test_id) > catalog.MAX_NAME_LENGTH:
+            raise InvalidResult("Test Case Result %s is not valid: invalid test case name" % test_id)
+        form = TestCaseResultForm(data={'result' : result, 'message' : message})
+        if not form.is_valid():
+            raise InvalidResult("Test Case Result %s is not valid: %s" % (test_id, form.errors.as_text()))
+
+        if result == 'idle':
+            self.planned.add(test_id)
+        else:
+            self.pending.append((test_id, form.save(commit=False)))
+        if len(self.pending) >= self.batch_size or time.time() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def _add_counts(self, counts):
+        # Update in the database so that pages reading the run meanwhile see consistent counts
+        TestRun.objects.filter(pk=self.testrun.pk).update(
+            **dict((result, F(result) + count) for result, count in counts.items()))
+        for result, count in counts.items():
+            setattr(self.testrun, result, getattr(self.testrun, result) + count)
+        rollups.add_results(self.testrun, counts)
+
+    def flush(self):
+        self.flushed_at = time.time()
+        if not self.pending and not self.planned:
+            return
+
+        counts = collections.Counter(testcaseresult.result for test_id, testcaseresult in self.pending)
+        with transaction.atomic():
+            if self.planned:
+                catalog.plan(self.testrun.testplan, self.planned)
+            ids = catalog.get_ids(set(test_id for test_id, testcaseresult in self.pending))
+            for test_id, testcaseresult in self.pending:
+                testcaseresult.testcase_id = ids[test_id]
+                testcaseresult.testrun = self.testrun
+                testcaseresult.version = self.testrun.version
+                if testcaseresult.result == 'failed':
+                    # Group the failure with the ones sharing the same root cause
+                    testcaseresult.signature = signatures.index_failure(testcaseresult.message, self.testrun.start_date)
+            TestCaseResult.objects.bulk_create(testcaseresult for test_id, testcaseresult in self.pending)
+            self._add_counts(counts)
+
+        self.count += len(self.pending)
+        self.pending = []
+        self.planned = set()
+        pagecache.bump_data_version(self.testrun.release)
+
+    def close(self):
+        """ Saves the results left, then counts the planned test cases the run
+            has no result for as idle """
+
+        self.flush()
+        idle = self.testrun.get_missing().count() - self.testrun.idle
+        if idle:
+            with transaction.atomic():
+                self._add_counts({'idle' : idle})
+            pagecache.bump_data_version(self.testrun.release)
+
+def import_records(testrun, records, **kwargs):
+    """ Saves the results a parser yields, None being a chance to save the
+        results read so far. Returns how many there were. Interrupting it
+        saves the results read until then. """
+
+    importer = Importer(testrun, **kwargs)
+    try:
+        for record in records:
+            if record is None:
+                importer.flush()
+            else:
+                importer.add(*record)
+    except KeyboardInterrupt:
+        pass
+
+    importer.close()
+    return importer.count
+
+def import_lines(testrun, lines, log_format='text', **kwargs):
+    return import_records(testrun, parsers.PARSERS[log_format](lines), **kwargs)
+
+def get_testplan(name):
+    if name not in _testplans:
+        testplan = TestPlan.objects.filter(name=name).first()
+        if testplan is None:
+            raise IngestError("No Test Plan named %s" % name)
+        _testplans[name] = testplan
+    return _testplans[name]
+
+def add_testplan(name, product, product_version, testcases_file=None):
+    """ Creates a Test Plan, planning the test cases listed in testcases_file, one per line """
+
+    testplan_form = TestPlanForm(data={'name' : name, 'product' : product, 'product_version' : product_version})
+    if not testplan_form.is_valid():
+        raise IngestError("TestPlan json is not valid")
+
+    names = set(line.strip() for line in open(testcases_file)) - set([""]) if testcases_file else set()
+    if any(len(testcase) > catalog.MAX_NAME_LENGTH for testcase in names):
+        raise IngestError("Test case names are at most %d characters long" % catalog.MAX_NAME_LENGTH)
+
+    testplan = testplan_form.save()
+    catalog.plan(testplan, names)
+    _testplans.setdefault(name, testplan)
+    return testplan
+
+def add_testrun(log_file, fields, packages_file=None, services_file=None, attachments_dir=None, follow=False,
+                log_format=None, out=sys.stdout):
+    """ Creates a Test Run from fields, the data of a TestRunForm, and saves
+        the results of its log, read from stdin when log_file is "-". The
+        format of the log is guessed from its name if not given. Raises
+        IngestError, or whatever else went wrong, once the Test Run is
+        deleted, if it can't be imported. """
+
+    if log_format is None:
+        log_format = 'text' if log_file == "-" else parsers.detect(log_file)
+    if log_format not in parsers.PARSERS:
+        raise IngestError("Unknown log format %s, one of %s" % (log_format, ', '.join(sorted(parsers.PARSERS))))
+    if follow and log_format not in parsers.LINE_FORMATS:
+        raise IngestError("Only %s logs can be followed" % ' and '.join(sorted(parsers.LINE_FORMATS)))
+
+    testrun_form = TestRunForm(data=fields)
+    if not testrun_form.is_valid():
+        raise IngestError("TestRun json is not valid")
+
+    testrun = testrun_form.save(commit=False)
+    testrun.testplan = get_testplan(OE_CORE_TESTPLAN if testrun.target in OE_CORE_TARGETS else BSP_TESTPLAN)
+    testrun.save()
+    partitions.ensure_partition(testrun.version)
+    out.write("TestRun saved\n")
+
+    if log_file == "-":
+        log = iter(sys.stdin.readline, "") if log_format in parsers.LINE_FORMATS else sys.stdin
+    elif not os.path.isfile(log_file):
+        testrun.delete()
+        out.write("Test Run deleted\n")
+        raise IngestError("Cannot find log file")
+    elif follow:
+        log = tail(log_file)
+    else:
+        log = open(log_file, 'r' if log_format in parsers.LINE_FORMATS else 'rb')
+
+    # Counted in its release from now on, its results are added as they are saved
+    rollups.add_testrun(testrun)
+    try:
+        count = import_records(testrun, parsers.PARSERS[log_format](log))
+        out.write("All %d TestCaseResults saved. Done\n" % count)
+
+        # Package and service lists are stored once for all the runs they were found on
+        if packages_file or services_file:
+            inventory.store(testrun,
+                            packages=open(packages_file).read().decode('utf-8') if packages_file else '',
+                            services=open(services_file).read().decode('utf-8') if services_file else '')
+
+        if attachments_dir:
+            # Only text logs lower the case of test cases
+            attached = attachments.attach_directory(testrun, attachments_dir, lower_case=log_format == 'text')
+            out.write("Attached %d files\n" % attached)
+
+        reports.add_testrun(testrun)
+    except Exception as e:
+        # The counters in memory may be ahead of a batch that failed to save
+        testrun.refresh_from_db(fields=TestRun.COUNTERS)
+        rollups.remove_testrun(testrun)
+        indexed = signatures.remove_testrun(testrun)
+        testrun.delete()
+        signatures.drop_unused(indexed)
+        out.write("Test Run deleted\n")
+        if isinstance(e, parsers.ParseError):
+            raise IngestError("Cannot parse %s log: %s" % (log_format, e))
+        raise
+
+    # Drop the cached pages of the release, a worker renders the new ones
+    pagecache.bump_data_version(testrun.release)
+    jobs.enqueue('warm_release', testrun.release)
+    out.write("Release pages queued for caching\n")
+
+    return testrun
@@ -0,0 +1,117 @@
+"""
+Package and service inventories of Test Runs. The lists are parsed into
+snapshots of (name, version) items, addressed by a hash of their content, so
+that runs on the same image share one snapshot instead of storing the same
+20k characters again.
+"""
+
+from django.db import IntegrityError, transaction
+import hashlib
+import re
+
+from .models import InventorySnapshot, InventoryItem, TestRun
+
+# "name - version" (opkg), "name version", "name=version" or "name: version"
+NAME_VERSION = re.compile(r'^(\S+?)\s*(?:\s-\s|\s|=|:\s)\s*(\S+)')
+# name-version-release as printed by rpm -qa, the version starts with a digit
+NAME_DASH_VERSION = re.compile(r'^(.+?)-(\d[^-]*(?:-[^-]+)?)$')
+
+def split_entries(text):
+    """ Lists usually hold one entry per line, short ones are comma separated """
+
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) == 1 and ',' in lines[0]:
+        lines = [entry.strip() for entry in lines[0].split(',') if entry.strip()]
+    return lines
+
+def parse_packages(text):
+    """ Returns {package name: version} of a list of installed packages """
+
+    packages = {}
+    for entry in split_entries(text):
+        match = NAME_VERSION.match(entry) or NAME_DASH_VERSION.match(entry)
+        if match:
+            packages[match.group(1)] = match.group(2)
+        else:
+            packages[entry] = ''
+    return packages
+
+def parse_services(text):
+    """ Returns {service name: ''} of a list of running services """
+
+    return dict((entry.split()[0], '') for entry in split_entries(text))
+
+def get_digest(kind, items):
+    content = "\n".join("%s\t%s" % item for item in sorted(items.items()))
+    return hashlib.sha1((kind + "\n" + content).encode('utf-8')).hexdigest()
+
+def get_snapshot(kind, items):
+    """ Returns the snapshot holding exactly items, {name: version}, creating it if needed """
+
+    digest = get_digest(kind, items)
+    snapshot = InventorySnapshot.objects.filter(digest=digest).first()
+    if snapshot is not None:
+        return snapshot
+
+    try:
+        with transaction.atomic():
+            snapshot = InventorySnapshot.objects.create(kind=kind, digest=digest, size=len(items))
+            InventoryItem.objects.bulk_create(
+                [InventoryItem(snapshot=snapshot, name=name, version=version) for name, version in items.items()],
+                batch_size=1000)
+    except IntegrityError:
+        # Created by a concurrent import
+        snapshot = InventorySnapshot.objects.get(digest=digest)
+
+    return snapshot
+
+def store(testrun, packages=None, services=None, keep_text=False):
+    """ Sets the inventory snapshots of a Test Run from the given lists, or
+        its text fields, which are then emptied unless keep_text is set """
+
+    if packages is None:
+        packages = testrun.package_versions_installed
+    if services is None:
+        services = testrun.services_running
+
+    fields = []
+    if packages.strip():
+        testrun.packages = get_snapshot('packages', parse_packages(packages))
+        fields.append('packages')
+    if services.strip():
+        testrun.services = get_snapshot('services', parse_services(services))
+        fields.append('services')
+
+    if not keep_text:
+        testrun.package_versions_installed = testrun.services_running = ''
+        fields += ['package_versions_installed', 'services_running']
+
+    if fields:
+        testrun.save(update_fields=fields)
+
+def diff(snapshot_id, other_snapshot_id):
+    """ Returns the items added, removed and changed from the first snapshot
+        to the second one: {'added': [(name, version)], 'removed': [(name,
+        version)], 'changed': [(name, version, other version)]} """
+
+    items = ({}, {})
+    if snapshot_id != other_snapshot_id:
+        for snapshot, name, version in (InventoryItem.objects.filter(snapshot__in=[snapshot_id, other_snapshot_id])
+                                        .values_list('snapshot', 'name', 'version')):
+            items[snapshot != snapshot_id][name] = version
+
+    before, after = items
+    return {
+        'added' : sorted((name, version) for name, version in after.items() if name not in before),
+        'removed' : sorted((name, version) for name, version in before.items() if name not in after),
+        'changed' : sorted((name, before[name], version) for name, version in after.items()
+                           if name in before and before[name] != version),
+    }
+
+def diff_testruns(testrun_id, other_testrun_id, kind='packages'):
+    """ Diff of the inventories of two Test Runs, None if one of them doesn't exist """
+
+    snapshots = dict(TestRun.objects.filter(pk__in=[testrun_id, other_testrun_id]).values_list('id', kind))
+    if len(snapshots) != len(set([testrun_id, other_testrun_id])):
+        return None
+    return diff(snapshots[testrun_id], snapshots[other_testrun_id])
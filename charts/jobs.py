@@ -0,0 +1,180 @@
+"""
+Queue of background work, kept in the Job table and run by the run_jobs
+command, so that imports don't wait for it and pages don't do it. A job is
+a kind, naming one of the HANDLERS, and a key it works on, e.g. a release.
+Queueing a job already waiting to run does nothing, failed jobs are retried
+a few times, later each time.
+"""
+
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+import datetime
+import time
+import traceback
+
+from .models import ArchivedTestRun, Job, TestRun
+from . import pagecache
+from . import reports
+from . import rollups
+
+# Seconds before a failed job runs again, doubled on every attempt
+RETRY_DELAY = 60
+
+# Running jobs started longer ago than this belong to a worker that died
+STALE_AFTER = datetime.timedelta(hours=6)
+
+# Finished jobs are kept this long
+KEEP_FINISHED = datetime.timedelta(days=7)
+
+POLL_INTERVAL = 1
+
+HANDLERS = {}
+PRIORITIES = {}
+
+def handler(kind, priority=0):
+    """ Registers the function running jobs of a kind, given their key """
+
+    def decorator(function):
+        HANDLERS[kind] = function
+        PRIORITIES[kind] = priority
+        return function
+    return decorator
+
+@handler('warm_release', priority=10)
+def warm_release(release):
+    pagecache.warm_release(release)
+
+@handler('update_counts', priority=5)
+def update_counts(testrun_id):
+    testrun = TestRun.objects.get(pk=testrun_id)
+    # Archived runs keep their counts, they have no results to count
+    if ArchivedTestRun.objects.filter(testrun=testrun).exists():
+        return
+    with transaction.atomic():
+        rollups.remove_testrun(testrun)
+        testrun.update_counts()
+        rollups.add_testrun(testrun)
+        reports.add_testrun(testrun)
+    pagecache.bump_data_version(testrun.release)
+
+@handler('rebuild_rollups')
+def rebuild_rollups(key):
+    rollups.rebuild()
+    pagecache.bump_data_version(None)
+
+@handler('snapshot_release')
+def snapshot_release(release):
+    call_command('snapshot_release', release)
+
+def get_dedupe_key(kind, key):
+    return '%s:%s' % (kind, key)
+
+def enqueue(kind, key='', priority=None, delay=0):
+    """ Queues a job, or returns the same one if it is already queued """
+
+    if kind not in HANDLERS:
+        raise ValueError("Unknown job kind %s" % kind)
+    if priority is None:
+        priority = PRIORITIES[kind]
+    key = str(key)
+
+    # Twice, the queued job may start running in between
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                return Job.objects.create(kind=kind, key=key, priority=priority, dedupe_key=get_dedupe_key(kind, key),
+                                          run_after=timezone.now() + datetime.timedelta(seconds=delay))
+        except IntegrityError:
+            job = Job.objects.filter(dedupe_key=get_dedupe_key(kind, key)).first()
+            if job is not None:
+                if priority > job.priority:
+                    Job.objects.filter(pk=job.pk).update(priority=priority)
+                return job
+
+    raise IntegrityError("Could not queue %s" % get_dedupe_key(kind, key))
+
+def claim(kinds=None):
+    """ Marks the next job to run as running and returns it, None if there is none """
+
+    jobs = Job.objects.filter(state=Job.QUEUED, run_after__lte=timezone.now())
+    if kinds:
+        jobs = jobs.filter(kind__in=kinds)
+
+    for job in jobs.order_by('-priority', 'run_after', 'id')[:10]:
+        # Only one worker gets to update it
+        if Job.objects.filter(pk=job.pk, state=Job.QUEUED).update(
+                state=Job.RUNNING, dedupe_key=None, started=timezone.now(), attempts=F('attempts') + 1):
+            job.refresh_from_db()
+            return job
+    return None
+
+def run(job):
+    """ Runs a claimed job, queuing it again if it fails and has attempts left.
+        Returns the state it ends in. """
+
+    try:
+        HANDLERS[job.kind](job.key)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        job.state = Job.FAILED
+        if job.attempts < job.max_attempts:
+            job.state = Job.QUEUED
+            job.dedupe_key = get_dedupe_key(job.kind, job.key)
+            job.run_after = timezone.now() + datetime.timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+        # The connection may be what failed
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+    else:
+        job.state = Job.DONE
+        job.last_error = ''
+
+    job.finished = timezone.now()
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        # The same job was queued again meanwhile, it will do the work
+        job.state = Job.FAILED
+        job.dedupe_key = None
+        job.save()
+
+    return job.state
+
+def requeue_stale():
+    """ Queues again the jobs of workers that died while running them """
+
+    for job in Job.objects.filter(state=Job.RUNNING, started__lt=timezone.now() - STALE_AFTER):
+        job.state = Job.QUEUED
+        job.dedupe_key = get_dedupe_key(job.kind, job.key)
+        try:
+            with transaction.atomic():
+                job.save()
+        except IntegrityError:
+            Job.objects.filter(pk=job.pk).update(state=Job.FAILED, last_error="Superseded by a newer job")
+
+def prune():
+    Job.objects.filter(state__in=[Job.DONE, Job.FAILED], finished__lt=timezone.now() - KEEP_FINISHED).delete()
+
+def work(kinds=None, poll_interval=POLL_INTERVAL, once=False, log=None):
+    """ Runs jobs as they are queued, or until there are none left if once is set """
+
+    requeue_stale()
+    prune()
+    while True:
+        # Keep the connection open between jobs, unless the server dropped it
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+        job = claim(kinds)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        start = time.time()
+        state = run(job)
+        if log is not None:
+            log.write("%s %s: %s in %.1fs" % (job.kind, job.key, state, time.time() - start))
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from charts.models import TestRun
+from charts import archive
+from charts import pagecache
+
+class Command(BaseCommand):
+    help = ("Moves the Test Case Results of old releases to the archive. Test Runs, their result counts "
+            "and the rollups stay, and their pages read the results from the archive. Without releases, "
+            "archives the ones with no Test Run newer than --older-than days.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('releases', nargs='*')
+        parser.add_argument('--older-than', type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help="Age in days of the newest Test Run of the releases to archive")
+        parser.add_argument('--restore', action='store_true', default=False,
+                            help="Move the results of the given releases back out of the archive")
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help="Only list the releases that would be archived")
+
+    def handle(self, *args, **options):
+        releases = options['releases']
+        if not releases and not options['restore']:
+            releases = archive.expired_releases(options['older_than'])
+
+        for release in releases:
+            if options['dry_run']:
+                self.stdout.write(release)
+                continue
+
+            moved = 0
+            for testrun in TestRun.objects.filter(release=release).order_by('id'):
+                if options['restore']:
+                    moved += archive.restore_testrun(testrun) or 0
+                else:
+                    moved += archive.archive_testrun(testrun) or 0
+
+            pagecache.bump_data_version(release)
+            self.stdout.write("%s: %s %d results" % (release, "restored" if options['restore'] else "archived", moved))
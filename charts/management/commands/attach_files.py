@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+import os
+
+from charts.models import TestRun
+from charts import attachments
+from charts import catalog
+from charts import pagecache
+
+class Command(BaseCommand):
+    help = ("Attaches files to a Test Run, or to one of its Test Cases. Files are stored once "
+            "whatever the number of runs they are attached to. With --prune, deletes the stored "
+            "files no run refers to anymore and that were not used for an hour.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('testrun', nargs='?', type=int)
+        parser.add_argument('paths', nargs='*', help="Files, or directories laid out as for add_testrun.py")
+        parser.add_argument('--testcase', help="Name of the Test Case to attach the files to")
+        parser.add_argument('--lower-case', action='store_true', default=False,
+                            help="Match directory names and --testcase whatever their case, for runs imported "
+                                 "from text logs whose test cases are lower case")
+        parser.add_argument('--prune', action='store_true', default=False)
+
+    def handle(self, *args, **options):
+        if options['testrun'] is not None:
+            testrun = TestRun.objects.filter(pk=options['testrun']).first()
+            if testrun is None:
+                raise CommandError("No Test Run %d" % options['testrun'])
+
+            testcase_id = None
+            if options['testcase']:
+                name = options['testcase'].lower() if options['lower_case'] else options['testcase']
+                testcase_id = catalog.get_ids([name])[name]
+
+            for path in options['paths']:
+                if os.path.isdir(path):
+                    self.stdout.write("Attached %d files" % attachments.attach_directory(testrun, path,
+                                                                                         lower_case=options['lower_case']))
+                else:
+                    attachments.attach(testrun, path, testcase_id=testcase_id)
+                    self.stdout.write("Attached %s" % path)
+
+            pagecache.bump_data_version(testrun.release)
+
+        if options['prune']:
+            self.stdout.write("Deleted %d unused files" % attachments.prune())
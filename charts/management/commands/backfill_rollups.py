@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from charts.models import TestRun
+from charts import rollups
+from charts import pagecache
+
+class Command(BaseCommand):
+    help = ("Rebuilds the daily, weekly and per commit result rollups the trend charts and the first bad "
+            "commit finder are drawn from, and the catalog of versions and releases. Run it once after "
+            "migrating, add_testrun.py keeps them up to date afterwards.")
+
+    def handle(self, *args, **options):
+        created = rollups.rebuild()
+
+        for release in TestRun.objects.values_list('release', flat=True).distinct():
+            pagecache.bump_data_version(release)
+
+        self.stdout.write("Created %d rollups" % created)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+from charts.models import TestRun
+from charts import transfer
+
+class Command(BaseCommand):
+    help = ("Writes the Test Runs of releases, with their results, Test Plans, failure signatures and "
+            "inventories, to a dump file that load_releases reads on another instance.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('releases', nargs='+')
+
+    def handle(self, *args, **options):
+        missing = set(options['releases']) - set(TestRun.objects.filter(release__in=options['releases'])
+                                                 .values_list('release', flat=True).distinct())
+        if missing:
+            raise CommandError("No Test Run in %s" % ', '.join(sorted(missing)))
+
+        start = time.time()
+        count = transfer.dump(options['path'], options['releases'])
+        self.stdout.write("Dumped %d Test Runs in %.1fs" % (count, time.time() - start))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from charts.models import TestRun
+from charts import dataset
+from charts import pagecache
+
+class Command(BaseCommand):
+    help = "Fills the database with synthetic Test Runs, for benchmarking"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--versions', type=int, default=2)
+        parser.add_argument('--releases', type=int, default=3, help="Releases per version")
+        parser.add_argument('--plan-envs', type=int, default=4,
+                            help="Plan-environments per release, at most %d" % len(dataset.PLAN_ENVS))
+        parser.add_argument('--runs', type=int, default=2, help="Test Runs per plan-environment")
+        parser.add_argument('--testcases', type=int, default=100, help="Test Case Results per Test Run")
+        parser.add_argument('--failure-rate', type=float, default=0.05)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        created = dataset.generate(versions=options['versions'], releases=options['releases'],
+                                   plan_envs=options['plan_envs'], runs=options['runs'],
+                                   testcases=options['testcases'], failure_rate=options['failure_rate'],
+                                   seed=options['seed'])
+
+        for release in TestRun.objects.values_list('release', flat=True).distinct():
+            pagecache.bump_data_version(release)
+
+        self.stdout.write("Created %d Test Runs" % created)
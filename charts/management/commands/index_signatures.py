@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from charts.models import FailureSignature, TestCaseResult
+from charts import signatures
+
+class Command(BaseCommand):
+    help = "Adds the failed Test Case Results that have no signature yet to the failure signature index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', default=False,
+                            help="Drop the existing index and rebuild it from all failed results")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            with transaction.atomic():
+                TestCaseResult.objects.filter(signature__isnull=False).update(signature=None)
+                FailureSignature.objects.all().delete()
+
+        pending = (TestCaseResult.objects.filter(result='failed', signature__isnull=True)
+                   .exclude(message='').order_by('id'))
+
+        indexed = last_id = 0
+        while True:
+            batch = list(pending.filter(id__gt=last_id)
+                         .values_list('id', 'message', 'testrun__start_date')[:options['batch_size']])
+            if not batch:
+                break
+
+            with transaction.atomic():
+                for result_id, message, start_date in batch:
+                    failure_signature = signatures.index_failure(message, start_date)
+                    TestCaseResult.objects.filter(pk=result_id).update(signature=failure_signature)
+
+            indexed += len(batch)
+            last_id = batch[-1][0]
+
+        self.stdout.write("Indexed %d failed results into %d signatures" % (indexed, FailureSignature.objects.count()))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from charts import spool
+
+class Command(BaseCommand):
+    help = ("Imports the Test Runs and Test Plans queued with queue_ingest.py as they come, keeping its "
+            "database connection and Test Plans between them. One daemon serves a spool directory at a time.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spool', help="Spool directory, INGEST_SPOOL_ROOT by default")
+        parser.add_argument('--poll-interval', type=float, default=spool.POLL_INTERVAL,
+                            help="Seconds between checks for new jobs")
+        parser.add_argument('--once', action='store_true', default=False,
+                            help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        try:
+            spool.serve(options['spool'], options['poll_interval'], options['once'], log=self.stdout)
+        except KeyboardInterrupt:
+            pass
+        except spool.SpoolLocked as e:
+            raise CommandError(e)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+from charts import transfer
+from charts import pagecache
+from charts import jobs
+
+class Command(BaseCommand):
+    help = ("Loads a dump file written by dump_releases. Rows get new ids; Test Plans, failure "
+            "signatures and inventories already on this instance are reused.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        try:
+            counts, releases = transfer.load(options['path'])
+        except transfer.DumpError as e:
+            raise CommandError(str(e))
+
+        for release in releases:
+            pagecache.bump_data_version(release)
+            jobs.enqueue('warm_release', release)
+
+        for table, count in counts.items():
+            self.stdout.write("%s: %d rows" % (table, count))
+        self.stdout.write("Loaded %s in %.1fs" % (', '.join(releases), time.time() - start))
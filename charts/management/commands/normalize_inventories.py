@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from charts.models import TestRun, InventorySnapshot
+from charts import inventory
+
+class Command(BaseCommand):
+    help = ("Parses the package and service lists stored as text on Test Runs into deduplicated "
+            "inventory snapshots, and empties the text fields")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-text', action='store_true', default=False,
+                            help="Keep the text fields after parsing them")
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        pending = (TestRun.objects.exclude(package_versions_installed='', services_running='')
+                   .filter(Q(packages__isnull=True) | Q(services__isnull=True)).order_by('id'))
+
+        done = last_id = 0
+        while True:
+            batch = list(pending.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+
+            with transaction.atomic():
+                for testrun in batch:
+                    inventory.store(testrun, keep_text=options['keep_text'])
+
+            done += len(batch)
+            last_id = batch[-1].id
+
+        self.stdout.write("Parsed the inventories of %d Test Runs into %d snapshots" %
+                          (done, InventorySnapshot.objects.count()))
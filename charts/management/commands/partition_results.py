@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from charts.models import TestRun, ResultRollup
+from charts import partitions
+from charts import pagecache
+from charts import rollups
+from charts import releases
+
+class Command(BaseCommand):
+    help = ("Manages the partitioning of Test Case Results by version, in PostgreSQL 11 or newer. "
+            "Without options, lists the partitions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true', default=False,
+                            help="Partition the Test Case Results table. It is locked while its rows are copied.")
+        parser.add_argument('--create', action='append', default=[], metavar='VERSION',
+                            help="Create the partition of a version, add_testrun.py does it for new versions")
+        parser.add_argument('--detach', action='append', default=[], metavar='VERSION',
+                            help="Detach the partition of a version, keeping it as a standalone table")
+        parser.add_argument('--drop-version', action='append', default=[], metavar='VERSION',
+                            help="Drop the partition of a version and delete its Test Runs")
+
+    def handle(self, *args, **options):
+        if not partitions.is_supported():
+            raise CommandError("Partitioning needs PostgreSQL 11 or newer")
+
+        if options['convert']:
+            if partitions.convert():
+                self.stdout.write("Partitioned %s" % partitions.TABLE)
+            else:
+                self.stdout.write("%s already is partitioned" % partitions.TABLE)
+
+        if not partitions.is_partitioned(connection.cursor()):
+            raise CommandError("%s is not partitioned, run with --convert first" % partitions.TABLE)
+
+        for version in options['create']:
+            partitions.ensure_partition(version)
+
+        for version in options['detach']:
+            if not partitions.detach(version):
+                raise CommandError("Version %s has no partition" % version)
+            self.stdout.write("Detached %s" % partitions.partition_name(version))
+
+        for version in options['drop_version']:
+            self.drop_version(version)
+
+        for name, bound in partitions.get_partitions(connection.cursor()):
+            self.stdout.write("%-40s %s" % (name, bound))
+
+    def drop_version(self, version):
+        names = list(TestRun.objects.filter(version=version).values_list('release', flat=True).distinct())
+
+        with transaction.atomic():
+            if not partitions.detach(version, drop=True):
+                raise CommandError("Version %s has no partition" % version)
+            # The results are gone with the partition, what is left is small.
+            # Commit rollups can span versions, the runs are taken out of them.
+            for testrun in TestRun.objects.filter(version=version):
+                rollups.remove_testrun(testrun)
+            ResultRollup.objects.filter(version=version).delete()
+            TestRun.objects.filter(version=version).delete()
+            # Releases also run for other versions keep the dates of these runs
+            releases.refresh_dates(names)
+
+        for release in names:
+            pagecache.bump_data_version(release)
+        self.stdout.write("Dropped version %s" % version)
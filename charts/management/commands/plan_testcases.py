@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from charts.models import TestPlan
+from charts import catalog
+from charts import jobs
+
+class Command(BaseCommand):
+    help = ("Adds the test cases listed in a file, one per line, to the ones a Test Plan plans. Those "
+            "a Test Run of the plan has no result for are counted as idle from its next import, and "
+            "with --recount for the existing runs.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('testplan', type=int, help="Test Plan id")
+        parser.add_argument('path', help="File listing the test cases")
+        parser.add_argument('--recount', action='store_true', default=False,
+                            help="Count the idle test cases of the plan's existing Test Runs again")
+
+    def handle(self, *args, **options):
+        testplan = TestPlan.objects.filter(pk=options['testplan']).first()
+        if testplan is None:
+            raise CommandError("No Test Plan %d" % options['testplan'])
+
+        names = set(line.strip() for line in open(options['path'])) - set([""])
+        if any(len(name) > catalog.MAX_NAME_LENGTH for name in names):
+            raise CommandError("Test case names are at most %d characters long" % catalog.MAX_NAME_LENGTH)
+        catalog.plan(testplan, names)
+        self.stdout.write("%s plans %d test cases" % (testplan.name, testplan.testcases.count()))
+
+        if options['recount']:
+            # Archived runs have no results to count
+            testruns = testplan.testrun_set.filter(archivedtestrun=None).values_list('id', flat=True)
+            for testrun in testruns:
+                jobs.enqueue('update_counts', testrun)
+            self.stdout.write("Counts of %d Test Runs queued for update, see run_jobs" % len(testruns))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from charts.models import TestReport
+from charts import reports
+
+class Command(BaseCommand):
+    help = ("Matches saved reports against all Test Runs again. Run it once after migrating, add_testrun.py "
+            "keeps them up to date afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('testreport', nargs='*', help="Report ids, all of them by default")
+
+    def handle(self, *args, **options):
+        testreports = TestReport.objects.all()
+        if options['testreport']:
+            testreports = testreports.filter(pk__in=options['testreport'])
+
+        for testreport in testreports:
+            reports.refresh(testreport)
+            self.stdout.write("%s: %d Test Runs" % (testreport.testreport_id, testreport.testreportrun_set.count()))
@@ -0,0 +1,271 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse, RegexURLResolver
+from django.db import connection, connections
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.http import urlencode
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from charts.models import TestCase, TestPlan, TestRun, TestCaseResult, FailureSignature, TestReport, Job
+from charts import dataset
+from charts import ingest
+from charts import pagecache
+from charts import partitions
+from charts import reports
+from charts import rollups
+import charts.urls
+
+# Arguments and query string to request each url of the charts app with,
+# given a Test Run and one of its failed Test Case Results
+URL_SAMPLES = {
+    'index' : lambda testrun, result: ([], {}),
+    'index_2' : lambda testrun, result: ([testrun.version], {}),
+    'heatmap' : lambda testrun, result: ([testrun.version], {}),
+    'search' : lambda testrun, result: ([], {'q' : testrun.release}),
+    'testrun_filter' : lambda testrun, result: ([], {'release' : testrun.release, 'testplan' : testrun.testplan_id}),
+    'testcase_filter' : lambda testrun, result: ([], {'name' : result.testcase.name}),
+    'testrun' : lambda testrun, result: ([testrun.id], {}),
+    'testcaseresult_message' : lambda testrun, result: ([result.id], {}),
+    'inventory_diff' : lambda testrun, result: ([TestRun.objects.order_by('id').values_list('id', flat=True).first(),
+                                                 'packages', testrun.id], {}),
+    'first_bad_commit' : lambda testrun, result: ([result.testcase.name, testrun.testplan_id, testrun.target, testrun.hw], {}),
+    'testreport' : lambda testrun, result: ([testrun.release], {}),
+    'saved_report' : lambda testrun, result: ([reports.save({'release' : testrun.release}).testreport_id], {}),
+    'plan_env' : lambda testrun, result: ([testrun.release, testrun.testplan_id, testrun.target, testrun.hw], {}),
+    'testreporttable' : lambda testrun, result: ([testrun.release], pagecache.TABLE_DEFAULT_PARAMS),
+    'searchtable' : lambda testrun, result: ([], dict(pagecache.TABLE_DEFAULT_PARAMS, q=testrun.release)),
+    'testcasetable' : lambda testrun, result: ([], dict(pagecache.TABLE_DEFAULT_PARAMS, name=result.testcase.name)),
+    'testrunresultstable' : lambda testrun, result: ([testrun.id], pagecache.TABLE_DEFAULT_PARAMS),
+}
+
+# Urls that are not worth measuring
+SKIPPED_URLS = ('base_testrun', 'base_testreport', 'save_report', 'querystats', 'attachment')
+
+# Pages are cached in a cache of the command's own, not in the site's
+BENCHMARK_CACHES = {'default' : {'BACKEND' : 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION' : 'benchmarks'}}
+
+INGEST_VERSION = '0.0'
+INGEST_RELEASE = 'benchmark_ingest'
+INGEST_COMMIT = '0' * 40
+
+def url_names(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, RegexURLResolver):
+            for name in url_names(pattern.url_patterns):
+                yield name
+        elif pattern.name:
+            yield pattern.name
+
+class QueryCounter(object):
+    """ Counts the queries run on all databases inside a with block """
+
+    def __enter__(self):
+        self.debug_cursors = []
+        for connection in connections.all():
+            self.debug_cursors.append((connection, connection.force_debug_cursor))
+            connection.force_debug_cursor = True
+            connection.queries_log.clear()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.count = 0
+        for connection, force_debug_cursor in self.debug_cursors:
+            self.count += len(connection.queries_log)
+            connection.force_debug_cursor = force_debug_cursor
+
+class Command(BaseCommand):
+    help = ("Times every url of the charts app and add_testrun.py ingestion against the current database, "
+            "and appends the results to a file so that runs can be compared. Pages are requested with an "
+            "empty cache of the command's own unless --warm is given, and the ingested Test Run is removed "
+            "with everything it added, but timings are only meaningful on a database nobody else uses. "
+            "Use generate_dataset to create the data to run it on.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help="Requests per url")
+        parser.add_argument('--warm', action='store_true', default=False,
+                            help="Keep the page cache between requests")
+        parser.add_argument('--ingest-testcases', type=int, default=2000,
+                            help="Size of the log ingested with add_testrun.py, 0 to skip ingestion")
+        parser.add_argument('--output', default=os.path.join(settings.BASE_DIR, 'benchmarks.jsonl'),
+                            help="File the results are appended to")
+        parser.add_argument('--label', default='', help="Free text stored with the results")
+
+    def handle(self, *args, **options):
+        with override_settings(CACHES=BENCHMARK_CACHES):
+            self.run(options)
+
+    def run(self, options):
+        testrun = TestRun.objects.exclude(release=INGEST_RELEASE).order_by('-id').first()
+        if testrun is None:
+            raise CommandError("No Test Runs to benchmark, run generate_dataset first")
+        results = TestCaseResult.objects.select_related('testcase')
+        result = (results.filter(testrun__release=testrun.release, result='failed').first() or
+                  results.filter(testrun=testrun).first())
+
+        report = {
+            'date' : timezone.now().isoformat(),
+            'commit' : self.get_commit(),
+            'label' : options['label'],
+            'warm' : options['warm'],
+            'dataset' : {
+                'testruns' : TestRun.objects.count(),
+                'testcaseresults' : TestCaseResult.objects.count(),
+            },
+            'urls' : {},
+        }
+
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if '*' not in host), 'localhost')
+        client = Client(REMOTE_ADDR='127.0.0.1', HTTP_HOST=host)
+        # The saved_report sample may save one
+        saved_reports = set(TestReport.objects.values_list('pk', flat=True))
+        try:
+            self.benchmark_urls(client, testrun, result, options, report)
+        finally:
+            TestReport.objects.exclude(pk__in=saved_reports).delete()
+
+        if options['ingest_testcases']:
+            report['ingest'] = self.benchmark_ingest(options['ingest_testcases'])
+
+        previous = self.get_previous(options['output'])
+        with open(options['output'], 'a') as output:
+            output.write(json.dumps(report, sort_keys=True) + "\n")
+
+        self.print_report(report, previous)
+
+    def benchmark_urls(self, client, testrun, result, options, report):
+        for name in url_names(charts.urls.urlpatterns):
+            if name in SKIPPED_URLS:
+                continue
+            if name not in URL_SAMPLES:
+                self.stderr.write("No sample for url '%s', add it to URL_SAMPLES" % name)
+                continue
+
+            url_args, query = URL_SAMPLES[name](testrun, result)
+            url = reverse('charts:' + name, args=url_args)
+            if query:
+                url += '?' + urlencode(sorted(query.items()))
+
+            timings = []
+            for i in range(options['repeat']):
+                if not options['warm']:
+                    cache.clear()
+                with QueryCounter() as queries:
+                    start = time.time()
+                    response = client.get(url)
+                    timings.append((time.time() - start) * 1000)
+
+                if response.status_code != 200:
+                    raise CommandError("%s returned %d" % (url, response.status_code))
+
+            timings.sort()
+            report['urls'][name] = {
+                'url' : url,
+                'median_ms' : timings[len(timings) // 2],
+                'min_ms' : timings[0],
+                'max_ms' : timings[-1],
+                'queries' : queries.count,
+                'bytes' : len(response.content),
+            }
+
+    def benchmark_ingest(self, testcases):
+        """ Times the import of a generated log as add_testrun.py does it, in
+            this process so that it uses the benchmark cache. The Test Run is
+            removed afterwards, and so is everything its import added or
+            changed. """
+
+        testplan, testplan_created = TestPlan.objects.get_or_create(
+            name=ingest.BSP_TESTPLAN, defaults={'product' : 'BSPs', 'product_version' : '1.0'})
+        planned = set(testplan.testcases.values_list('pk', flat=True))
+        last_testcase = TestCase.objects.aggregate(Max('pk'))['pk__max'] or 0
+        last_signature = FailureSignature.objects.aggregate(Max('pk'))['pk__max'] or 0
+        signature_dates = dict((row[0], row[1:]) for row in FailureSignature.objects.values_list(
+            'pk', 'occurrences', 'first_seen', 'last_seen'))
+        with connection.cursor() as cursor:
+            had_partition = partitions.is_supported() and partitions.partition_exists(cursor, INGEST_VERSION)
+
+        workdir = tempfile.mkdtemp()
+        try:
+            log = os.path.join(workdir, 'results.log')
+            dataset.write_log(log, testcases)
+
+            start = time.time()
+            ingest.add_testrun(log, {'version' : INGEST_VERSION, 'release' : INGEST_RELEASE, 'test_type' : 'Weekly',
+                                     'poky_commit' : INGEST_COMMIT, 'poky_branch' : 'master',
+                                     'start_date' : '2015-05-15 10:00:00', 'target' : 'genericx86',
+                                     'image_type' : 'core-image-sato', 'hw_arch' : 'x86', 'hw' : 'NUC'},
+                               out=open(os.devnull, 'w'))
+            elapsed = time.time() - start
+        finally:
+            shutil.rmtree(workdir)
+            for testrun in TestRun.objects.filter(release=INGEST_RELEASE):
+                rollups.remove_testrun(testrun)
+            TestCaseResult.objects.filter(testrun__release=INGEST_RELEASE).delete()
+            TestRun.objects.filter(release=INGEST_RELEASE).delete()
+            Job.objects.filter(key=INGEST_RELEASE).delete()
+
+            for row in FailureSignature.objects.filter(pk__in=signature_dates).values_list(
+                    'pk', 'occurrences', 'first_seen', 'last_seen'):
+                if row[1:] != signature_dates[row[0]]:
+                    FailureSignature.objects.filter(pk=row[0]).update(**dict(zip(
+                        ('occurrences', 'first_seen', 'last_seen'), signature_dates[row[0]])))
+            FailureSignature.objects.filter(pk__gt=last_signature, testcaseresult=None).delete()
+            TestPlan.testcases.through.objects.filter(testplan=testplan).exclude(testcase__in=planned).delete()
+            TestCase.objects.filter(pk__gt=last_testcase, testcaseresult=None).delete()
+            if testplan_created:
+                testplan.delete()
+                ingest._testplans.pop(ingest.BSP_TESTPLAN, None)
+            if partitions.is_supported() and not had_partition:
+                partitions.detach(INGEST_VERSION, drop=True)
+
+        return {
+            'testcases' : testcases,
+            'seconds' : elapsed,
+            'results_per_second' : testcases / elapsed,
+        }
+
+    def get_commit(self):
+        try:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                                           stderr=open(os.devnull, 'w')).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def get_previous(self, path):
+        """ Returns the last report stored in the results file, if any """
+
+        if not os.path.exists(path):
+            return None
+
+        previous = None
+        with open(path) as results:
+            for line in results:
+                if line.strip():
+                    previous = line
+        return json.loads(previous) if previous else None
+
+    def print_report(self, report, previous):
+        previous_urls = previous['urls'] if previous else {}
+
+        self.stdout.write("%-25s %10s %10s %8s %10s" % ('url', 'median ms', 'change', 'queries', 'change'))
+        for name, stats in sorted(report['urls'].items()):
+            before = previous_urls.get(name)
+            self.stdout.write("%-25s %10.1f %10s %8d %10s" % (
+                name, stats['median_ms'],
+                '%+.1f' % (stats['median_ms'] - before['median_ms']) if before else '',
+                stats['queries'],
+                '%+d' % (stats['queries'] - before['queries']) if before else ''))
+
+        if 'ingest' in report:
+            self.stdout.write("Ingestion: %d results in %.2f s (%.0f results/s)" % (
+                report['ingest']['testcases'], report['ingest']['seconds'], report['ingest']['results_per_second']))
+            if previous and 'ingest' in previous:
+                self.stdout.write("  previously %.2f s" % previous['ingest']['seconds'])
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from charts.models import Job
+from charts import jobs
+
+class Command(BaseCommand):
+    help = ("Runs the background jobs queued by imports and commands, highest priority first, retrying "
+            "the failed ones. Several workers can run at once. With --enqueue, queues a job instead.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', action='append', dest='kinds', choices=sorted(jobs.HANDLERS),
+                            help="Only run jobs of this kind, can be repeated")
+        parser.add_argument('--once', action='store_true', default=False,
+                            help="Exit once no job is left to run")
+        parser.add_argument('--poll-interval', type=float, default=jobs.POLL_INTERVAL,
+                            help="Seconds between checks for new jobs")
+        parser.add_argument('--enqueue', nargs='+', metavar=('KIND', 'KEY'),
+                            help="Queue a job of a kind, e.g. --enqueue warm_release 1.8_M1.rc1")
+        parser.add_argument('--list', action='store_true', default=False,
+                            help="List the queued, running and failed jobs")
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            kind, key = options['enqueue'][0], ' '.join(options['enqueue'][1:])
+            if kind not in jobs.HANDLERS:
+                raise CommandError("Unknown job kind %s, one of %s" % (kind, ', '.join(sorted(jobs.HANDLERS))))
+            job = jobs.enqueue(kind, key)
+            self.stdout.write("Queued job %d" % job.id)
+        elif options['list']:
+            for job in Job.objects.exclude(state=Job.DONE).order_by('state', '-priority', 'run_after'):
+                self.stdout.write("%d\t%s\t%s\t%s\tpriority %d\tattempt %d/%d\t%s" % (
+                    job.id, job.state, job.kind, job.key, job.priority, job.attempts, job.max_attempts,
+                    job.run_after.strftime('%Y-%m-%d %H:%M:%S')))
+        else:
+            try:
+                jobs.work(options['kinds'], options['poll_interval'], options['once'], log=self.stdout)
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,176 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Max, Sum
+from django.utils.http import urlencode
+import json
+import os
+import shutil
+import tempfile
+
+from charts.models import TestRun, TestCaseResult, ArchivedTestRun
+from charts import pagecache
+
+MANIFEST_DIR = '.manifest'
+
+class Command(BaseCommand):
+    help = ("Renders the pages of finished releases, and the data of the tables in them, into static files. "
+            "A page at <url> is written to <output><url>/index.html, page <n> of a table with <limit> rows "
+            "per page to <output><url>/<limit>-<n>.json and the whole table to <output><url>/all.json. "
+            "Releases are only rendered again when their data changed since the last snapshot. The "
+            "snapshot is written to a new directory, <output> being a symbolic link swapped to it once "
+            "it is complete, so that it is never served half-written.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('releases', nargs='+', metavar='release')
+        parser.add_argument('--output', default=settings.SNAPSHOT_ROOT,
+                            help="Directory the snapshots are written to (default: %s)" % settings.SNAPSHOT_ROOT)
+        parser.add_argument('--page-size', type=int, action='append', dest='page_sizes',
+                            help="Rows per table page to render, can be repeated (default: %d)" % pagecache.TABLE_DEFAULT_PARAMS['limit'])
+        parser.add_argument('--force', action='store_true', default=False,
+                            help="Render releases even if they didn't change")
+
+    def handle(self, *args, **options):
+        root = options['output'].rstrip('/')
+        page_sizes = options['page_sizes'] or [pagecache.TABLE_DEFAULT_PARAMS['limit']]
+
+        changed = []
+        for release in options['releases']:
+            fingerprint = self.get_fingerprint(release)
+            if fingerprint['testruns'] == 0:
+                raise CommandError("Release %s has no Test Runs" % release)
+
+            manifest = self.read_manifest(root, release)
+            if not options['force'] and manifest.get('fingerprint') == fingerprint:
+                self.stdout.write("%s: unchanged" % release)
+                continue
+            changed.append((release, fingerprint, manifest))
+
+        if not changed:
+            return
+
+        self.output = self.stage(root)
+        try:
+            for release, fingerprint, manifest in changed:
+                # Pages of runs the release doesn't have anymore, and table pages past its end
+                for path in manifest.get('files', []):
+                    if os.path.exists(os.path.join(self.output, path)):
+                        os.remove(os.path.join(self.output, path))
+
+                self.written = []
+                pages, tables = pagecache.release_urls(release)
+
+                for url in pages:
+                    self.write(os.path.join(url, 'index.html'), pagecache.render_url(url).content)
+
+                for url in tables:
+                    for limit in page_sizes:
+                        page = 1
+                        total = self.write_table(url, limit, page)
+                        while page * limit < total:
+                            page += 1
+                            self.write_table(url, limit, page)
+                    self.write_table(url, max(total, 1), 1, name='all.json')
+
+                self.write(os.path.join(MANIFEST_DIR, release + '.json'),
+                           json.dumps({'fingerprint' : fingerprint, 'files' : self.written}))
+                self.stdout.write("%s: %d pages and %d tables written" % (release, len(pages), len(tables)))
+
+            self.swap(root, self.output)
+        except:
+            shutil.rmtree(self.output)
+            raise
+
+    def get_fingerprint(self, release):
+        """ Summary of a release's data that changes whenever something is
+            ingested into it, counted again or archived. The data version
+            also catches the other writes, e.g. attached files. """
+
+        testruns = TestRun.objects.filter(release=release)
+        counts = testruns.aggregate(count=Count('id'), last=Max('id'), *[Sum(result) for result in TestRun.COUNTERS])
+        results = TestCaseResult.objects.filter(testrun__release=release).aggregate(count=Count('id'), last=Max('id'))
+
+        return dict(
+            ((result, counts[result + '__sum']) for result in TestRun.COUNTERS),
+            testruns=counts['count'],
+            last_testrun=counts['last'],
+            testcaseresults=results['count'],
+            last_testcaseresult=results['last'],
+            archived=ArchivedTestRun.objects.filter(testrun__release=release).count(),
+            data_version=pagecache.get_data_version(release),
+        )
+
+    def read_manifest(self, root, release):
+        """ Returns {'fingerprint': ..., 'files': [paths]} of the release's last snapshot, {} if there is none """
+
+        path = os.path.join(root, MANIFEST_DIR, release + '.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+        # Manifests of snapshots written in place only hold the fingerprint
+        return manifest if 'fingerprint' in manifest else {}
+
+    def stage(self, root):
+        """ Returns a new directory next to root holding the current snapshot,
+            its files being hard links to the current ones """
+
+        parent = os.path.dirname(os.path.abspath(root))
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        staged = tempfile.mkdtemp(prefix=os.path.basename(root) + '.', dir=parent)
+        os.chmod(staged, 0o755)
+
+        if os.path.isdir(root):
+            current = os.path.realpath(root)
+            for directory, dirnames, filenames in os.walk(current):
+                target = os.path.join(staged, os.path.relpath(directory, current))
+                if not os.path.isdir(target):
+                    os.makedirs(target)
+                for filename in filenames:
+                    if not filename.endswith('.tmp'):
+                        os.link(os.path.join(directory, filename), os.path.join(target, filename))
+        return staged
+
+    def swap(self, root, staged):
+        """ Points root to the staged directory and removes the previous one """
+
+        old = os.path.realpath(root) if os.path.islink(root) else None
+        if os.path.isdir(root) and old is None:
+            # Written in place by an older version, moved aside once
+            old = tempfile.mkdtemp(prefix=os.path.basename(root) + '.', dir=os.path.dirname(os.path.abspath(root)))
+            os.rmdir(old)
+            os.rename(root, old)
+
+        link = root + '.tmp'
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.basename(staged), link)
+        # Atomic, readers see either the old snapshot or the new one
+        os.rename(link, root)
+
+        if old is not None and old != staged:
+            shutil.rmtree(old)
+
+    def write_table(self, url, limit, page, name=None):
+        """ Writes one page of a table, returns the total number of rows """
+
+        query = dict(pagecache.TABLE_DEFAULT_PARAMS, limit=limit, page=page)
+        content = pagecache.render_url(url + '?' + urlencode(sorted(query.items()))).content
+        self.write(os.path.join(url, name or '%d-%d.json' % (limit, page)), content)
+
+        return json.loads(content)['total']
+
+    def write(self, path, content):
+        """ Replaces the file at path, relative to the output directory. The
+            file may be a hard link to one of the snapshot being served, it
+            is replaced rather than written to. """
+
+        path = path.lstrip('/')
+        self.written.append(path)
+        path = os.path.join(self.output, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(path + '.tmp', 'wb') as tmp_file:
+            tmp_file.write(content)
+        os.rename(path + '.tmp', path)
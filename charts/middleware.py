@@ -0,0 +1,158 @@
+from django.conf import settings
+from django.db import connections
+import collections
+import logging
+import re
+import threading
+import time
+
+from . import routers
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, the last bucket takes everything above
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Literals are replaced so that queries differing only by their parameters,
+# e.g. the same lookup run for every row of a table, share one template
+SQL_LITERALS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(\.\d+)?\b'), '?'),
+    (re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)'), '(...)'),
+)
+
+def query_template(sql):
+    for pattern, replacement in SQL_LITERALS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+def _histogram(buckets):
+    histogram = collections.OrderedDict((str(bound), 0) for bound in buckets)
+    histogram['+inf'] = 0
+    return histogram
+
+def _bucket(buckets, value):
+    for bound in buckets:
+        if value <= bound:
+            return str(bound)
+    return '+inf'
+
+class ViewStats(object):
+    """ Aggregated measurements of all the requests served by one view """
+
+    def __init__(self):
+        self.requests = 0
+        self.total_ms = self.max_ms = 0.0
+        self.queries = self.max_queries = 0
+        self.sql_ms = 0.0
+        self.latency_histogram = _histogram(LATENCY_BUCKETS_MS)
+        self.queries_histogram = _histogram(QUERY_COUNT_BUCKETS)
+        self.worst_repeated = {'template' : None, 'count' : 0}
+
+    def add(self, wall_ms, queries, sql_ms, repeated_template, repeated_count):
+        self.requests += 1
+        self.total_ms += wall_ms
+        self.max_ms = max(self.max_ms, wall_ms)
+        self.queries += queries
+        self.max_queries = max(self.max_queries, queries)
+        self.sql_ms += sql_ms
+        self.latency_histogram[_bucket(LATENCY_BUCKETS_MS, wall_ms)] += 1
+        self.queries_histogram[_bucket(QUERY_COUNT_BUCKETS, queries)] += 1
+        if repeated_count > self.worst_repeated['count']:
+            self.worst_repeated = {'template' : repeated_template, 'count' : repeated_count}
+
+    def as_dict(self):
+        return {
+            'requests' : self.requests,
+            'avg_ms' : self.total_ms / self.requests,
+            'max_ms' : self.max_ms,
+            'avg_queries' : self.queries / float(self.requests),
+            'max_queries' : self.max_queries,
+            'avg_sql_ms' : self.sql_ms / self.requests,
+            'latency_histogram_ms' : self.latency_histogram,
+            'queries_histogram' : self.queries_histogram,
+            'most_repeated_query' : self.worst_repeated,
+        }
+
+# Stats are kept per process, each worker of the web server has its own
+_stats = collections.defaultdict(ViewStats)
+_stats_lock = threading.Lock()
+
+def get_stats():
+    with _stats_lock:
+        return collections.OrderedDict((view, stats.as_dict()) for view, stats in sorted(_stats.items()))
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+class QueryStatsMiddleware(object):
+    """ Records the wall time, the number and time of SQL queries, and the
+        most repeated query of every request, aggregated per view.
+
+        Requests slower than QUERYSTATS_SLOW_REQUEST_MS, or running more
+        queries than QUERYSTATS_SLOW_REQUEST_QUERIES, are logged as warnings.
+    """
+
+    def process_request(self, request):
+        # Queries are only recorded by debug cursors, the log itself is
+        # emptied by Django when each request starts
+        request._querystats_debug_cursors = []
+        for connection in connections.all():
+            request._querystats_debug_cursors.append((connection, connection.force_debug_cursor))
+            connection.force_debug_cursor = True
+
+        request._querystats_view = 'unresolved'
+        request._querystats_start = time.time()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.resolver_match:
+            request._querystats_view = request.resolver_match.view_name
+
+    def process_response(self, request, response):
+        if not hasattr(request, '_querystats_start'):
+            return response
+
+        wall_ms = (time.time() - request._querystats_start) * 1000
+
+        queries = []
+        for connection, force_debug_cursor in request._querystats_debug_cursors:
+            queries.extend(connection.queries_log)
+            connection.force_debug_cursor = force_debug_cursor
+
+        sql_ms = sum(float(query['time']) for query in queries) * 1000
+        templates = collections.Counter(query_template(query['sql']) for query in queries)
+        repeated_template, repeated_count = templates.most_common(1)[0] if templates else (None, 0)
+
+        with _stats_lock:
+            _stats[request._querystats_view].add(wall_ms, len(queries), sql_ms, repeated_template, repeated_count)
+
+        slow_ms = getattr(settings, 'QUERYSTATS_SLOW_REQUEST_MS', None)
+        slow_queries = getattr(settings, 'QUERYSTATS_SLOW_REQUEST_QUERIES', None)
+        if (slow_ms is not None and wall_ms > slow_ms) or (slow_queries is not None and len(queries) > slow_queries):
+            logger.warning("Slow request %s (%s): %.0f ms, %d queries taking %.0f ms, most repeated (%dx): %s",
+                           request.get_full_path(), request._querystats_view, wall_ms, len(queries), sql_ms,
+                           repeated_count, repeated_template)
+
+        return response
+
+class ReportingDatabaseMiddleware(object):
+    """ Reads the data of GET requests from the reporting database, see
+        charts.routers. Clients sending other requests read from the default
+        database for the next REPORTING_DATABASE_LAG seconds, so that they
+        see what they wrote. """
+
+    STICKY_COOKIE = 'read_primary'
+
+    def process_request(self, request):
+        routers.read_from_reporting(request.method in ('GET', 'HEAD') and self.STICKY_COOKIE not in request.COOKIES)
+
+    def process_response(self, request, response):
+        routers.read_from_reporting(False)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and routers.is_configured():
+            response.set_cookie(self.STICKY_COOKIE, '1', max_age=settings.REPORTING_DATABASE_LAG)
+        return response
+
+    def process_exception(self, request, exception):
+        routers.read_from_reporting(False)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FailureSignature',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('signature', models.CharField(unique=True, max_length=40)),
+                ('summary', models.CharField(max_length=255, blank=True)),
+                ('occurrences', models.PositiveIntegerField(default=0)),
+                ('first_seen', models.DateTimeField(null=True, blank=True)),
+                ('last_seen', models.DateTimeField(null=True, blank=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='testcaseresult',
+            name='signature',
+            field=models.ForeignKey(blank=True, to='charts.FailureSignature', null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0002_failuresignature'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultRollup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('bucket', models.CharField(max_length=4, choices=[(b'day', b'day'), (b'week', b'week')])),
+                ('bucket_start', models.DateField()),
+                ('version', models.CharField(max_length=10, blank=True)),
+                ('release', models.CharField(max_length=30, blank=True)),
+                ('target', models.CharField(max_length=30, blank=True)),
+                ('hw', models.CharField(max_length=30, blank=True)),
+                ('result', models.CharField(max_length=7, choices=[(b'passed', b'passed'), (b'failed', b'failed'), (b'blocked', b'blocked'), (b'idle', b'idle')])),
+                ('count', models.IntegerField(default=0)),
+                ('testplan', models.ForeignKey(to='charts.TestPlan')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='resultrollup',
+            unique_together=set([('bucket', 'bucket_start', 'version', 'release', 'testplan', 'target', 'hw', 'result')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='resultrollup',
+            index_together=set([('bucket', 'version', 'bucket_start')]),
+        ),
+    ]
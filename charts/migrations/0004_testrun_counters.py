@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_counters(apps, schema_editor):
+    TestRun = apps.get_model('charts', 'TestRun')
+    TestCaseResult = apps.get_model('charts', 'TestCaseResult')
+
+    counts = {}
+    for testrun, result, count in (TestCaseResult.objects.order_by().values_list('testrun', 'result')
+                                   .annotate(models.Count('id'))):
+        counts.setdefault(testrun, {})[result] = count
+
+    for testrun, testrun_counts in counts.items():
+        TestRun.objects.filter(pk=testrun).update(**dict(
+            (result, testrun_counts.get(result, 0)) for result in ('passed', 'failed', 'blocked', 'idle')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0003_resultrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTestRun',
+            fields=[
+                ('testrun', models.OneToOneField(primary_key=True, serialize=False, to='charts.TestRun')),
+                ('results', models.BinaryField()),
+                ('first_result_id', models.IntegerField()),
+                ('last_result_id', models.IntegerField()),
+                ('archived_on', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='testrun',
+            name='blocked',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='testrun',
+            name='failed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='testrun',
+            name='idle',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='testrun',
+            name='passed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_version(apps, schema_editor):
+    TestRun = apps.get_model('charts', 'TestRun')
+    TestCaseResult = apps.get_model('charts', 'TestCaseResult')
+
+    # One statement per version rather than per result
+    for version in TestRun.objects.order_by().values_list('version', flat=True).distinct():
+        TestCaseResult.objects.filter(testrun__version=version).update(version=version)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0004_testrun_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testcaseresult',
+            name='version',
+            field=models.CharField(db_index=True, max_length=10, blank=True),
+        ),
+        migrations.RunPython(fill_version, migrations.RunPython.noop),
+    ]
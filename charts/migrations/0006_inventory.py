@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0005_testcaseresult_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryItem',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(max_length=100)),
+                ('version', models.CharField(max_length=100, blank=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InventorySnapshot',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('kind', models.CharField(max_length=8, choices=[(b'packages', b'packages'), (b'services', b'services')])),
+                ('digest', models.CharField(unique=True, max_length=40)),
+                ('size', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='inventoryitem',
+            name='snapshot',
+            field=models.ForeignKey(to='charts.InventorySnapshot'),
+        ),
+        migrations.AddField(
+            model_name='testrun',
+            name='packages',
+            field=models.ForeignKey(related_name='+', blank=True, to='charts.InventorySnapshot', null=True),
+        ),
+        migrations.AddField(
+            model_name='testrun',
+            name='services',
+            field=models.ForeignKey(related_name='+', blank=True, to='charts.InventorySnapshot', null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='inventoryitem',
+            unique_together=set([('snapshot', 'name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='inventoryitem',
+            index_together=set([('name', 'version')]),
+        ),
+    ]
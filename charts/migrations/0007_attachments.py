@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0006_inventory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Attachment',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('digest', models.CharField(unique=True, max_length=64)),
+                ('size', models.BigIntegerField()),
+                ('content_type', models.CharField(max_length=100)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TestCaseAttachment',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('testcase_id', models.CharField(max_length=40, blank=True)),
+                ('name', models.CharField(max_length=255)),
+                ('attachment', models.ForeignKey(to='charts.Attachment')),
+                ('testrun', models.ForeignKey(to='charts.TestRun')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='testcaseattachment',
+            unique_together=set([('testrun', 'testcase_id', 'name')]),
+        ),
+    ]
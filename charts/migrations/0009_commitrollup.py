@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0008_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommitRollup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('poky_commit', models.CharField(max_length=100)),
+                ('poky_branch', models.CharField(max_length=15)),
+                ('target', models.CharField(max_length=30, blank=True)),
+                ('hw', models.CharField(max_length=30, blank=True)),
+                ('result', models.CharField(max_length=7, choices=[(b'passed', b'passed'), (b'failed', b'failed'), (b'blocked', b'blocked'), (b'idle', b'idle')])),
+                ('count', models.IntegerField(default=0)),
+                ('first_seen', models.DateTimeField()),
+                ('testplan', models.ForeignKey(to='charts.TestPlan')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='testcaseresult',
+            index_together=set([('testcase_id', 'testrun')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='commitrollup',
+            unique_together=set([('poky_commit', 'poky_branch', 'testplan', 'target', 'hw', 'result')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='commitrollup',
+            index_together=set([('testplan', 'target', 'hw', 'first_seen')]),
+        ),
+    ]
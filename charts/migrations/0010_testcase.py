@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.utils import timezone
+import collections
+import json
+import zlib
+
+
+def archives(ArchivedTestRun):
+    """ Yields the archived Test Runs one at a time, they can be big """
+
+    for pk in list(ArchivedTestRun.objects.order_by('pk').values_list('pk', flat=True)):
+        yield ArchivedTestRun.objects.select_related('testrun').get(pk=pk)
+
+
+def archived_rows(archived):
+    data = zlib.decompress(bytes(archived.results))
+    return [json.loads(line) for line in data.split("\n")] if data else []
+
+
+def fill_catalog(apps, schema_editor):
+    TestCase = apps.get_model('charts', 'TestCase')
+    TestPlan = apps.get_model('charts', 'TestPlan')
+    TestRun = apps.get_model('charts', 'TestRun')
+    TestCaseResult = apps.get_model('charts', 'TestCaseResult')
+    ArchivedTestRun = apps.get_model('charts', 'ArchivedTestRun')
+    Job = apps.get_model('charts', 'Job')
+
+    names = set(TestCaseResult.objects.order_by().values_list('testcase_id', flat=True).distinct())
+    for archived in archives(ArchivedTestRun):
+        names.update(row['testcase_id'] for row in archived_rows(archived))
+
+    TestCase.objects.bulk_create([TestCase(name=name) for name in sorted(names)])
+    ids = dict(TestCase.objects.values_list('name', 'id'))
+
+    # One statement per test case rather than per result
+    for name, id in ids.items():
+        TestCaseResult.objects.filter(testcase_id=name).update(case=id)
+
+    # Test Plans plan the test cases their runs have idle results for, which
+    # are then counted as the planned test cases a run has no result for.
+    idle = TestCaseResult.objects.filter(result='idle')
+    planned = set(idle.order_by().values_list('testrun__testplan', 'case').distinct())
+    idle.delete()
+    archived_cases = {}
+    for archived in archives(ArchivedTestRun):
+        rows = archived_rows(archived)
+        planned.update((archived.testrun.testplan_id, ids[row['testcase_id']]) for row in rows if row['result'] == 'idle')
+        rows = [dict(row, testcase_id=ids[row['testcase_id']]) for row in rows if row['result'] != 'idle']
+        archived_cases[archived.testrun_id] = set(row['testcase_id'] for row in rows)
+        ArchivedTestRun.objects.filter(pk=archived.pk).update(results=zlib.compress(
+            "\n".join(json.dumps(row, sort_keys=True) for row in rows), 9))
+
+    TestPlan.testcases.through.objects.bulk_create(
+        [TestPlan.testcases.through(testplan_id=testplan, testcase_id=testcase) for testplan, testcase in planned])
+
+    # Plans are shared by all the targets and machines they run on, so a test
+    # case idle on one is now idle on the plan's other runs without a result
+    # for it too: recount, and have run_jobs rebuild the rollups.
+    planned_by = collections.defaultdict(set)
+    for testplan, testcase in planned:
+        planned_by[testplan].add(testcase)
+    recounted = 0
+    for testrun_id, testplan, count in TestRun.objects.filter(testplan__in=planned_by).values_list('id', 'testplan', 'idle'):
+        cases = archived_cases.get(testrun_id)
+        if cases is None:
+            cases = set(TestCaseResult.objects.filter(testrun=testrun_id).values_list('case', flat=True))
+        idle = len(planned_by[testplan] - cases)
+        if idle != count:
+            TestRun.objects.filter(pk=testrun_id).update(idle=idle)
+            recounted += 1
+    if recounted and not Job.objects.filter(dedupe_key='rebuild_rollups:').exists():
+        Job.objects.create(kind='rebuild_rollups', dedupe_key='rebuild_rollups:', run_after=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0009_commitrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestCase',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(unique=True, max_length=255)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='testplan',
+            name='testcases',
+            field=models.ManyToManyField(related_name='testplans', to='charts.TestCase', blank=True),
+        ),
+        migrations.AddField(
+            model_name='testcaseresult',
+            name='case',
+            field=models.ForeignKey(to='charts.TestCase', null=True),
+        ),
+        migrations.RunPython(fill_catalog),
+        migrations.AlterIndexTogether(
+            name='testcaseresult',
+            index_together=set([]),
+        ),
+        migrations.RemoveField(
+            model_name='testcaseresult',
+            name='testcase_id',
+        ),
+        migrations.RenameField(
+            model_name='testcaseresult',
+            old_name='case',
+            new_name='testcase',
+        ),
+        migrations.AlterField(
+            model_name='testcaseresult',
+            name='testcase',
+            field=models.ForeignKey(to='charts.TestCase'),
+        ),
+        migrations.AlterIndexTogether(
+            name='testcaseresult',
+            index_together=set([('testcase', 'testrun')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0010_testcase'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestReportRun',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('start_date', models.DateTimeField()),
+                ('passed', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('blocked', models.PositiveIntegerField(default=0)),
+                ('idle', models.PositiveIntegerField(default=0)),
+                ('testreport', models.ForeignKey(to='charts.TestReport')),
+                ('testrun', models.ForeignKey(to='charts.TestRun')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='testreportrun',
+            unique_together=set([('testreport', 'testrun')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='testreportrun',
+            index_together=set([('testreport', 'start_date')]),
+        ),
+    ]
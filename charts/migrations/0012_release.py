@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+import re
+
+
+def sort_key(name):
+    return re.sub(r'\d+', lambda match: match.group(0).zfill(8), name)
+
+
+def fill_catalog(apps, schema_editor):
+    TestRun = apps.get_model('charts', 'TestRun')
+    Version = apps.get_model('charts', 'Version')
+    Release = apps.get_model('charts', 'Release')
+
+    counters = ('passed', 'failed', 'blocked', 'idle')
+    releases = {}
+    for row in (TestRun.objects.values_list('version', 'release')
+                .annotate(Min('start_date'), Max('start_date'), Count('id'), *[Sum(result) for result in counters])
+                .order_by('start_date__min', 'version')):
+        version, name, first_run, last_run, testruns = row[:5]
+        if name in releases:
+            # Under several versions, the release belongs to the one it was first run for
+            release = releases[name]
+            release['first_run'], release['last_run'] = min(release['first_run'], first_run), max(release['last_run'], last_run)
+            release['testruns'] += testruns
+            for result, count in zip(counters, row[5:]):
+                release[result] += count or 0
+        else:
+            releases[name] = dict(zip(counters, [count or 0 for count in row[5:]]), version=version, first_run=first_run,
+                                  last_run=last_run, testruns=testruns)
+
+    versions = {}
+    for release in releases.values():
+        if release['version'] not in versions:
+            versions[release['version']] = Version.objects.create(
+                name=release['version'], sort_key=sort_key(release['version']), first_run=release['first_run'],
+                last_run=release['last_run'])
+        version = versions[release['version']]
+        version.first_run, version.last_run = min(version.first_run, release['first_run']), max(version.last_run, release['last_run'])
+    for version in versions.values():
+        version.save()
+
+    Release.objects.bulk_create([Release(name=name, sort_key=sort_key(name), version=versions[release.pop('version')], **release)
+                                 for name, release in releases.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0011_testreportrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Release',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(unique=True, max_length=30)),
+                ('sort_key', models.CharField(max_length=255, db_index=True)),
+                ('first_run', models.DateTimeField()),
+                ('last_run', models.DateTimeField()),
+                ('testruns', models.IntegerField(default=0)),
+                ('passed', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('blocked', models.IntegerField(default=0)),
+                ('idle', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Version',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(unique=True, max_length=10)),
+                ('sort_key', models.CharField(max_length=255, db_index=True)),
+                ('first_run', models.DateTimeField()),
+                ('last_run', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='release',
+            name='version',
+            field=models.ForeignKey(to='charts.Version'),
+        ),
+        migrations.RunPython(fill_catalog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.utils.six.moves.urllib.parse import parse_qsl
+import hashlib
+import json
+
+FIELDS = ('testplan', 'release', 'test_type', 'poky_commit', 'target', 'image_type', 'hw_arch', 'hw', 'from', 'to')
+
+
+def parse_filters(text):
+    """ The filters of a report saved as JSON or as a query string, None if there are none """
+
+    try:
+        filters = json.loads(text)
+    except ValueError:
+        filters = dict(parse_qsl(text.lstrip('?')))
+    if not isinstance(filters, dict):
+        return None
+    return dict((field, '%s' % filters[field]) for field in FIELDS if filters.get(field)) or None
+
+
+def fill_digests(apps, schema_editor):
+    TestReport = apps.get_model('charts', 'TestReport')
+
+    digests = set()
+    for testreport in TestReport.objects.order_by('pk'):
+        filters = parse_filters(testreport.filters)
+        if filters is None:
+            testreport.delete()
+            continue
+        testreport.filters = json.dumps(filters, sort_keys=True)
+        testreport.digest = hashlib.sha1(testreport.filters.encode('utf-8')).hexdigest()
+        if testreport.digest in digests:
+            # The same query saved twice
+            testreport.delete()
+            continue
+        digests.add(testreport.digest)
+        testreport.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0012_release'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testreport',
+            name='digest',
+            field=models.CharField(max_length=40, null=True),
+        ),
+        migrations.RunPython(fill_digests, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0013_testreport_digest'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='testreport',
+            name='digest',
+            field=models.CharField(unique=True, max_length=40),
+        ),
+    ]
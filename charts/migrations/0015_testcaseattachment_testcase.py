@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def link_testcases(apps, schema_editor):
+    TestCase = apps.get_model('charts', 'TestCase')
+    TestCaseResult = apps.get_model('charts', 'TestCaseResult')
+    TestCaseAttachment = apps.get_model('charts', 'TestCaseAttachment')
+
+    for name in (TestCaseAttachment.objects.exclude(testcase_name='').order_by()
+                 .values_list('testcase_name', flat=True).distinct()):
+        attached = TestCaseAttachment.objects.filter(testcase_name=name)
+        testcase = TestCase.objects.filter(name=name).first()
+        if testcase is not None:
+            attached.update(testcase=testcase)
+            continue
+
+        # Directory names were stored lower case, whatever the case of the test case
+        candidates = list(TestCase.objects.filter(name__iexact=name).order_by('pk').values_list('pk', flat=True))
+        if not candidates:
+            attached.update(testcase=TestCase.objects.create(name=name))
+            continue
+
+        # The test case the run has a result for, when several only differ by their case
+        ran = dict(TestCaseResult.objects.filter(testrun__in=attached.values('testrun'), testcase__in=candidates)
+                   .order_by().values_list('testrun', 'testcase').distinct())
+        for testrun_id in set(attached.values_list('testrun', flat=True)):
+            attached.filter(testrun=testrun_id).update(testcase=ran.get(testrun_id, candidates[0]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0014_testreport_digest_unique'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='testcaseattachment',
+            unique_together=set([]),
+        ),
+        migrations.RenameField(
+            model_name='testcaseattachment',
+            old_name='testcase_id',
+            new_name='testcase_name',
+        ),
+        migrations.AddField(
+            model_name='testcaseattachment',
+            name='testcase',
+            field=models.ForeignKey(blank=True, to='charts.TestCase', null=True),
+        ),
+        migrations.RunPython(link_testcases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0015_testcaseattachment_testcase'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='testcaseattachment',
+            name='testcase_name',
+        ),
+        migrations.AlterUniqueTogether(
+            name='testcaseattachment',
+            unique_together=set([('testrun', 'testcase', 'name')]),
+        ),
+    ]
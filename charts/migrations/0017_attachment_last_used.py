@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def fill_last_used(apps, schema_editor):
+    Attachment = apps.get_model('charts', 'Attachment')
+    Attachment.objects.update(last_used=models.F('created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('charts', '0016_remove_testcaseattachment_testcase_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='last_used',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(fill_last_used, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,46 @@
 from django.db import models
 from django.forms import ModelForm
+from django.utils import timezone
+import collections
+import json
+
+def percentage(part, whole):
+    """ Formats part/whole as a percentage, without trailing zeros """
+    if not whole:
+        return "0"
+    return ("%.2f" % ((part / float(whole)) * 100)).rstrip('0').rstrip('.')
+
+def count_results(testcaseresults, *group_by):
+    """ Returns the number of results per status of each group_by value, a
+        tuple of values when grouping by several fields, in one query.
+    """
+    counts = collections.defaultdict(dict)
+    for row in testcaseresults.order_by().values_list(*(group_by + ('result',))).annotate(models.Count('id')):
+        group = row[0] if len(group_by) == 1 else tuple(row[:-2])
+        counts[group][row[-2]] = row[-1]
+    return counts
+
+def sum_counts(testruns, *group_by):
+    """ Like count_results, from the counters of the Test Runs. Without
+        group_by, returns the counts of all the Test Runs. """
+    sums = [models.Sum(result) for result in TestRun.COUNTERS]
+    if not group_by:
+        total = testruns.order_by().aggregate(*sums)
+        return dict((result, total[result + '__sum'] or 0) for result in TestRun.COUNTERS)
+
+    counts = {}
+    for row in testruns.order_by().values_list(*group_by).annotate(*sums):
+        group = row[0] if len(group_by) == 1 else tuple(row[:len(group_by)])
+        counts[group] = dict(zip(TestRun.COUNTERS, row[len(group_by):]))
+    return counts
+
+class TestCase(models.Model):
+    """ A test case of the catalog, see charts/catalog.py """
+
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.name
 
 class TestPlan(models.Model):
     name = models.CharField(max_length=30)
@@ -9,10 +50,40 @@ class TestPlan(models.Model):
     author = models.CharField(max_length=100, blank=True)
     version = models.CharField(max_length=10, blank=True)
     plan_type = models.CharField(max_length=30, blank=True)
+    # Test cases a Test Run of the plan should run, those it has no result for are idle
+    testcases = models.ManyToManyField(TestCase, blank=True, related_name='testplans')
 
     def __str__(self):
         return self.name + " version: " + self.product_version
 
+class InventorySnapshot(models.Model):
+    """ A package or service list shared by all the Test Runs it was found
+        on, see charts/inventory.py """
+
+    KIND_CHOICES = (
+        ('packages', 'packages'),
+        ('services', 'services')
+    )
+
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    digest = models.CharField(max_length=40, unique=True)
+    size = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return "%s %s (%d)" % (self.kind, self.digest[:10], self.size)
+
+class InventoryItem(models.Model):
+    snapshot = models.ForeignKey(InventorySnapshot)
+    name = models.CharField(max_length=100)
+    version = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        unique_together = ('snapshot', 'name')
+        index_together = (('name', 'version'),)
+
+    def __str__(self):
+        return self.name + " " + self.version
+
 class TestRun(models.Model):
 
     TYPE_CHOICES = (
@@ -39,43 +110,80 @@ class TestRun(models.Model):
     ab_image_repo = models.CharField(max_length=100, blank=True)
     services_running = models.CharField(max_length=10000, blank=True)
     package_versions_installed = models.CharField(max_length=20000, blank=True)
+    # The two lists above, parsed and deduplicated
+    packages = models.ForeignKey(InventorySnapshot, null=True, blank=True, related_name='+')
+    services = models.ForeignKey(InventorySnapshot, null=True, blank=True, related_name='+')
+
+    # Number of results per status, kept when the results are archived
+    passed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    blocked = models.PositiveIntegerField(default=0)
+    idle = models.PositiveIntegerField(default=0)
+
+    COUNTERS = ('passed', 'failed', 'blocked', 'idle')
+
+    def get_counts(self):
+        return dict((result, getattr(self, result)) for result in self.COUNTERS)
+
+    def update_counts(self):
+        """ Sets the counters from the Test Case Results, once they are all
+            saved. Planned test cases without a result are idle. """
+        counts = count_results(self.testcaseresult_set.all(), 'testrun')[self.id]
+        counts['idle'] = self.get_missing().count()
+        for result in self.COUNTERS:
+            setattr(self, result, counts.get(result, 0))
+        self.save(update_fields=self.COUNTERS)
+
+    def get_missing(self):
+        """ Test cases planned by the Test Plan that the run has no result for """
+        return TestCase.objects.filter(testplans=self.testplan_id).exclude(pk__in=self.testcaseresult_set.values('testcase'))
 
     def get_for_plan_env(self):
         return TestRun.objects.filter(release=self.release).filter(testplan=self.testplan, target=self.target, hw=self.hw)
 
+    def get_plan_env_run_ids(self):
+        if not hasattr(self, '_plan_env_run_ids'):
+            self._plan_env_run_ids = list(self.get_for_plan_env().order_by('id').values_list('id', flat=True))
+        return self._plan_env_run_ids
+
+    def get_plan_env_counts(self):
+        """ Number of results per status in all Test Runs of the plan-environment.
+            Tables set _plan_env_counts for a whole page of rows at once. """
+        if not hasattr(self, '_plan_env_counts'):
+            self._plan_env_counts = sum_counts(self.get_for_plan_env())
+        return self._plan_env_counts
+
     def get_total(self):
-        total = 0
-        for testrun in self.get_for_plan_env():
-            total += testrun.testcaseresult_set.count()
-        return total
+        return sum(self.get_plan_env_counts().values())
 
     def get_run(self):
-        run = 0
-        for testrun in self.get_for_plan_env():
-            run += testrun.testcaseresult_set.filter(~models.Q(result='idle')).count()
-        return run
+        return self.get_total() - self.get_plan_env_counts().get('idle', 0)
 
     def get_passed(self):
-        passed = 0
-        for testrun in self.get_for_plan_env():
-            passed += testrun.testcaseresult_set.filter(result='passed').count()
-        return passed
+        return self.get_plan_env_counts().get('passed', 0)
 
     def get_failed(self):
-        failed = 0
-        for testrun in self.get_for_plan_env():
-            failed += testrun.testcaseresult_set.filter(result='failed').count()
-        return failed
+        return self.get_plan_env_counts().get('failed', 0)
 
     def get_abs_passed_percentage(self):
-        return ("%.2f" % ((self.get_passed() / float(self.get_total())) * 100)).rstrip('0').rstrip('.')
+        return percentage(self.get_passed(), self.get_total())
 
     def get_relative_passed_percentage(self):
-        return ("%.2f" % ((self.get_passed() / float(self.get_run())) * 100)).rstrip('0').rstrip('.')
+        return percentage(self.get_passed(), self.get_run())
 
     def __str__(self):
         return self.id.__str__() + " " + self.test_type + " " + self.release
 
+class FailureSignature(models.Model):
+    signature = models.CharField(max_length=40, unique=True)
+    summary = models.CharField(max_length=255, blank=True)
+    occurrences = models.PositiveIntegerField(default=0)
+    first_seen = models.DateTimeField(null=True, blank=True)
+    last_seen = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.signature[:10] + " " + self.summary
+
 class TestCaseResult(models.Model):
     RESULT_CHOICES = (
         ('passed', 'passed'),
@@ -84,8 +192,10 @@ class TestCaseResult(models.Model):
         ('idle', 'idle')
     )
 
-    testcase_id = models.CharField(max_length=40)
+    testcase = models.ForeignKey(TestCase)
     testrun = models.ForeignKey(TestRun)
+    # Version of the Test Run, the partition key, see charts/partitions.py
+    version = models.CharField(max_length=10, blank=True, db_index=True)
 
     result = models.CharField(max_length=7, choices=RESULT_CHOICES)
     message = models.CharField(max_length=30000, blank=True)
@@ -93,17 +203,213 @@ class TestCaseResult(models.Model):
     finished_on = models.DateTimeField(null=True, blank=True)
     attachments = models.CharField(max_length=1000, blank=True)
     comments = models.CharField(max_length=1000, blank=True)
+    signature = models.ForeignKey(FailureSignature, null=True, blank=True)
+
+    class Meta:
+        # History of a test case, see charts/commits.py
+        index_together = (('testcase', 'testrun'),)
+
+    def __str__(self):
+        return self.testcase.name + " is " + self.result
+
+class Attachment(models.Model):
+    """ A file stored under ATTACHMENT_ROOT, see charts/attachments.py """
+
+    digest = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=100)
+    created = models.DateTimeField(auto_now_add=True)
+    # Last time it was stored or attached, unused files are pruned a while after
+    last_used = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return "%s (%d bytes)" % (self.digest[:10], self.size)
+
+class TestCaseAttachment(models.Model):
+    """ A file attached to a Test Run, or to one of its Test Cases. Linked to
+        the test case rather than to the Test Case Result, which may be
+        archived. """
+
+    testrun = models.ForeignKey(TestRun)
+    # None for the files of the whole run
+    testcase = models.ForeignKey(TestCase, null=True, blank=True)
+    name = models.CharField(max_length=255)
+    attachment = models.ForeignKey(Attachment)
+
+    class Meta:
+        unique_together = ('testrun', 'testcase', 'name')
+
+    def __str__(self):
+        return self.name
+
+class ResultRollup(models.Model):
+    """ Number of Test Case Results with a status, over the Test Runs of a
+        plan-environment started in a day or a week. See charts/rollups.py. """
+
+    BUCKET_CHOICES = (
+        ('day', 'day'),
+        ('week', 'week')
+    )
+
+    bucket = models.CharField(max_length=4, choices=BUCKET_CHOICES)
+    bucket_start = models.DateField()
+
+    version = models.CharField(max_length=10, blank=True)
+    release = models.CharField(max_length=30, blank=True)
+    testplan = models.ForeignKey(TestPlan)
+    target = models.CharField(max_length=30, blank=True)
+    hw = models.CharField(max_length=30, blank=True)
+    result = models.CharField(max_length=7, choices=TestCaseResult.RESULT_CHOICES)
+
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('bucket', 'bucket_start', 'version', 'release', 'testplan', 'target', 'hw', 'result')
+        index_together = (('bucket', 'version', 'bucket_start'),)
+
+    def __str__(self):
+        return "%s %s %s: %d %s" % (self.bucket, self.bucket_start, self.release, self.count, self.result)
+
+class CommitRollup(models.Model):
+    """ Number of Test Case Results with a status, over the Test Runs of a
+        plan-environment on a poky commit. See charts/rollups.py. """
+
+    poky_commit = models.CharField(max_length=100)
+    poky_branch = models.CharField(max_length=15)
+    testplan = models.ForeignKey(TestPlan)
+    target = models.CharField(max_length=30, blank=True)
+    hw = models.CharField(max_length=30, blank=True)
+    result = models.CharField(max_length=7, choices=TestCaseResult.RESULT_CHOICES)
+
+    count = models.IntegerField(default=0)
+    # Start of the first Test Run of the commit in the plan-environment, commits are ordered by it
+    first_seen = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('poky_commit', 'poky_branch', 'testplan', 'target', 'hw', 'result')
+        index_together = (('testplan', 'target', 'hw', 'first_seen'),)
+
+    def __str__(self):
+        return "%s %s: %d %s" % (self.poky_commit[:10], self.hw, self.count, self.result)
+
+class Version(models.Model):
+    """ A version Test Runs were run for. See charts/releases.py. """
+
+    name = models.CharField(max_length=10, unique=True)
+    # Orders versions by their numbers
+    sort_key = models.CharField(max_length=255, db_index=True)
+    first_run = models.DateTimeField()
+    last_run = models.DateTimeField()
 
     def __str__(self):
-        return self.testcase_id + " is " + self.result
+        return self.name
+
+class Release(models.Model):
+    """ A release Test Runs were run for, with their result counts. See
+        charts/releases.py. """
+
+    name = models.CharField(max_length=30, unique=True)
+    version = models.ForeignKey(Version)
+    sort_key = models.CharField(max_length=255, db_index=True)
+    first_run = models.DateTimeField()
+    last_run = models.DateTimeField()
+
+    testruns = models.IntegerField(default=0)
+    passed = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    blocked = models.IntegerField(default=0)
+    idle = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+    def get_counts(self):
+        return dict((result, getattr(self, result)) for result in TestRun.COUNTERS)
+
+class ArchivedTestRun(models.Model):
+    """ Test Case Results of an archived Test Run, see charts/archive.py """
+
+    testrun = models.OneToOneField(TestRun, primary_key=True)
+    # zlib compressed JSON, one result per line
+    results = models.BinaryField()
+    first_result_id = models.IntegerField()
+    last_result_id = models.IntegerField()
+    archived_on = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "%d archived on %s" % (self.testrun_id, self.archived_on)
+
+class Job(models.Model):
+    """ Background work, run by the run_jobs command. See charts/jobs.py. """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATE_CHOICES = (
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed')
+    )
+
+    kind = models.CharField(max_length=30)
+    # What the job works on, e.g. a release
+    key = models.CharField(max_length=100, blank=True)
+    priority = models.IntegerField(default=0)
+    state = models.CharField(max_length=7, choices=STATE_CHOICES, default=QUEUED)
+    # "kind:key" while the job is queued, so that the same job isn't queued twice
+    dedupe_key = models.CharField(max_length=131, unique=True, null=True)
+
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField()
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = (('state', 'priority', 'run_after'),)
+
+    def __str__(self):
+        return "%s %s (%s)" % (self.kind, self.key, self.state)
 
 class TestReport(models.Model):
+    """ A saved testrun_filter query, see charts/reports.py """
+
     testreport_id = models.CharField(max_length=10, primary_key=True)
+    # JSON of the query string parameters, keys sorted
     filters = models.CharField(max_length=10000)
+    # SHA-1 of filters, so that a query is saved once
+    digest = models.CharField(max_length=40, unique=True)
 
     def __str__(self):
         return self.testreport_id
 
+    def get_filters(self):
+        return json.loads(self.filters)
+
+class TestReportRun(models.Model):
+    """ A Test Run a saved report matches, with its counts """
+
+    testreport = models.ForeignKey(TestReport)
+    testrun = models.ForeignKey(TestRun)
+    start_date = models.DateTimeField()
+    passed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    blocked = models.PositiveIntegerField(default=0)
+    idle = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('testreport', 'testrun')
+        index_together = (('testreport', 'start_date'),)
+
+    def __str__(self):
+        return "%s: %s" % (self.testreport_id, self.testrun_id)
+
 
 class TestPlanForm(ModelForm):
     class Meta:
@@ -119,7 +425,7 @@ class TestRunForm(ModelForm):
 class TestCaseResultForm(ModelForm):
     class Meta:
         model = TestCaseResult
-        fields = ['testcase_id', 'result', 'message', 'started_on', 'finished_on', 'attachments', 'comments']
+        fields = ['result', 'message', 'started_on', 'finished_on', 'attachments', 'comments']
 
 class TestReportForm(ModelForm):
     class Meta:
@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import reverse, resolve
+from django.test.client import RequestFactory
+from django.utils.http import urlencode
+from functools import wraps
+import hashlib
+import uuid
+
+from .models import TestRun
+from . import routers
+
+# Pages are cached until their release changes, this only bounds how long
+# pages of releases nobody looks at anymore stay around
+PAGE_TIMEOUT = 60*60*24*7
+
+# Data version of pages which depend on more than one release
+ALL_RELEASES = '__all__'
+
+# Parameters table.js sends when a table is first displayed
+TABLE_DEFAULT_PARAMS = {'limit' : 25, 'page' : 1, 'orderby' : '', 'filter' : '', 'search' : ''}
+
+def _version_key(release):
+    return 'dataversion:%s' % (release or ALL_RELEASES)
+
+def _new_version():
+    # Unique rather than counted up: incr isn't atomic on every cache backend,
+    # two concurrent bumps could leave the version unchanged, and a version
+    # evicted from the cache can't come back to a value with pages stored under it
+    return uuid.uuid4().hex
+
+def get_data_version(release=None):
+    """ Returns the current data version of a release, or of the whole
+        database when no release is given.
+    """
+
+    key = _version_key(release)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), None)
+        version = cache.get(key)
+
+    # A page built now is cached under this version, it mustn't miss data a
+    # lagging reporting database doesn't have yet
+    if routers.is_reading_from_reporting() and cache.get(_written_key(release)):
+        routers.read_from_reporting(False)
+
+    return version
+
+def _written_key(release):
+    return 'written:%s' % (release or ALL_RELEASES)
+
+def bump_data_version(release):
+    """ Invalidates all pages of a release, and the ones spanning releases """
+
+    for key in (_version_key(release), _version_key(None)):
+        cache.set(key, _new_version(), None)
+
+    if routers.is_configured():
+        for key in (_written_key(release), _written_key(None)):
+            cache.set(key, True, settings.REPORTING_DATABASE_LAG)
+
+def release_of_testrun(id):
+    """ Returns the release of a Test Run, None if it doesn't exist """
+
+    key = 'testrun-release:%s' % id
+    release = cache.get(key)
+    if release is None:
+        release = TestRun.objects.filter(pk=id).values_list('release', flat=True).first()
+        if release is not None:
+            cache.set(key, release, None)
+
+    return release
+
+def cache_release_page(get_release=lambda **kwargs: kwargs.get('release')):
+    """ Decorator caching a view's response until the data of the release it
+        shows changes. get_release is given the view's keyword arguments and
+        returns the release, or None if the page depends on all of them.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(request, *args, **kwargs)
+
+            key = 'page:%s:%s:%s' % (view.__name__, get_data_version(get_release(**kwargs)),
+                                     hashlib.md5(request.get_full_path().encode('utf8')).hexdigest())
+
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    cache.set(key, response, PAGE_TIMEOUT)
+
+            return response
+        return wrapper
+    return decorator
+
+def release_urls(release):
+    """ Returns the urls of the pages showing a release, and the ones of the
+        tables inside them.
+    """
+
+    testruns = TestRun.objects.filter(release=release)
+
+    pages = [reverse('charts:testreport', args=[release])]
+    tables = [reverse('charts:testreporttable', args=[release])]
+
+    for testplan, target, hw in sorted(set(testruns.values_list('testplan_id', 'target', 'hw'))):
+        pages.append(reverse('charts:plan_env', args=[release, testplan, target, hw]))
+
+    for id in testruns.order_by('id').values_list('id', flat=True):
+        pages.append(reverse('charts:testrun', args=[id]))
+        tables.append(reverse('charts:testrunresultstable', args=[id]))
+
+    return pages, tables
+
+def render_url(url):
+    """ Returns the response of the view behind a local url """
+
+    request = RequestFactory().get(url)
+    match = resolve(request.path)
+
+    return match.func(request, *match.args, **match.kwargs)
+
+def warm_release(release):
+    """ Renders the pages of a release so that they are cached before anyone
+        asks for them. Meant to be called after a release changed.
+    """
+
+    version = TestRun.objects.filter(release=release).values_list('version', flat=True).first()
+    if version is None:
+        return
+
+    pages, tables = release_urls(release)
+    urls = [reverse('charts:index'), reverse('charts:index_2', args=[version]), reverse('charts:heatmap', args=[version])]
+    urls += pages
+    urls += [table + '?' + urlencode(sorted(TABLE_DEFAULT_PARAMS.items())) for table in tables]
+
+    for url in urls:
+        render_url(url)
@@ -0,0 +1,275 @@
+"""
+Parsers of the test log formats add_testrun.py imports. A parser is given
+the log and yields (testcase id, result, message) records as it reads them,
+or None when it is a good time to save the records read so far, so that logs
+of any size are imported in constant memory. Parsers of line formats are
+given an iterator of lines, which may be a log still being written (see
+ingest.tail), the others a file opened in binary mode.
+"""
+
+from xml.etree import cElementTree
+import json
+import os
+import struct
+import zlib
+
+PARSERS = {}
+LINE_FORMATS = set()
+
+# Formats of logs by file extension, the others are text
+EXTENSIONS = {
+    '.xml' : 'junit',
+    '.subunit' : 'subunit',
+    '.json' : 'json',
+    '.jsonl' : 'json',
+}
+
+class ParseError(Exception):
+    pass
+
+def parser(name, lines=False):
+    """ Registers the parser of a log format """
+
+    def decorator(function):
+        PARSERS[name] = function
+        if lines:
+            LINE_FORMATS.add(name)
+        return function
+    return decorator
+
+def detect(path):
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'text')
+
+# Text logs of bitbake's testimage
+
+RESULT_SEPARATOR = " - Testcase "
+
+def clean_message(msg):
+    msg = msg.replace('\"', '\\\"')
+    msg = msg.replace('\\\\', '(double backslash)')
+    msg = msg.replace('\\_', ' ')
+    msg = msg.strip('\\\\')
+    msg = msg.replace('\\n\\n_', '\\n')
+    msg = msg.replace('\t', ' ')
+    return msg
+
+class LogParser(object):
+    """ Parses a log fed one line at a time. A result line reads "... -
+        Testcase <id>: PASSED" (or FAILED); the message of a failure is the
+        non-empty lines from the second one after it to the next result. """
+
+    def __init__(self):
+        self.failure = None
+        self.message = []
+        self.skip_line = False
+
+    def _end_failure(self):
+        failure, self.failure = self.failure, None
+        return [failure + (clean_message("".join(line + "\n" for line in self.message)),)]
+
+    def feed(self, line):
+        """ Returns the (testcase id, result, message) of the results the line completes """
+
+        line = line.rstrip('\n')
+        results = []
+
+        if self.failure is not None:
+            if self.skip_line:
+                self.skip_line = False
+            elif RESULT_SEPARATOR in line or line == "":
+                results += self._end_failure()
+            else:
+                self.message.append(line)
+
+        if RESULT_SEPARATOR in line and (": PASSED" in line or ": FAILED" in line):
+            if self.failure is not None:
+                results += self._end_failure()
+
+            testcase = line.split(RESULT_SEPARATOR)[1]
+            test_id = testcase.split(":")[0].lower().replace(" ", "")
+            result = testcase.split(":")[1].lower().replace(" ", "")
+            if result == "failed":
+                self.failure = (test_id, result)
+                self.message = []
+                self.skip_line = True
+            else:
+                results.append((test_id, result, ""))
+
+        return results
+
+    def close(self):
+        """ Returns the result still waiting for the end of its message """
+
+        return self._end_failure() if self.failure is not None else []
+
+@parser('text', lines=True)
+def parse_text(lines):
+    log_parser = LogParser()
+    try:
+        for line in lines:
+            if line is None:
+                yield None
+                continue
+            for result in log_parser.feed(line):
+                yield result
+    except KeyboardInterrupt:
+        # Following a log was stopped, the last failure is complete
+        pass
+
+    for result in log_parser.close():
+        yield result
+
+# JUnit XML reports
+
+@parser('junit')
+def parse_junit(log):
+    """ Test cases are named classname.name, or name when they have no
+        classname. Those with a failure or an error failed, skipped ones are
+        blocked. Elements are dropped once read, so that the document is
+        never held in memory. """
+
+    parents = []
+    try:
+        for event, element in cElementTree.iterparse(log, events=('start', 'end')):
+            if event == 'start':
+                parents.append(element)
+                continue
+
+            parents.pop()
+            if element.tag == 'testcase':
+                result, message = 'passed', ''
+                for child in element:
+                    if child.tag in ('failure', 'error'):
+                        result = 'failed'
+                        message = "\n".join(text for text in (child.get('message'), child.text) if text)
+                        break
+                    if child.tag == 'skipped':
+                        result = 'blocked'
+                        message = child.get('message') or ''
+                name, classname = element.get('name', '').strip(), element.get('classname', '').strip()
+                yield '%s.%s' % (classname, name) if classname else name, result, message
+
+            # Test cases need their children until they end
+            if parents and parents[-1].tag != 'testcase':
+                parents[-1].remove(element)
+    except SyntaxError as e:
+        raise ParseError("Invalid JUnit XML: %s" % e)
+
+# subunit v2 streams, see https://github.com/testing-cabal/subunit
+
+SUBUNIT_SIGNATURE = b'\xb3'
+SUBUNIT_VERSION = 2
+
+SUBUNIT_TEST_ID = 0x0800
+SUBUNIT_ROUTE_CODE = 0x0400
+SUBUNIT_TIMESTAMP = 0x0200
+SUBUNIT_TAGS = 0x0080
+SUBUNIT_FILE_CONTENT = 0x0040
+SUBUNIT_MIME_TYPE = 0x0020
+
+# Final statuses of a test: success, unexpected success, skip, failure and expected failure
+SUBUNIT_RESULTS = {3 : 'passed', 4 : 'failed', 5 : 'blocked', 6 : 'failed', 7 : 'passed'}
+
+def _read_number(data, position):
+    """ Reads a number whose 2 high bits give its length, returns (number, next position) """
+
+    size = ord(data[position:position + 1]) >> 6
+    number = ord(data[position:position + 1]) & 0x3f
+    for byte in data[position + 1:position + 1 + size]:
+        number = (number << 8) | ord(byte)
+    return number, position + 1 + size
+
+def _read_string(data, position):
+    length, position = _read_number(data, position)
+    return data[position:position + length].decode('utf-8'), position + length
+
+def read_subunit_packets(log):
+    """ Yields (flags, test id, file content) of the packets of a stream """
+
+    while True:
+        header = log.read(4)
+        if not header:
+            return
+        if header[:1] != SUBUNIT_SIGNATURE or len(header) < 4:
+            raise ParseError("Invalid subunit v2 packet")
+
+        flags = struct.unpack('>H', header[1:3])[0]
+        if flags >> 12 != SUBUNIT_VERSION:
+            raise ParseError("Unsupported subunit version %d" % (flags >> 12))
+
+        # The length counts the whole packet, itself included
+        size = ord(header[3:4]) >> 6
+        packet = header + log.read(size)
+        length = _read_number(packet, 3)[0]
+        packet += log.read(length - len(packet))
+        if len(packet) != length or struct.unpack('>I', packet[-4:])[0] != zlib.crc32(packet[:-4]) & 0xffffffff:
+            raise ParseError("Corrupt subunit v2 packet")
+
+        position = 4 + size
+        test_id, content = None, b''
+        if flags & SUBUNIT_TIMESTAMP:
+            position = _read_number(packet, position + 4)[1]
+        if flags & SUBUNIT_TEST_ID:
+            test_id, position = _read_string(packet, position)
+        if flags & SUBUNIT_TAGS:
+            count, position = _read_number(packet, position)
+            for i in range(count):
+                position = _read_string(packet, position)[1]
+        if flags & SUBUNIT_MIME_TYPE:
+            position = _read_string(packet, position)[1]
+        if flags & SUBUNIT_FILE_CONTENT:
+            position = _read_string(packet, position)[1]
+            length, position = _read_number(packet, position)
+            content = packet[position:position + length]
+
+        yield flags, test_id, content
+
+@parser('subunit')
+def parse_subunit(log):
+    """ Files attached to a test, e.g. its traceback, make up its message """
+
+    contents = {}
+    for flags, test_id, content in read_subunit_packets(log):
+        if test_id is None:
+            continue
+        if content:
+            contents.setdefault(test_id, []).append(content)
+        result = SUBUNIT_RESULTS.get(flags & 0x7)
+        if result is not None:
+            message = b''.join(contents.pop(test_id, [])).decode('utf-8', 'replace')
+            yield test_id, result, message
+
+# JSON lines, one {"testcase": ..., "status": ..., "log": ...} object per
+# line, with the statuses of oeqa's testresults.json
+
+JSON_RESULTS = {
+    'passed' : 'passed',
+    'failed' : 'failed',
+    'error' : 'failed',
+    'skipped' : 'blocked',
+    'expectedfail' : 'passed',
+    'unexpectedsuccess' : 'failed',
+    'blocked' : 'blocked',
+    'idle' : 'idle',
+}
+
+@parser('json', lines=True)
+def parse_json(lines):
+    number = 0
+    for line in lines:
+        if line is None:
+            yield None
+            continue
+        number += 1
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+            testcase, result = record['testcase'], JSON_RESULTS[record['status'].lower()]
+            log = record.get('log') or ''
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise ParseError("Line %d is not a test result" % number)
+        if not isinstance(testcase, basestring) or not isinstance(log, basestring):
+            raise ParseError("Line %d is not a test result" % number)
+        yield testcase, result, log
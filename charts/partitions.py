@@ -0,0 +1,153 @@
+"""
+List partitioning of the Test Case Results table by version, in PostgreSQL 11
+or newer. Test Case Results carry the version of their Test Run so that each
+version's results live in their own partition: queries restricted to a
+release only read its version's partition, and an old version is dropped by
+detaching its partition rather than deleting its rows.
+
+Test Runs are not partitioned, other tables have foreign keys to them.
+See the partition_results command.
+"""
+
+from django.db import connection, transaction
+import re
+
+from .models import TestRun, TestCaseResult
+
+TABLE = TestCaseResult._meta.db_table
+DEFAULT_PARTITION = TABLE + '_default'
+
+# Versions known to have a partition, per process
+_partitioned_versions = set()
+
+def partition_name(version):
+    return '%s_v%s' % (TABLE, re.sub(r'\W+', '_', version).lower())
+
+def for_release(testcaseresults, release):
+    """ Restricts Test Case Results to the partitions of the release's
+        versions, usually one. They are looked up in an array subquery,
+        which PostgreSQL runs first and prunes the other partitions with; it
+        doesn't with IN, which it runs as a join. """
+
+    versions = 'SELECT DISTINCT version FROM %s WHERE release = %%s' % TestRun._meta.db_table
+    if connection.vendor == 'postgresql':
+        where = '%s.version = ANY(ARRAY(%s))' % (TABLE, versions)
+    else:
+        where = '%s.version IN (%s)' % (TABLE, versions)
+    return testcaseresults.extra(where=[where], params=[release])
+
+def for_testrun(testcaseresults, testrun_id):
+    """ Restricts Test Case Results to the partition of the Test Run's version """
+
+    return testcaseresults.extra(
+        where=['%s.version = (SELECT version FROM %s WHERE id = %%s)' % (TABLE, TestRun._meta.db_table)],
+        params=[testrun_id])
+
+def is_supported():
+    return connection.vendor == 'postgresql' and connection.pg_version >= 110000
+
+def is_partitioned(cursor):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLE])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+def get_partitions(cursor):
+    """ Returns [(partition table, bound)] of the Test Case Results table """
+
+    cursor.execute("SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits "
+                   "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                   "WHERE pg_inherits.inhparent = to_regclass(%s) ORDER BY child.relname", [TABLE])
+    return cursor.fetchall()
+
+def partition_exists(cursor, version):
+    cursor.execute("SELECT 1 FROM pg_inherits WHERE inhparent = to_regclass(%s) AND inhrelid = to_regclass(%s)",
+                   [TABLE, partition_name(version)])
+    return cursor.fetchone() is not None
+
+def ensure_partition(version):
+    """ Creates the partition of a version if the table is partitioned and it
+        has none yet. Results of the version already saved in the default
+        partition are moved to it. Does nothing on other databases. """
+
+    if version in _partitioned_versions or not is_supported():
+        return
+
+    with transaction.atomic():
+        cursor = connection.cursor()
+        if not is_partitioned(cursor):
+            return
+
+        if not partition_exists(cursor, version):
+            name = connection.ops.quote_name(partition_name(version))
+            cursor.execute("LOCK TABLE %s IN SHARE ROW EXCLUSIVE MODE" % DEFAULT_PARTITION)
+            cursor.execute("CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)" % (name, TABLE))
+            cursor.execute("INSERT INTO %s SELECT * FROM %s WHERE version = %%s" % (name, DEFAULT_PARTITION), [version])
+            cursor.execute("DELETE FROM %s WHERE version = %%s" % DEFAULT_PARTITION, [version])
+            cursor.execute("ALTER TABLE %s ATTACH PARTITION %s FOR VALUES IN (%%s)" % (TABLE, name), [version])
+
+    _partitioned_versions.add(version)
+
+def convert():
+    """ Replaces the Test Case Results table by one partitioned by version,
+        with a partition for each version and a default one. Holds an
+        exclusive lock on the table while its rows are copied. """
+
+    with transaction.atomic():
+        cursor = connection.cursor()
+        if is_partitioned(cursor):
+            return False
+
+        old = TABLE + '_unpartitioned'
+        constraints = connection.introspection.get_constraints(cursor, TABLE)
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        sequence = cursor.fetchone()[0]
+
+        cursor.execute("LOCK TABLE %s IN ACCESS EXCLUSIVE MODE" % TABLE)
+        cursor.execute("ALTER TABLE %s RENAME TO %s" % (TABLE, old))
+        # Kept for the new table, it would be dropped with the old one
+        cursor.execute("ALTER SEQUENCE %s OWNED BY NONE" % sequence)
+
+        # The partition key has to be part of the primary key
+        cursor.execute("CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) PARTITION BY LIST (version)" % (TABLE, old))
+        cursor.execute("ALTER TABLE %s ADD PRIMARY KEY (id, version)" % TABLE)
+        indexed = set()
+        for name, constraint in sorted(constraints.items()):
+            columns = ', '.join(connection.ops.quote_name(column) for column in constraint['columns'])
+            if constraint['foreign_key']:
+                table, column = constraint['foreign_key']
+                cursor.execute("ALTER TABLE %s ADD FOREIGN KEY (%s) REFERENCES %s (%s) DEFERRABLE INITIALLY DEFERRED"
+                               % (TABLE, columns, table, column))
+            # Varchar columns also have a "_like" index on the same columns
+            elif constraint['index'] and not constraint['primary_key'] and columns not in indexed:
+                cursor.execute("CREATE INDEX ON %s (%s)" % (TABLE, columns))
+                indexed.add(columns)
+
+        cursor.execute("CREATE TABLE %s PARTITION OF %s DEFAULT" % (DEFAULT_PARTITION, TABLE))
+        cursor.execute("SELECT DISTINCT version FROM %s" % old)
+        for version, in cursor.fetchall():
+            cursor.execute("CREATE TABLE %s PARTITION OF %s FOR VALUES IN (%%s)"
+                           % (connection.ops.quote_name(partition_name(version)), TABLE), [version])
+
+        cursor.execute("INSERT INTO %s SELECT * FROM %s" % (TABLE, old))
+        cursor.execute("ALTER SEQUENCE %s OWNED BY %s.id" % (sequence, TABLE))
+        cursor.execute("DROP TABLE %s" % old)
+
+    cursor.execute("ANALYZE %s" % TABLE)
+    return True
+
+def detach(version, drop=False):
+    """ Detaches the partition of a version, which keeps its results as a
+        standalone table unless drop is set """
+
+    with transaction.atomic():
+        cursor = connection.cursor()
+        if not partition_exists(cursor, version):
+            return False
+
+        name = connection.ops.quote_name(partition_name(version))
+        cursor.execute("ALTER TABLE %s DETACH PARTITION %s" % (TABLE, name))
+        if drop:
+            cursor.execute("DROP TABLE %s" % name)
+
+    _partitioned_versions.discard(version)
+    return True
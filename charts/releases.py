@@ -0,0 +1,114 @@
+"""
+Catalog of the versions and releases Test Runs were run for, with the start
+of their first and last runs and the result counts of each release, so that
+the landing page and the version and release pickers read a few rows
+rather than finding the distinct values of every Test Run. Kept up to date
+with the rollups, see rollups._update.
+
+Names are ordered by their numbers rather than as text, 1.10 coming after
+1.9 and 2.1_M10 after 2.1_M9.
+"""
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Sum
+import re
+
+from .models import TestRun, Version, Release
+
+# Digits each number is padded to in sort keys
+NUMBER_WIDTH = 8
+
+def sort_key(name):
+    """ The name with its numbers zero padded, so that keys sort as text in
+        the order of the numbers """
+
+    return re.sub(r'\d+', lambda match: match.group(0).zfill(NUMBER_WIDTH), name)
+
+def _extend_dates(model, pk, date):
+    model.objects.filter(pk=pk, first_run__gt=date).update(first_run=date)
+    model.objects.filter(pk=pk, last_run__lt=date).update(last_run=date)
+
+def refresh_dates(names, exclude=None):
+    """ Recomputes the dates of releases, and of their versions, from their
+        Test Runs but the one with the pk exclude """
+
+    testruns = TestRun.objects.filter(release__in=names)
+    if exclude is not None:
+        testruns = testruns.exclude(pk=exclude)
+    for name, first_run, last_run in testruns.order_by().values_list('release').annotate(Min('start_date'),
+                                                                                          Max('start_date')):
+        Release.objects.filter(name=name).update(first_run=first_run, last_run=last_run)
+
+    # A version spans its releases
+    for version in Version.objects.filter(release__name__in=names).distinct():
+        dates = Release.objects.filter(version=version).aggregate(first_run=Min('first_run'), last_run=Max('last_run'))
+        Version.objects.filter(pk=version.pk).update(**dates)
+
+def update(testrun, counts, sign, testruns):
+    """ Adds counts, {status: count}, and a number of Test Runs to the release
+        of a Test Run, or takes them out when sign is -1. Releases left with
+        no runs are dropped, and so are versions left with no releases. A
+        Test Run taken out, still in the database, no longer counts in the
+        dates. """
+
+    dates = {'first_run' : testrun.start_date, 'last_run' : testrun.start_date}
+    version, created = Version.objects.get_or_create(name=testrun.version,
+                                                     defaults=dict(dates, sort_key=sort_key(testrun.version)))
+    release, created = Release.objects.get_or_create(name=testrun.release,
+                                                     defaults=dict(dates, version=version, sort_key=sort_key(testrun.release)))
+    if sign > 0 and testruns:
+        _extend_dates(Version, version.pk, testrun.start_date)
+        _extend_dates(Release, release.pk, testrun.start_date)
+
+    # Update in the database so that concurrent imports don't lose counts
+    Release.objects.filter(pk=release.pk).update(testruns=F('testruns') + sign * testruns, **dict(
+        (result, F(result) + sign * count) for result, count in counts.items() if count))
+
+    if sign < 0 and testruns:
+        Release.objects.filter(pk=release.pk, testruns__lte=0).delete()
+        Version.objects.filter(pk=version.pk, release=None).delete()
+        # Only the first or last run of a release moves its dates
+        if testrun.start_date in (release.first_run, release.last_run):
+            refresh_dates([testrun.release], exclude=testrun.pk)
+
+def rebuild():
+    """ Recomputes the catalog from the Test Runs, returns the number of releases """
+
+    sums = [Sum(result) for result in TestRun.COUNTERS]
+    rows = list(TestRun.objects.values_list('version', 'release')
+                .annotate(Min('start_date'), Max('start_date'), Count('id'), *sums)
+                .order_by('start_date__min', 'version'))
+
+    releases, versions, version_of = {}, {}, {}
+    for row in rows:
+        version, name, first_run, last_run, testruns = row[:5]
+        # A release found under several versions belongs to the one it was first run for
+        if name not in releases:
+            releases[name] = Release(name=name, sort_key=sort_key(name), first_run=first_run, last_run=last_run)
+            version_of[name] = version
+            versions.setdefault(version, Version(name=version, sort_key=sort_key(version), first_run=first_run,
+                                                 last_run=last_run))
+        for obj in (releases[name], versions[version_of[name]]):
+            obj.first_run, obj.last_run = min(obj.first_run, first_run), max(obj.last_run, last_run)
+        releases[name].testruns += testruns
+        for result, count in zip(TestRun.COUNTERS, row[5:]):
+            setattr(releases[name], result, getattr(releases[name], result) + (count or 0))
+
+    with transaction.atomic():
+        Release.objects.all().delete()
+        Version.objects.all().delete()
+        Version.objects.bulk_create(versions.values())
+        ids = dict(Version.objects.values_list('name', 'id'))
+        for name, release in releases.items():
+            release.version_id = ids[version_of[name]]
+        Release.objects.bulk_create(releases.values())
+
+    return len(releases)
+
+def get_releases(version=None):
+    """ Releases, latest first, of a version or of all of them """
+
+    releases = Release.objects.order_by('-sort_key')
+    if version is not None:
+        releases = releases.filter(version__name=version)
+    return releases
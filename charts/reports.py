@@ -0,0 +1,124 @@
+"""
+Saved reports. A TestReport holds the parameters of a testrun_filter query
+and TestReportRun the Test Runs it matches with their counts, so that a
+report is read from a small table rather than by filtering every Test Run
+again. Runs are added to the reports they match as they are imported, and
+their counts updated when they are counted again; runs are matched in Python
+against the filters of all reports, read once per batch of runs.
+"""
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.encoding import force_text
+import datetime
+import hashlib
+import json
+import uuid
+
+from .models import TestRun, TestReport, TestReportRun, TestReportForm
+
+# Query string parameters of testrun_filter
+FIELDS = ('testplan', 'release', 'test_type', 'poky_commit', 'target', 'image_type', 'hw_arch', 'hw')
+DATE_FIELDS = ('from', 'to')
+
+ID_LENGTH = 8
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+def start_of_day(date):
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time()), timezone.get_current_timezone())
+
+def clean_filters(params):
+    """ The filters of a query string that testrun_filter uses """
+
+    filters = dict((field, params[field]) for field in FIELDS if params.get(field))
+    filters.update((field, params[field]) for field in DATE_FIELDS if parse_date(params.get(field)))
+    return filters
+
+def dumps(filters):
+    return json.dumps(filters, sort_keys=True)
+
+def get_digest(text):
+    """ The digest of the JSON of filters, see dumps """
+
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def get_testruns(filters):
+    testruns = TestRun.objects.filter(**dict((field, value) for field, value in filters.items() if field in FIELDS))
+    date_from, date_to = parse_date(filters.get('from')), parse_date(filters.get('to'))
+    if date_from:
+        testruns = testruns.filter(start_date__gte=start_of_day(date_from))
+    if date_to:
+        testruns = testruns.filter(start_date__lt=start_of_day(date_to + datetime.timedelta(days=1)))
+    return testruns
+
+def matches(testrun, filters):
+    """ Whether get_testruns(filters) holds the Test Run """
+
+    for field in FIELDS:
+        if field in filters:
+            value = testrun.testplan_id if field == 'testplan' else getattr(testrun, field)
+            if force_text(value) != force_text(filters[field]):
+                return False
+    date_from, date_to = parse_date(filters.get('from')), parse_date(filters.get('to'))
+    if date_from and testrun.start_date < start_of_day(date_from):
+        return False
+    if date_to and testrun.start_date >= start_of_day(date_to + datetime.timedelta(days=1)):
+        return False
+    return True
+
+def _row(testreport, testrun):
+    return TestReportRun(testreport=testreport, testrun=testrun, start_date=testrun.start_date, **testrun.get_counts())
+
+def refresh(testreport):
+    """ Matches the report against all Test Runs again """
+
+    with transaction.atomic():
+        testreport.testreportrun_set.all().delete()
+        TestReportRun.objects.bulk_create(_row(testreport, testrun) for testrun in
+                                          get_testruns(testreport.get_filters()).only('start_date', *TestRun.COUNTERS))
+
+def save(filters):
+    """ Returns the report of the filters, creating it if there is none """
+
+    form = TestReportForm(data={'filters' : dumps(filters)})
+    if not form.is_valid():
+        raise ValueError("Invalid report filters: %s" % form.errors.as_text())
+
+    digest = get_digest(form.cleaned_data['filters'])
+    testreport = TestReport.objects.filter(digest=digest).first()
+    if testreport is None:
+        testreport = form.save(commit=False)
+        testreport.testreport_id = uuid.uuid4().hex[:ID_LENGTH]
+        testreport.digest = digest
+        try:
+            with transaction.atomic():
+                testreport.save(force_insert=True)
+                refresh(testreport)
+        except IntegrityError:
+            # Saved by a concurrent request
+            testreport = TestReport.objects.get(digest=digest)
+    return testreport
+
+def add_testruns(testruns):
+    """ Adds Test Runs to the reports they match, or updates their counts there """
+
+    testreports = [(testreport, testreport.get_filters()) for testreport in TestReport.objects.all()]
+    for testrun in testruns:
+        for testreport, filters in testreports:
+            if matches(testrun, filters):
+                TestReportRun.objects.update_or_create(testreport=testreport, testrun=testrun, defaults=dict(
+                    start_date=testrun.start_date, **testrun.get_counts()))
+
+def add_testrun(testrun):
+    add_testruns([testrun])
+
+def get_series(testreport):
+    """ Returns [(testrun id, start date, counts)] of the runs of a report, oldest first """
+
+    return [(row[0], row[1], dict(zip(TestRun.COUNTERS, row[2:]))) for row in
+            testreport.testreportrun_set.order_by('start_date', 'testrun').values_list('testrun', 'start_date', *TestRun.COUNTERS)]
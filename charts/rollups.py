@@ -0,0 +1,177 @@
+"""
+Result counts of Test Runs summed per day and per week, so that charts over
+long periods don't count raw Test Case Results, per poky commit of each
+plan-environment and per release (see charts/releases.py).
+"""
+
+from django.db import transaction
+from django.db.models import F, Min, Sum
+import collections
+import datetime
+
+from .models import TestRun, ResultRollup, CommitRollup
+from . import releases
+
+BUCKET_DAYS = collections.OrderedDict((
+    ('week', 7),
+    ('day', 1),
+))
+
+# A chart uses the coarsest bucket still giving it at least this many points,
+# or shows single Test Runs when not even days do
+MIN_POINTS = 30
+
+# Test Run fields a rollup is broken down by
+DIMENSIONS = ('version', 'release', 'testplan', 'target', 'hw')
+
+# Test Run fields a commit rollup is broken down by
+COMMIT_DIMENSIONS = ('poky_commit', 'poky_branch', 'testplan', 'target', 'hw')
+
+def bucket_start(bucket, date):
+    """ Returns the first day of the bucket the date falls in, weeks start on Monday """
+
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    if bucket == 'week':
+        date -= datetime.timedelta(days=date.weekday())
+    return date
+
+def pick_bucket(start, end):
+    """ Returns the coarsest bucket fitting the period, None if single Test Runs
+        should be shown instead """
+
+    if start is None or end is None:
+        return None
+
+    days = (end - start).days
+    for bucket, length in BUCKET_DAYS.items():
+        if days / length >= MIN_POINTS:
+            return bucket
+    return None
+
+def _add(model, count, defaults=None, **key):
+    """ Adds count to the rollup of the key, created if needed, returns its pk """
+
+    while True:
+        rollup, created = model.objects.get_or_create(defaults=defaults, **key)
+        # Update in the database so that concurrent imports don't lose counts
+        if model.objects.filter(pk=rollup.pk).update(count=F('count') + count):
+            return rollup.pk
+        # Deleted meanwhile, its count having dropped to zero
+
+def _update(testrun, counts, sign, testruns=0):
+    with transaction.atomic():
+        releases.update(testrun, counts, sign, testruns)
+
+        updated = []
+        for bucket in BUCKET_DAYS:
+            for result, count in counts.items():
+                if not count:
+                    continue
+                updated.append(_add(ResultRollup, sign * count, bucket=bucket,
+                                    bucket_start=bucket_start(bucket, testrun.start_date), version=testrun.version,
+                                    release=testrun.release, testplan_id=testrun.testplan_id, target=testrun.target,
+                                    hw=testrun.hw, result=result))
+
+        commit = dict(poky_commit=testrun.poky_commit, poky_branch=testrun.poky_branch, testplan_id=testrun.testplan_id,
+                      target=testrun.target, hw=testrun.hw)
+        # All the rollups of a commit share the start of its first run
+        first_seen = CommitRollup.objects.filter(**commit).aggregate(Min('first_seen'))['first_seen__min']
+        first_seen = min(first_seen or testrun.start_date, testrun.start_date)
+        updated_commits = []
+        for result, count in counts.items():
+            if not count:
+                continue
+            updated_commits.append(_add(CommitRollup, sign * count, defaults={'first_seen' : first_seen},
+                                        result=result, **commit))
+
+        if sign > 0:
+            # A run imported late may be the first one of its commit
+            CommitRollup.objects.filter(first_seen__gt=first_seen, **commit).update(first_seen=first_seen)
+            return
+
+        ResultRollup.objects.filter(pk__in=updated, count=0).delete()
+        CommitRollup.objects.filter(pk__in=updated_commits, count=0).delete()
+        if testruns and testrun.start_date == first_seen:
+            # The run taken out was the first one of its commit
+            first_seen = (TestRun.objects.filter(**commit).exclude(pk=testrun.pk)
+                          .aggregate(Min('start_date'))['start_date__min'])
+            if first_seen is not None:
+                CommitRollup.objects.filter(**commit).update(first_seen=first_seen)
+
+def add_testrun(testrun):
+    """ Adds a newly imported Test Run and its results, once its counters
+        are set, to the rollups """
+
+    _update(testrun, testrun.get_counts(), 1, testruns=1)
+
+def add_results(testrun, counts):
+    """ Adds results of a Test Run still being imported, counts is {status: count} """
+
+    _update(testrun, counts, 1)
+
+def remove_testrun(testrun):
+    """ Takes a Test Run about to be deleted and its results out of the rollups """
+
+    _update(testrun, testrun.get_counts(), -1, testruns=1)
+
+def rebuild():
+    """ Recomputes all rollups, and the release catalog, from the counters of the Test Runs """
+
+    rollups = collections.defaultdict(int)
+    commits = collections.defaultdict(int)
+    first_seen = {}
+
+    for testrun in TestRun.objects.only('id', 'start_date', *(DIMENSIONS + COMMIT_DIMENSIONS + TestRun.COUNTERS)).iterator():
+        commit = (testrun.poky_commit, testrun.poky_branch, testrun.testplan_id, testrun.target, testrun.hw)
+        first_seen[commit] = min(testrun.start_date, first_seen.get(commit, testrun.start_date))
+        for result, count in testrun.get_counts().items():
+            if not count:
+                continue
+            commits[commit + (result,)] += count
+            for bucket in BUCKET_DAYS:
+                rollups[(bucket, bucket_start(bucket, testrun.start_date), testrun.version, testrun.release,
+                         testrun.testplan_id, testrun.target, testrun.hw, result)] += count
+
+    with transaction.atomic():
+        ResultRollup.objects.all().delete()
+        ResultRollup.objects.bulk_create(
+            (ResultRollup(bucket=bucket, bucket_start=start, version=version, release=release, testplan_id=testplan,
+                          target=target, hw=hw, result=result, count=count)
+             for (bucket, start, version, release, testplan, target, hw, result), count in rollups.items()),
+            batch_size=1000)
+        CommitRollup.objects.all().delete()
+        CommitRollup.objects.bulk_create(
+            (CommitRollup(poky_commit=commit, poky_branch=branch, testplan_id=testplan, target=target, hw=hw,
+                          result=result, count=count, first_seen=first_seen[(commit, branch, testplan, target, hw)])
+             for (commit, branch, testplan, target, hw, result), count in commits.items()),
+            batch_size=1000)
+        created = releases.rebuild()
+
+    return len(rollups) + len(commits) + created
+
+def series(bucket, start=None, end=None, **filters):
+    """ Returns [(bucket start, {status: count})] in date order for the rollups
+        matching filters, which are lookups on DIMENSIONS """
+
+    rollups = ResultRollup.objects.filter(bucket=bucket, **filters)
+    if start is not None:
+        rollups = rollups.filter(bucket_start__gte=bucket_start(bucket, start))
+    if end is not None:
+        rollups = rollups.filter(bucket_start__lte=end)
+
+    points = collections.OrderedDict()
+    for day, result, count in (rollups.order_by('bucket_start').values_list('bucket_start', 'result')
+                               .annotate(Sum('count'))):
+        points.setdefault(day, {})[result] = count
+
+    return list(points.items())
+
+def totals(group_by, **filters):
+    """ Returns {group_by value: {status: count}} summed over all time """
+
+    counts = collections.defaultdict(dict)
+    for group, result, count in (ResultRollup.objects.filter(bucket='week', **filters).order_by()
+                                 .values_list(group_by, 'result').annotate(Sum('count'))):
+        counts[group][result] = count
+    return counts
@@ -0,0 +1,41 @@
+"""
+Routing of the reads of web pages to a reporting database, a replica of the
+default one, so that reports and ingestion don't compete for the same
+server. Writes, and everything run outside of a web request such as
+add_testrun.py, use the default database.
+
+A replica lags a little behind. Pages of a release written less than
+REPORTING_DATABASE_LAG seconds ago are read from the default database, so
+that they aren't cached with the data missing, and so are the pages asked
+for by a client that just sent a write request.
+"""
+
+from django.conf import settings
+import threading
+
+REPORTING = 'reporting'
+
+_local = threading.local()
+
+def is_configured():
+    return REPORTING in settings.DATABASES
+
+def read_from_reporting(enabled):
+    """ Sends the reads of the current thread to the reporting database, or back to the default one """
+
+    _local.reporting = enabled and is_configured()
+
+def is_reading_from_reporting():
+    return getattr(_local, 'reporting', False)
+
+class ReportingRouter(object):
+
+    def db_for_read(self, model, **hints):
+        return REPORTING if is_reading_from_reporting() else 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same rows
+        return True
@@ -0,0 +1,124 @@
+from django.db.models import Case, Count, DateTimeField, F, Q, Value, When
+import hashlib
+import re
+
+from .models import FailureSignature, TestCaseResult
+from . import partitions
+
+# Substitutions applied, in order, to a failure message before hashing it.
+# Anything that differs between two runs hitting the same problem (where the
+# tree was checked out, when it ran, where things lived in memory) is
+# replaced by a fixed placeholder.
+NORMALIZERS = (
+    # 2015-05-15 11:39:23, 2015-05-15T11:39:23.123
+    (re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?'), '<date>'),
+    # 13:41:27, 13:41:27.456
+    (re.compile(r'\b\d{1,2}:\d{2}:\d{2}(\.\d+)?\b'), '<time>'),
+    # kernel log timestamps, e.g. "[    0.270279]"
+    (re.compile(r'\[\s*\d+\.\d+\]'), '[<ktime>]'),
+    # absolute paths, only the file name is kept
+    (re.compile(r'(?:/[\w.+-]+)+/([\w.+-]+)'), r'\1'),
+    # pointers and other hex addresses
+    (re.compile(r'\b0x[0-9a-fA-F]+\b'), '<addr>'),
+    (re.compile(r'\b[0-9a-fA-F]{8,}\b'), '<addr>'),
+    # line numbers in traceback frames move with every change to the file
+    (re.compile(r'\bline \d+\b'), 'line <n>'),
+    (re.compile(r'[ \t]+'), ' '),
+)
+
+SUMMARY_LINE = re.compile(r'^\w*(Error|Exception|Failure|Timeout)\b')
+
+def normalize(message):
+    """ Returns the failure message with all run specific details stripped """
+
+    normalized = message.replace('\r', '')
+    for pattern, replacement in NORMALIZERS:
+        normalized = pattern.sub(replacement, normalized)
+
+    return "\n".join(line.strip() for line in normalized.split("\n") if line.strip())
+
+def summarize(normalized):
+    """ Returns the line of a normalized message that best describes it,
+        usually the exception raised at the bottom of the traceback.
+    """
+
+    lines = normalized.split("\n")
+    for line in lines:
+        if SUMMARY_LINE.match(line):
+            return line[:255]
+
+    return lines[-1][:255]
+
+def compute(message):
+    """ Returns the (signature, summary) pair of a failure message """
+
+    normalized = normalize(message)
+    if not normalized:
+        return None, ''
+
+    return hashlib.sha1(normalized.encode('utf8')).hexdigest(), summarize(normalized)
+
+def index_failure(message, seen=None, count=1):
+    """ Adds a failure to the signature index and returns its FailureSignature,
+        or None if the message is empty.
+    """
+
+    signature, summary = compute(message)
+    if signature is None:
+        return None
+
+    failure_signature, created = FailureSignature.objects.get_or_create(
+        signature=signature,
+        defaults={'summary' : summary, 'first_seen' : seen, 'last_seen' : seen})
+    add_occurrences(failure_signature.pk, count, seen, seen)
+
+    return failure_signature
+
+def add_occurrences(signature_id, count, first_seen=None, last_seen=None):
+    """ Adds failures seen between two dates to the occurrences of a signature """
+
+    # Update in the database so that concurrent imports don't lose counts.
+    # Runs aren't imported in the order they ran, dates only extend the range.
+    dates = {}
+    if first_seen is not None:
+        dates['first_seen'] = Case(When(Q(first_seen=None) | Q(first_seen__gt=first_seen),
+                                        then=Value(first_seen, output_field=DateTimeField())), default=F('first_seen'))
+    if last_seen is not None:
+        dates['last_seen'] = Case(When(Q(last_seen=None) | Q(last_seen__lt=last_seen),
+                                       then=Value(last_seen, output_field=DateTimeField())), default=F('last_seen'))
+    FailureSignature.objects.filter(pk=signature_id).update(occurrences=F('occurrences') + count, **dates)
+
+def remove_testrun(testrun):
+    """ Takes the failures of a Test Run about to be deleted out of the
+        occurrences of their signatures. Returns the ids of the signatures,
+        for drop_unused once the run is deleted. """
+
+    failures = (partitions.for_testrun(TestCaseResult.objects.filter(testrun=testrun), testrun.pk)
+                .filter(result='failed', signature__isnull=False))
+    counts = list(failures.order_by().values_list('signature').annotate(Count('id')))
+    for signature_id, count in counts:
+        FailureSignature.objects.filter(pk=signature_id).update(occurrences=F('occurrences') - count)
+    return [signature_id for signature_id, count in counts]
+
+def drop_unused(signature_ids):
+    """ Deletes the signatures among the given ones that no result has anymore """
+
+    FailureSignature.objects.filter(pk__in=signature_ids, occurrences__lte=0, testcaseresult=None).delete()
+
+def top_signatures(testcaseresults, limit=10):
+    """ Groups the failed results of the given TestCaseResult queryset by
+        signature, most frequent first.
+    """
+
+    return (testcaseresults.filter(result='failed', signature__isnull=False)
+            .values('signature__signature', 'signature__summary')
+            .annotate(count=Count('id'), testcases=Count('testcase', distinct=True), testruns=Count('testrun', distinct=True))
+            .order_by('-count')[:limit])
+
+def top_for_release(release, limit=10):
+    return top_signatures(partitions.for_release(TestCaseResult.objects.filter(testrun__release=release), release), limit)
+
+def top_for_plan_env(release, testplan, target, hw, limit=10):
+    results = TestCaseResult.objects.filter(testrun__release=release, testrun__testplan_id=testplan,
+                                            testrun__target=target, testrun__hw=hw)
+    return top_signatures(partitions.for_release(results, release), limit)
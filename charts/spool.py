@@ -0,0 +1,192 @@
+"""
+Spool directory of the ingest_daemon command, which imports Test Runs in a
+long-running process instead of paying for the start-up of add_testrun.py
+on every log. queue_ingest.py drops a JSON file per import in incoming/,
+the daemon claims it by moving it to processing/ and writes its outcome to
+done/. Files are renamed into place, so that nobody reads them half-written.
+A daemon locks the spool, the jobs left in processing/ are then the ones of
+a daemon that stopped.
+"""
+
+from django.conf import settings
+from django.db import connection
+import StringIO
+import fcntl
+import json
+import os
+import threading
+import time
+import traceback
+
+from . import ingest
+
+# add_testrun.py arguments following the log file
+TESTRUN_ARGUMENTS = ('version', 'release', 'test_type', 'poky_commit', 'poky_branch', 'start_date', 'target',
+                     'image_type', 'hw_arch', 'hw')
+
+POLL_INTERVAL = 0.2
+
+# Outcomes in done/ are kept this long, in seconds, for queue_ingest.py --wait
+KEEP_DONE = 60*60*24*7
+
+# Seconds between two prunings of done/
+PRUNE_INTERVAL = 60*60
+
+LOCK_FILE = 'daemon.lock'
+
+class SpoolLocked(Exception):
+    pass
+
+def get_directory(name, root=None):
+    path = os.path.join(root or settings.INGEST_SPOOL_ROOT, name)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+def write_json(path, data):
+    with open(path + '.tmp', 'w') as tmp:
+        json.dump(data, tmp)
+    os.rename(path + '.tmp', path)
+
+def queue(job, root=None):
+    """ Queues a job, {'command': 'testrun' or 'testplan', 'args': [script
+        arguments], 'follow': bool, 'format': log format or None}, returns
+        its name. queue_ingest.py does the same without loading Django. """
+
+    name = '%d-%d.json' % (time.time() * 1000000, os.getpid())
+    write_json(os.path.join(get_directory('incoming', root), name), job)
+    return name
+
+def lock(root=None):
+    """ Locks the spool for the calling process, until the returned file is
+        closed or the process exits. Raises SpoolLocked if a daemon already
+        serves the spool. """
+
+    lock_file = open(os.path.join(get_directory('', root), LOCK_FILE), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        lock_file.close()
+        raise SpoolLocked("Another ingest daemon serves %s" % (root or settings.INGEST_SPOOL_ROOT))
+    return lock_file
+
+def requeue(root=None):
+    """ Moves back the jobs a stopped daemon was processing, the spool must be locked """
+
+    processing = get_directory('processing', root)
+    for name in os.listdir(processing):
+        os.rename(os.path.join(processing, name), os.path.join(get_directory('incoming', root), name))
+
+def claim(root=None):
+    """ Moves the oldest queued job to processing/ and returns its name, None if there is none """
+
+    incoming = get_directory('incoming', root)
+    for name in sorted(name for name in os.listdir(incoming) if name.endswith('.json')):
+        try:
+            os.rename(os.path.join(incoming, name), os.path.join(get_directory('processing', root), name))
+        except OSError:
+            # Claimed by another daemon
+            continue
+        return name
+    return None
+
+def prune(root=None, keep=KEEP_DONE):
+    """ Deletes the outcomes older than keep seconds, returns how many there were """
+
+    done = get_directory('done', root)
+    pruned = 0
+    for name in os.listdir(done):
+        path = os.path.join(done, name)
+        try:
+            if os.path.getmtime(path) < time.time() - keep:
+                os.remove(path)
+                pruned += 1
+        except OSError:
+            # Removed meanwhile
+            continue
+    return pruned
+
+def run(job, out):
+    args = job['args']
+    if job['command'] == 'testplan':
+        ingest.add_testplan(*args[:3], testcases_file=(args[3:4] or [None])[0] or None)
+        out.write("TestPlan saved\n")
+    elif job['command'] == 'testrun':
+        optional = [arg or None for arg in (list(args[11:14]) + [None] * 3)[:3]]
+        ingest.add_testrun(args[0], dict(zip(TESTRUN_ARGUMENTS, args[1:11])), packages_file=optional[0],
+                           services_file=optional[1], attachments_dir=optional[2], follow=job.get('follow', False),
+                           log_format=job.get('format'), out=out)
+    else:
+        raise ingest.IngestError("Unknown command %s" % job['command'])
+
+def process(name, root=None):
+    """ Runs a claimed job and writes its outcome, {'status': 'done' or
+        'failed', 'output': text}, to done/ """
+
+    path = os.path.join(get_directory('processing', root), name)
+    out = StringIO.StringIO()
+    status = 'done'
+    try:
+        with open(path) as job:
+            run(json.load(job), out)
+    except ingest.IngestError as e:
+        out.write("Error: %s\n" % e)
+        status = 'failed'
+    except Exception:
+        out.write(traceback.format_exc())
+        status = 'failed'
+        # The connection may be what failed, the next job gets a new one
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+    write_json(os.path.join(get_directory('done', root), name), {'status' : status, 'output' : out.getvalue()})
+    os.remove(path)
+    return status
+
+def _process_in_thread(name, root):
+    try:
+        process(name, root)
+    finally:
+        connection.close()
+
+def serve(root=None, poll_interval=POLL_INTERVAL, once=False, log=None):
+    """ Processes queued jobs as they come, or until there are none left
+        if once is set. Followed logs are imported in their own thread. """
+
+    lock_file = lock(root)
+    try:
+        _serve(root, poll_interval, once, log)
+    finally:
+        lock_file.close()
+
+def _serve(root, poll_interval, once, log):
+    requeue(root)
+    threads = []
+    pruned_at = 0
+    while True:
+        name = claim(root)
+        if name is None:
+            threads = [thread for thread in threads if thread.is_alive()]
+            if once and not threads:
+                return
+            if time.time() - pruned_at >= PRUNE_INTERVAL:
+                prune(root)
+                pruned_at = time.time()
+            time.sleep(poll_interval)
+            continue
+
+        # Keep the connection open between jobs, unless the server dropped it
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+        with open(os.path.join(get_directory('processing', root), name)) as job:
+            follow = json.load(job).get('follow', False)
+        if follow:
+            thread = threading.Thread(target=_process_in_thread, args=(name, root))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        else:
+            status = process(name, root)
+            if log is not None:
+                log.write("%s: %s\n" % (name, status))
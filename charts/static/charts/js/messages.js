@@ -0,0 +1,18 @@
+/* Failure messages can be tens of KB each, so pages only carry a link to
+ * them and they are fetched when the user asks for one */
+$(function() {
+    $(document).on('click', '.load-message', function(e) {
+        e.preventDefault();
+        var link = $(this);
+        var message = link.next('pre.message');
+
+        if (message.data('loaded')) {
+            message.toggle();
+            return;
+        }
+
+        $.get(link.data('url'), function(text) {
+            message.text(text).data('loaded', true).show();
+        });
+    });
+});
@@ -0,0 +1,53 @@
+/* Draws a trend chart from rows built by charts/analytics.py, each one being
+ * [label, link, passes, fails, average fails, rolling pass rate %, change].
+ * Clicking a point opens its link. Needs the Google corechart package. */
+function drawTrend(elementId, rows, title) {
+    var data = new google.visualization.DataTable();
+    data.addColumn('string', 'Date');
+    data.addColumn('number', 'Passes');
+    data.addColumn('number', 'Fails');
+    data.addColumn('number', 'Fails (moving average)');
+    data.addColumn('number', 'Pass rate %');
+    data.addColumn({type: 'string', role: 'annotation'});
+
+    var links = [];
+    data.addRows($.map(rows, function(row) {
+        links.push(row[1]);
+        return [[row[0], row[2], row[3], row[4], row[5], row[6]]];
+    }));
+
+    var options = {
+        title : title,
+        theme : 'material',
+        colors : ['#4CAF50', '#F44336', '#B71C1C', '#1565C0'],
+        width : '100%',
+        height : 500,
+        isStacked : true,
+        seriesType : 'bars',
+        series : {
+            2 : {type : 'line'},
+            3 : {type : 'line', targetAxisIndex : 1}
+        },
+        vAxes : {
+            1 : {minValue : 0, maxValue : 100}
+        },
+        explorer : {
+            axis : 'horizontal',
+            actions : ['dragToZoom', 'rightClickToReset']
+        }
+    };
+
+    var chart = new google.visualization.ComboChart(document.getElementById(elementId));
+
+    google.visualization.events.addListener(chart, 'select', function() {
+        var selectedItem = chart.getSelection()[0];
+        if (selectedItem != null && selectedItem.row != null) {
+            window.location.href = links[selectedItem.row];
+        }
+    });
+
+    chart.draw(data, options);
+    $(window).resize(function() {
+        chart.draw(data, options);
+    });
+}
@@ -20,11 +20,15 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 from charts.widgets import ToasterTable
-from charts.models import TestRun, TestCaseResult
+from charts.models import TestRun, TestCaseResult, TestCaseAttachment, sum_counts
+from charts import pagecache
+from charts import archive
+from charts import partitions
 from django.db.models import Q
 from django.db.models import Count, Max, Min, Sum, Avg
 from django.conf.urls import url
 import re, urlparse
+import collections
 
 class TestReportTable(ToasterTable):
     """Table of layers in Toaster"""
@@ -35,15 +39,33 @@ class TestReportTable(ToasterTable):
         self.default_orderby = "target"
 
     def setup_queryset(self, *args, **kwargs):
-        testruns = TestRun.objects.filter(release=kwargs['release']).distinct('testplan', 'target', 'hw')
+        self.release = kwargs['release']
+        testruns = TestRun.objects.filter(release=self.release).distinct('testplan', 'target', 'hw').select_related('testplan')
 
         self.queryset = testruns.order_by(self.default_orderby)
 
+    def prepare_rows(self, rows):
+        # Runs and results of every plan-environment in two queries, rather
+        # than several for each row
+        run_ids = collections.defaultdict(list)
+        for id, testplan, target, hw in (TestRun.objects.filter(release=self.release).order_by('id')
+                                         .values_list('id', 'testplan_id', 'target', 'hw')):
+            run_ids[(testplan, target, hw)].append(id)
+
+        counts = sum_counts(TestRun.objects.filter(release=self.release), 'testplan', 'target', 'hw')
+
+        for row in rows:
+            plan_env = (row.testplan_id, row.target, row.hw)
+            row._plan_env_run_ids = run_ids[plan_env]
+            row._plan_env_counts = counts.get(plan_env, {})
+
+        return rows
+
     def setup_columns(self, *args, **kwargs):
 
         testrun_template = '''\
-        {% for testrun in data.get_for_plan_env %}\
-            <a href="{% url 'charts:testrun' testrun.id %}">{{ testrun.id }} </a>\
+        {% for id in data.get_plan_env_run_ids %}\
+            <a href="{% url 'charts:testrun' id %}">{{ id }} </a>\
         {% endfor %}\
         '''
 
@@ -210,7 +232,7 @@ class SearchTable(ToasterTable):
             ['testplan__name', 'version', 'release', 'test_type', 'poky_commit',
              'poky_branch', 'target', 'image_type', 'hw_arch', 'hw'])
 
-        found_entries = TestRun.objects.filter(entry_query)
+        found_entries = TestRun.objects.filter(entry_query).select_related('testplan')
 
         self.queryset = found_entries.order_by(self.default_orderby)
 
@@ -278,7 +300,9 @@ class TestCaseTable(ToasterTable):
             if self.request.GET['name']:
                 query = urlparse.urlparse(self.request.get_full_path()).query
                 query_string = urlparse.parse_qs(query)['name'][0].encode('ascii', 'ignore')
-                results = TestCaseResult.objects.filter(testcase_id=query_string).order_by('-testrun__start_date')
+                results = (TestCaseResult.objects.filter(testcase__name=query_string).select_related('testrun')
+                           .defer('message', 'testrun__services_running', 'testrun__package_versions_installed')
+                           .order_by('-testrun__start_date'))
 
         self.queryset = results
 
@@ -321,10 +345,102 @@ class TestCaseTable(ToasterTable):
                         field_name="testrun__release")
 
 
+class TestRunResultsTable(ToasterTable):
+    """Table used inside a Test Run's page"""
+
+    def __init__(self, *args, **kwargs):
+        ToasterTable.__init__(self, False)
+        self.default_orderby = "testcase__name"
+
+    def setup_queryset(self, *args, **kwargs):
+        # Messages can be up to 30k chars each, they are loaded on demand
+        self.testrun_id = kwargs['id']
+        results = (partitions.for_testrun(TestCaseResult.objects.filter(testrun_id=kwargs['id']), kwargs['id'])
+                   .select_related('testcase').defer('message'))
+
+        # Test Runs of archived releases have their results in the archive
+        if not results.exists():
+            results = archive.results_of(kwargs['id']) or results
+
+        self.queryset = results.order_by(self.default_orderby)
+
+    def get_release(self, *args, **kwargs):
+        return pagecache.release_of_testrun(kwargs['id'])
+
+    def prepare_rows(self, rows):
+        # Attachments of the whole page in one query
+        attachments = collections.defaultdict(list)
+        for attachment in (TestCaseAttachment.objects.filter(testrun_id=self.testrun_id,
+                                                             testcase_id__in=[row.testcase_id for row in rows])
+                           .order_by('name')):
+            attachments[attachment.testcase_id].append(attachment)
+
+        for row in rows:
+            row.testcase_attachments = attachments[row.testcase_id]
+
+        return rows
+
+    def setup_columns(self, *args, **kwargs):
+
+        testcase_template = '''\
+        {% with "https://bugzilla.yoctoproject.org/tr_show_case.cgi?case_id="|add:data.testcase.name as link %}\
+        <a href="{{ link }}" target="_blank">{{ data.testcase.name }}</a>\
+        {% endwith %}\
+        '''
+
+        self.add_column(title="Test Case",
+                        hideable=False,
+                        orderable=True,
+                        static_data_name="testcase__name",
+                        static_data_template=testcase_template)
+
+        result_template = '''\
+        {% if data.result == 'failed' %}\
+            <span class="text-danger">{{ data.result }}</span>\
+        {% elif data.result == 'passed' %}\
+            <span class="text-success">{{ data.result }}</span>\
+        {% else %}\
+            <span>{{ data.result }}</span>\
+        {% endif %}\
+        '''
+
+        self.add_column(title="Status",
+                        hideable=False,
+                        orderable=True,
+                        static_data_name="result",
+                        static_data_template=result_template)
+
+        message_template = '''\
+        {% if data.result == 'failed' %}\
+            <a href="#" class="load-message" data-url="{% url 'charts:testcaseresult_message' data.id %}">Show message</a>\
+            <pre class="message" style="display:none"></pre>\
+        {% endif %}\
+        '''
+
+        self.add_column(title="Message",
+                        hideable=True,
+                        orderable=False,
+                        static_data_name="message",
+                        static_data_template=message_template)
+
+        attachments_template = '''\
+        {% for attachment in data.testcase_attachments %}\
+            <a href="{% url 'charts:attachment' attachment.id attachment.name %}">{{ attachment.name }}</a><br />\
+        {% endfor %}\
+        '''
+
+        self.add_column(title="Attachments",
+                        hideable=True,
+                        orderable=False,
+                        static_data_name="attachments",
+                        static_data_template=attachments_template)
+
+
 # This needs to be staticaly defined here as django reads the url patterns
 # on start up
 urlpatterns = (
     url(r'testreport/(?P<release>[\w.]+)/(?P<cmd>\w+)*', TestReportTable.as_view(), name=TestReportTable.__name__.lower()),
     url(r'search/(?P<cmd>\w+)*', SearchTable.as_view(), name=SearchTable.__name__.lower()),
-    url(r'testcasefilter/(?P<cmd>\w+)*', TestCaseTable.as_view(), name=TestCaseTable.__name__.lower())
+    url(r'testcasefilter/(?P<cmd>\w+)*', TestCaseTable.as_view(), name=TestCaseTable.__name__.lower()),
+    url(r'testrun/(?P<id>[0-9]+)/(?P<cmd>\w+)*', TestRunResultsTable.as_view(), name=TestRunResultsTable.__name__.lower())
 )
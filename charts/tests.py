@@ -1,3 +1,1301 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.urlresolvers import resolve, reverse
+from django.db import connection, reset_queries
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.utils.http import urlencode
+import StringIO
+import collections
+import datetime
+import json
+import logging
+import os
+import re
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+from unittest import skipUnless
 
-# Create your tests here.
+from .models import (TestRun, TestCaseResult, ResultRollup, CommitRollup, InventorySnapshot, Attachment, TestReport, Job, Version, Release,
+                     FailureSignature, count_results, sum_counts)
+from . import catalog
+from . import dataset
+from . import pagecache
+from . import rollups
+from . import analytics
+from . import archive
+from . import partitions
+from . import inventory
+from . import attachments
+from . import transfer
+from . import ingest
+from . import routers
+from . import spool
+from . import jobs
+from . import heatmap
+from . import commits
+from . import parsers
+from . import reports
+from . import releases
+from . import signatures
+from . import middleware
+
+# Sizes of the two datasets every page is requested on. The second one is
+# generated on top of the first, making its releases hold more runs and
+# plan-environments, and its runs more results.
+SMALL_DATASET = dict(versions=1, releases=2, plan_envs=2, runs=1, testcases=10, failure_rate=0.2, seed=0)
+LARGE_DATASET = dict(versions=2, releases=2, plan_envs=5, runs=3, testcases=40, failure_rate=0.2, seed=1)
+
+# Most queries any request of a page may run, whatever the size of the data
+QUERY_BUDGETS = {
+    'index' : 2,
+    'heatmap' : 1,
+    'testrun_filter' : 10,
+    'testrun_filter_rollups' : 9,
+    'testcase_filter' : 1,
+    'testrun' : 3,
+    'testcaseresult_message' : 1,
+    'inventory_diff' : 2,
+    'first_bad_commit' : 4,
+    'testreport' : 2,
+    'saved_report' : 2,
+    'plan_env' : 3,
+    'testreporttable' : 5,
+    'searchtable' : 4,
+    'testcasetable' : 4,
+    'testrunresultstable' : 6,
+}
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class QueryBudgetTest(TestCase):
+    """ Fails when the number of queries of a page grows with the data, e.g.
+        a count run for every row of a table or every Test Run of a release.
+    """
+
+    def count_queries(self, url):
+        # Pages must be built from the database, not served from the cache
+        cache.clear()
+        reset_queries()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def assertQueryBudget(self, name, get_url):
+        """ get_url is given the latest Test Run and failed Test Case Result
+            and returns the url to request """
+
+        counts = []
+        for size in (SMALL_DATASET, LARGE_DATASET):
+            dataset.generate(**size)
+            testrun = TestRun.objects.filter(release='1.8_M1.rc1').order_by('-id').first()
+            result = TestCaseResult.objects.filter(testrun__release=testrun.release, result='failed').order_by('-id').first()
+            counts.append(self.count_queries(get_url(testrun, result)))
+
+        self.assertEqual(counts[0], counts[1],
+                         "%s runs %d queries on the small dataset and %d on the large one" % (name, counts[0], counts[1]))
+        self.assertLessEqual(counts[1], QUERY_BUDGETS[name],
+                             "%s runs %d queries, its budget is %d" % (name, counts[1], QUERY_BUDGETS[name]))
+
+    def table_url(self, table, args=(), **params):
+        return reverse("charts:" + table, args=args) + "?" + urlencode(sorted(dict(pagecache.TABLE_DEFAULT_PARAMS, **params).items()))
+
+    def test_index(self):
+        self.assertQueryBudget('index', lambda testrun, result: reverse('charts:index_2', args=[testrun.version]))
+
+    def test_heatmap(self):
+        self.assertQueryBudget('heatmap', lambda testrun, result: reverse('charts:heatmap', args=[testrun.version]))
+
+    def test_testrun_filter(self):
+        self.assertQueryBudget('testrun_filter', lambda testrun, result:
+                               reverse('charts:testrun_filter') + '?' + urlencode({'release' : testrun.release}))
+
+    def test_testrun_filter_rollups(self):
+        self.assertQueryBudget('testrun_filter_rollups', lambda testrun, result:
+                               reverse('charts:testrun_filter') + '?' + urlencode({'from' : '2000-01-01', 'to' : '2100-01-01'}))
+
+    def test_testcase_filter(self):
+        self.assertQueryBudget('testcase_filter', lambda testrun, result:
+                               reverse('charts:testcase_filter') + '?' + urlencode({'name' : result.testcase.name}))
+
+    def test_testrun(self):
+        self.assertQueryBudget('testrun', lambda testrun, result: reverse('charts:testrun', args=[testrun.id]))
+
+    def test_testcaseresult_message(self):
+        self.assertQueryBudget('testcaseresult_message', lambda testrun, result:
+                               reverse('charts:testcaseresult_message', args=[result.id]))
+
+    def test_inventory_diff(self):
+        self.assertQueryBudget('inventory_diff', lambda testrun, result: reverse('charts:inventory_diff', args=[
+            testrun.id, 'packages', TestRun.objects.order_by('-id').values_list('id', flat=True).first()]))
+
+    def test_first_bad_commit(self):
+        self.assertQueryBudget('first_bad_commit', lambda testrun, result: reverse('charts:first_bad_commit', args=[
+            result.testcase.name, testrun.testplan_id, testrun.target, testrun.hw]))
+
+    def test_testreport(self):
+        self.assertQueryBudget('testreport', lambda testrun, result: reverse('charts:testreport', args=[testrun.release]))
+
+    def test_saved_report(self):
+        self.assertQueryBudget('saved_report', lambda testrun, result: reverse('charts:saved_report', args=[
+            reports.save({'release' : testrun.release}).testreport_id]))
+
+    def test_plan_env(self):
+        self.assertQueryBudget('plan_env', lambda testrun, result:
+                               reverse('charts:plan_env', args=[testrun.release, testrun.testplan_id, testrun.target, testrun.hw]))
+
+    def test_testreporttable(self):
+        self.assertQueryBudget('testreporttable', lambda testrun, result:
+                               self.table_url('testreporttable', [testrun.release]))
+
+    def test_searchtable(self):
+        self.assertQueryBudget('searchtable', lambda testrun, result: self.table_url('searchtable', q=testrun.release))
+
+    def test_testcasetable(self):
+        self.assertQueryBudget('testcasetable', lambda testrun, result:
+                               self.table_url('testcasetable', name=result.testcase.name))
+
+    def test_testrunresultstable(self):
+        self.assertQueryBudget('testrunresultstable', lambda testrun, result:
+                               self.table_url('testrunresultstable', [testrun.id]))
+
+class RollupTest(TestCase):
+
+    def rollup_counts(self):
+        return sorted(ResultRollup.objects.exclude(count=0).values_list(
+            'bucket', 'bucket_start', 'version', 'release', 'testplan', 'target', 'hw', 'result', 'count'))
+
+    def test_incremental_matches_rebuild(self):
+        dataset.generate(**LARGE_DATASET)
+        incremental = self.rollup_counts()
+
+        rollups.rebuild()
+        self.assertEqual(incremental, self.rollup_counts())
+
+        totals = count_results(TestCaseResult.objects.all(), 'testrun__version')
+        for version, counts in totals.items():
+            for bucket in rollups.BUCKET_DAYS:
+                series = rollups.series(bucket, version=version)
+                for result, count in counts.items():
+                    self.assertEqual(sum(point.get(result, 0) for day, point in series), count)
+
+    def test_remove_testrun(self):
+        dataset.generate(**SMALL_DATASET)
+        before = self.rollup_counts()
+
+        testrun = TestRun.objects.order_by('-id').first()
+        rollups.remove_testrun(testrun)
+        rollups.add_testrun(testrun)
+        self.assertEqual(before, self.rollup_counts())
+
+    def test_pick_bucket(self):
+        day = datetime.date(2015, 5, 15)
+        self.assertIsNone(rollups.pick_bucket(day, day + datetime.timedelta(days=10)))
+        self.assertEqual(rollups.pick_bucket(day, day + datetime.timedelta(days=60)), 'day')
+        self.assertEqual(rollups.pick_bucket(day, day + datetime.timedelta(days=730)), 'week')
+        self.assertEqual(rollups.bucket_start('week', day), datetime.date(2015, 5, 11))
+
+class AnalyticsTest(TestCase):
+
+    def test_rolling_series(self):
+        self.assertEqual(analytics.moving_average([1, 2, 3, 4], 2).tolist(), [1, 1.5, 2.5, 3.5])
+        self.assertEqual(analytics.rolling_pass_rate([1, 1, 0, 0], [0, 1, 1, 0], 2).tolist(), [1, 2 / 3.0, 1 / 3.0, 0])
+
+    def test_change_points(self):
+        self.assertEqual(analytics.change_points([1] * 30 + [0] * 30, [0] * 30 + [1] * 30).tolist(), [30])
+        self.assertEqual(analytics.change_points([1] * 60, [0] * 60).tolist(), [])
+
+    def test_lttb_keeps_extremes(self):
+        values = [0] * 1000
+        values[567] = 10
+        index = analytics.lttb(values, 50)
+        self.assertEqual(len(index), 50)
+        self.assertIn(567, index)
+        self.assertEqual((index[0], index[-1]), (0, 999))
+
+    def test_chart_rows_keep_change_points(self):
+        count = analytics.MAX_POINTS * 4
+        passed = [1] * (count // 2) + [0] * (count // 2)
+        rows = analytics.chart_rows(range(count), range(count), passed, [1 - value for value in passed])
+        self.assertLessEqual(len(rows), analytics.MAX_POINTS + 1)
+        self.assertEqual([row[0] for row in rows if row[6]], [count // 2])
+
+class CommitTest(TestCase):
+
+    def add_testrun(self, commit, day, result):
+        testrun = TestRun.objects.create(testplan=self.testplan, release='r', poky_commit=commit, poky_branch='master',
+                                         target='t', hw='h', start_date=datetime.datetime(2015, 5, day, tzinfo=timezone.utc))
+        ids = catalog.get_ids(['1', '2'])
+        if result != 'idle':
+            TestCaseResult.objects.create(testrun=testrun, testcase_id=ids['1'], result=result)
+        TestCaseResult.objects.create(testrun=testrun, testcase_id=ids['2'], result='passed')
+        testrun.update_counts()
+        rollups.add_testrun(testrun)
+        return testrun
+
+    def setUp(self):
+        self.testplan = dataset.TestPlan.objects.create(name='p')
+        catalog.plan(self.testplan, ['1', '2'])
+        for commit, day, result in (('a', 1, 'passed'), ('b', 2, 'passed'), ('c', 4, 'failed'), ('d', 5, 'failed')):
+            self.add_testrun(commit, day, result)
+        # Imported late, commit c was first tested before d but without test case 1
+        self.late = self.add_testrun('c', 3, 'idle')
+
+    def test_rollups(self):
+        self.assertEqual(sorted(CommitRollup.objects.filter(poky_commit='c').values_list('result', 'count', 'first_seen')),
+                         [('failed', 1, datetime.datetime(2015, 5, 3, tzinfo=timezone.utc)),
+                          ('idle', 1, datetime.datetime(2015, 5, 3, tzinfo=timezone.utc)),
+                          ('passed', 2, datetime.datetime(2015, 5, 3, tzinfo=timezone.utc))])
+        incremental = sorted(CommitRollup.objects.values_list('poky_commit', 'result', 'count', 'first_seen'))
+        rollups.rebuild()
+        self.assertEqual(incremental, sorted(CommitRollup.objects.values_list('poky_commit', 'result', 'count', 'first_seen')))
+
+    def test_remove_testrun(self):
+        rollups.remove_testrun(self.late)
+        self.late.delete()
+        # Rows left with nothing are dropped, and the commit starts with its next run
+        self.assertEqual(sorted(CommitRollup.objects.filter(poky_commit='c').values_list('result', 'count', 'first_seen')),
+                         [('failed', 1, datetime.datetime(2015, 5, 4, tzinfo=timezone.utc)),
+                          ('passed', 1, datetime.datetime(2015, 5, 4, tzinfo=timezone.utc))])
+        self.assertFalse(ResultRollup.objects.filter(count=0).exists())
+
+        incremental = sorted(CommitRollup.objects.values_list('poky_commit', 'result', 'count', 'first_seen'))
+        rollups.rebuild()
+        self.assertEqual(incremental, sorted(CommitRollup.objects.values_list('poky_commit', 'result', 'count', 'first_seen')))
+
+    def test_find_first_bad(self):
+        found = commits.find_first_bad('1', self.testplan.id, 't', 'h')
+        self.assertEqual((found['last_good']['commit'], found['first_bad']['commit']), ('b', 'c'))
+        self.assertEqual([commit['commit'] for commit in found['suspects']], ['c'])
+
+        self.assertIsNone(commits.find_first_bad('2', self.testplan.id, 't', 'h')['first_bad'])
+        self.assertIsNone(commits.find_first_bad('3', self.testplan.id, 't', 'h'))
+
+class ReportTest(TestCase):
+
+    def get_rows(self, testreport):
+        return sorted(testreport.testreportrun_set.values_list('testrun', 'start_date', *TestRun.COUNTERS))
+
+    def get_matches(self, filters):
+        return sorted(reports.get_testruns(filters).values_list('id', 'start_date', *TestRun.COUNTERS))
+
+    def test_saved_report_follows_imports(self):
+        dataset.generate(**SMALL_DATASET)
+        testrun = TestRun.objects.order_by('id').first()
+        filters = {'testplan' : str(testrun.testplan_id), 'target' : testrun.target, 'from' : '2000-01-01'}
+
+        response = self.client.post(reverse('charts:save_report'), dict(filters, release=''))
+        testreport = TestReport.objects.get()
+        self.assertRedirects(response, reverse('charts:saved_report', args=[testreport.testreport_id]))
+        self.assertEqual(testreport.get_filters(), filters)
+        self.assertEqual(reports.save(filters), testreport)
+        self.assertEqual(self.get_rows(testreport), self.get_matches(filters))
+
+        # Runs generated later are added, the ones not matching are not
+        dataset.generate(**dict(SMALL_DATASET, releases=3, seed=1))
+        self.assertEqual(self.get_rows(testreport), self.get_matches(filters))
+        self.assertLess(len(self.get_rows(testreport)), TestRun.objects.count())
+
+        TestRun.objects.filter(pk=testrun.pk).update(passed=0, failed=0)
+        jobs.update_counts(testrun.pk)
+        self.assertEqual(self.get_rows(testreport), self.get_matches(filters))
+
+        response = self.client.get(reverse('charts:saved_report', args=[testreport.testreport_id]))
+        self.assertEqual(response.context['testruns'], len(self.get_matches(filters)))
+        self.assertEqual(response.context['counts'], sum_counts(reports.get_testruns(filters)))
+
+        self.assertEqual(self.client.post(reverse('charts:save_report'), {'from' : 'never'}).status_code, 400)
+
+    def test_matches(self):
+        dataset.generate(**SMALL_DATASET)
+        testrun = TestRun.objects.order_by('id').last()
+        day = timezone.localtime(testrun.start_date).date()
+        for filters in ({'release' : testrun.release, 'hw' : testrun.hw}, {'testplan' : str(testrun.testplan_id)},
+                        {'from' : str(day), 'to' : str(day)}, {'to' : str(day - datetime.timedelta(days=1))}):
+            self.assertEqual(set(other.pk for other in TestRun.objects.all() if reports.matches(other, filters)),
+                             set(reports.get_testruns(filters).values_list('pk', flat=True)))
+
+        # Reports are read once, runs are not queried again
+        reports.save({'release' : 'none'})
+        testruns = list(TestRun.objects.all())
+        with self.assertNumQueries(1):
+            reports.add_testruns(testruns)
+
+class ReleaseTest(TestCase):
+
+    def get_catalog(self):
+        return (sorted(releases.get_releases().values_list('name', 'version__name', 'first_run', 'last_run', 'testruns',
+                                                           *TestRun.COUNTERS)),
+                sorted(Version.objects.values_list('name', 'sort_key', 'first_run', 'last_run')))
+
+    def test_sort_key(self):
+        self.assertEqual(sorted(['1.10', '1.9', '1.8_M10.rc1', '1.8_M9.rc2', '1.8_M9.rc1'], key=releases.sort_key),
+                         ['1.8_M9.rc1', '1.8_M9.rc2', '1.8_M10.rc1', '1.9', '1.10'])
+
+    def test_incremental_matches_rebuild(self):
+        dataset.generate(**LARGE_DATASET)
+        # Imported the way add_testrun.py does
+        testrun = TestRun.objects.create(testplan=TestRun.objects.first().testplan, version='1.10', release='1.10_M1.rc1',
+                                         start_date=timezone.now())
+        rollups.add_testrun(testrun)
+        ingest.import_records(testrun, iter([('a', 'passed', ''), ('b', 'failed', '')]))
+        for testrun in TestRun.objects.filter(version='1.8'):
+            rollups.remove_testrun(testrun)
+            testrun.delete()
+
+        incremental = self.get_catalog()
+        releases.rebuild()
+        self.assertEqual(incremental, self.get_catalog())
+
+        counts = sum_counts(TestRun.objects.all(), 'release')
+        self.assertEqual(dict((release.name, release.get_counts()) for release in releases.get_releases()), counts)
+        self.assertEqual(list(Version.objects.order_by('-sort_key').values_list('name', flat=True)), ['1.10', '1.9'])
+
+        response = self.client.get(reverse('charts:index'))
+        self.assertEqual(response.context['versions'], ['1.10', '1.9'])
+        self.assertEqual(list(response.context['testruns']), ['1.10_M1.rc1'])
+
+    def test_dates_and_versions(self):
+        testplan = dataset.TestPlan.objects.create(name='p')
+        day = datetime.datetime(2015, 5, 15, tzinfo=timezone.utc)
+        testruns = [TestRun.objects.create(testplan=testplan, version=version, release='r', start_date=start_date)
+                    for version, start_date in (('2.0', day + datetime.timedelta(days=1)), ('1.0', day),
+                                                ('1.0', day + datetime.timedelta(days=2)))]
+        releases.rebuild()
+        # The release belongs to the version of its earliest run, not to the first one found
+        self.assertEqual(Release.objects.get().version.name, '1.0')
+        self.assertEqual(list(Version.objects.values_list('name', 'first_run', 'last_run')),
+                         [('1.0', day, day + datetime.timedelta(days=2))])
+
+        # Removed runs no longer count in the dates
+        for testrun in testruns[1:]:
+            rollups.remove_testrun(testrun)
+            testrun.delete()
+            left = [run.start_date for run in testruns if TestRun.objects.filter(pk=run.pk).exists()]
+            self.assertEqual(Release.objects.values_list('first_run', 'last_run').get(), (min(left), max(left)))
+            self.assertEqual(Version.objects.values_list('first_run', 'last_run').get(), (min(left), max(left)))
+
+class HeatmapTest(TestCase):
+
+    def test_cells_match_plan_env_counts(self):
+        dataset.generate(**LARGE_DATASET)
+        version = TestRun.objects.values_list('version', flat=True).first()
+        testruns = TestRun.objects.filter(version=version)
+
+        releases, rows = heatmap.build(version)
+        self.assertEqual(sorted(releases), sorted(set(testruns.values_list('release', flat=True))))
+
+        counts = sum_counts(testruns, 'testplan', 'target', 'hw', 'release')
+        cells = dict(((row['testplan'], row['target'], row['hw'], release), cell)
+                     for row in rows for release, cell in row['cells'] if cell)
+        self.assertEqual(set(cells), set(counts))
+        for key, cell in cells.items():
+            self.assertEqual((cell['passed'], cell['failed'], cell['total']),
+                             (counts[key]['passed'], counts[key]['failed'], sum(counts[key].values())))
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ArchiveTest(TestCase):
+
+    def setUp(self):
+        dataset.generate(**SMALL_DATASET)
+        self.release = '1.8_M1.rc1'
+        self.results = sorted(TestCaseResult.objects.filter(testrun__release=self.release).values_list(*archive.FIELDS))
+        self.failed = TestCaseResult.objects.filter(testrun__release=self.release, result='failed').first()
+        self.testrun = self.failed.testrun
+        call_command('archive_releases', self.release, stdout=open(os.devnull, 'w'))
+
+    def test_results_are_moved(self):
+        self.assertFalse(TestCaseResult.objects.filter(testrun__release=self.release).exists())
+        self.assertTrue(TestCaseResult.objects.exclude(testrun__release=self.release).exists())
+        self.assertEqual(sum(len(archive.results_of(testrun.id)) for testrun in TestRun.objects.filter(release=self.release)),
+                         len(self.results))
+
+    def test_pages_read_the_archive(self):
+        response = self.client.get(reverse('charts:testcaseresult_message', args=[self.failed.id]))
+        self.assertEqual(response.content, self.failed.message)
+
+        response = self.client.get(reverse('charts:testrunresultstable', args=[self.testrun.id]) + '?limit=100&orderby=-result')
+        data = json.loads(response.content)
+        self.assertEqual(data['total'], sum(self.testrun.get_counts().values()))
+        self.assertEqual(len(data['rows']), data['total'])
+
+        response = self.client.get(reverse('charts:testrun', args=[self.testrun.id]))
+        self.assertEqual(response.context['failed'], self.testrun.failed)
+
+        response = self.client.get(reverse('charts:plan_env', args=[self.release, self.testrun.testplan_id,
+                                                                    self.testrun.target, self.testrun.hw]))
+        self.assertContains(response, self.failed.testcase.name)
+
+    def test_restore(self):
+        call_command('archive_releases', self.release, restore=True, stdout=open(os.devnull, 'w'))
+        self.assertEqual(sorted(TestCaseResult.objects.filter(testrun__release=self.release).values_list(*archive.FIELDS)),
+                         self.results)
+
+class PartitionTest(TestCase):
+
+    def test_partition_name(self):
+        self.assertEqual(partitions.partition_name('1.8'), 'charts_testcaseresult_v1_8')
+        self.assertEqual(partitions.partition_name('2.0 M1'), 'charts_testcaseresult_v2_0_m1')
+
+    def test_results_carry_their_version(self):
+        dataset.generate(**LARGE_DATASET)
+        self.assertFalse(TestCaseResult.objects.exclude(version=F('testrun__version')).exists())
+
+        results = partitions.for_release(TestCaseResult.objects.all(), '1.9_M1.rc1')
+        self.assertEqual(set(results.values_list('version', flat=True).distinct()), set(['1.9']))
+        testrun = TestRun.objects.filter(version='1.8').first()
+        results = partitions.for_testrun(TestCaseResult.objects.all(), testrun.id)
+        self.assertEqual(results.count(), TestCaseResult.objects.filter(version='1.8').count())
+
+    def test_release_of_several_versions(self):
+        dataset.generate(**SMALL_DATASET)
+        testrun = TestRun.objects.filter(release='1.8_M1.rc1').first()
+        TestRun.objects.filter(pk=testrun.pk).update(version='1.8.1')
+        TestCaseResult.objects.filter(testrun=testrun).update(version='1.8.1')
+        results = TestCaseResult.objects.filter(testrun__release='1.8_M1.rc1')
+        self.assertEqual(partitions.for_release(results, '1.8_M1.rc1').count(), results.count())
+
+    @skipUnless(partitions.is_supported(), "Needs PostgreSQL 11 or newer")
+    def test_convert_and_detach(self):
+        self.addCleanup(partitions._partitioned_versions.clear)
+        cursor = connection.cursor()
+        # Tables can't be altered with foreign key checks pending, the test
+        # runs in a single transaction
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        dataset.generate(**SMALL_DATASET)
+        count = TestCaseResult.objects.count()
+        self.assertTrue(partitions.convert())
+        self.assertFalse(partitions.convert())
+
+        self.assertEqual([name for name, bound in partitions.get_partitions(cursor)],
+                         [partitions.DEFAULT_PARTITION, partitions.partition_name('1.8')])
+        self.assertEqual(TestCaseResult.objects.count(), count)
+
+        # Imports of a new version create its partition
+        dataset.generate(**dict(SMALL_DATASET, versions=2, seed=1))
+        cursor.execute("SELECT COUNT(*) FROM %s" % partitions.partition_name('1.9'))
+        self.assertEqual(cursor.fetchone()[0], TestCaseResult.objects.filter(version='1.9').count())
+        self.assertGreater(TestCaseResult.objects.filter(version='1.9').count(), 0)
+
+        self.assertTrue(partitions.detach('1.9'))
+        self.assertFalse(TestCaseResult.objects.filter(version='1.9').exists())
+        cursor.execute("SELECT to_regclass(%s)", [partitions.partition_name('1.9')])
+        self.assertIsNotNone(cursor.fetchone()[0])
+
+        self.assertTrue(partitions.detach('1.8', drop=True))
+        self.assertFalse(TestCaseResult.objects.filter(version='1.8').exists())
+        cursor.execute("SELECT to_regclass(%s)", [partitions.partition_name('1.8')])
+        self.assertIsNone(cursor.fetchone()[0])
+        self.assertFalse(partitions.detach('1.8'))
+
+    @skipUnless(partitions.is_supported(), "Needs PostgreSQL 11 or newer")
+    def test_other_partitions_are_pruned(self):
+        self.addCleanup(partitions._partitioned_versions.clear)
+        cursor = connection.cursor()
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        dataset.generate(**SMALL_DATASET)
+        self.assertTrue(partitions.convert())
+        dataset.generate(**dict(SMALL_DATASET, versions=2, seed=1))
+
+        results = partitions.for_release(TestCaseResult.objects.filter(result='failed'), '1.8_M1.rc1')
+        sql, params = results.query.sql_with_params()
+        names = [name for name, bound in partitions.get_partitions(cursor)]
+        # Partitions pruned while running the query are never executed
+        cursor.execute("EXPLAIN ANALYZE " + sql, params)
+        scanned = set()
+        for line, in cursor.fetchall():
+            for name in names:
+                if re.search(r'\bon %s\b' % name, line) and '(never executed)' not in line:
+                    scanned.add(name)
+        self.assertEqual(scanned, set([partitions.partition_name('1.8')]))
+
+class SignatureTest(TestCase):
+
+    def test_normalize(self):
+        self.assertEqual(signatures.normalize(
+            "2015-05-15 11:39:23 boot at 13:41:27.456\r\n\n[    0.270279] oops at 0xdeadbeef in 7f3a9c2e10\n"
+            "  File \"/home/build/poky/meta/lib/oeqa/runtime/ping.py\", line 42\n"),
+            "<date> boot at <time>\n[<ktime>] oops at <addr> in <addr>\nFile \"ping.py\", line <n>")
+
+    def test_compute(self):
+        message = "Traceback:\n  File \"/srv/%s/ping.py\", line %d\nAssertionError: no reply at %s\n"
+        signature, summary = signatures.compute(message % ('a', 10, '2015-05-15 11:39:23'))
+        self.assertEqual(summary, "AssertionError: no reply at <date>")
+        self.assertEqual(signatures.compute(message % ('b', 12, '2016-01-02 10:00:00'))[0], signature)
+        self.assertNotEqual(signatures.compute(message.replace('no reply', 'timeout') % ('a', 10, ''))[0], signature)
+        self.assertEqual(signatures.compute(" \r\n"), (None, ''))
+
+    def test_dates_only_extend(self):
+        days = [datetime.datetime(2015, 5, day, tzinfo=timezone.utc) for day in (1, 2, 3)]
+        failure_signature = signatures.index_failure("Error: x", days[1])
+        signatures.index_failure("Error: x", days[2])
+        signatures.index_failure("Error: x", days[0], count=2)
+        signatures.index_failure("Error: x")
+        failure_signature.refresh_from_db()
+        self.assertEqual((failure_signature.first_seen, failure_signature.last_seen, failure_signature.occurrences),
+                         (days[0], days[2], 5))
+
+    def test_top_signatures(self):
+        dataset.generate(**SMALL_DATASET)
+        failures = TestCaseResult.objects.filter(result='failed').exclude(signature=None)
+        counts = collections.Counter(failures.values_list('signature__signature', flat=True))
+        self.assertGreater(len(counts), 1)
+
+        top = list(signatures.top_signatures(TestCaseResult.objects.all(), limit=2))
+        self.assertEqual([row['count'] for row in top], sorted(counts.values(), reverse=True)[:2])
+        for row in top:
+            self.assertEqual(row['count'], counts[row['signature__signature']])
+            self.assertEqual(row['testruns'], failures.filter(signature__signature=row['signature__signature'])
+                             .values('testrun').distinct().count())
+
+class InventoryTest(TestCase):
+
+    def test_parse_packages(self):
+        self.assertEqual(inventory.parse_packages("bash - 4.3.30-r0\nbusybox 1.23.1-r0\n\nlibc6=2.21\nrpm-5.4.14-r0.core2_64\nzlib"),
+                         {'bash' : '4.3.30-r0', 'busybox' : '1.23.1-r0', 'libc6' : '2.21', 'rpm' : '5.4.14-r0.core2_64', 'zlib' : ''})
+        self.assertEqual(inventory.parse_services("connmand, dropbear,udevd"), {'connmand' : '', 'dropbear' : '', 'udevd' : ''})
+
+    def test_snapshots_are_shared(self):
+        dataset.generate(**SMALL_DATASET)
+        # One package list per release, the same services on all runs
+        self.assertEqual(InventorySnapshot.objects.filter(kind='packages').count(), 2)
+        self.assertEqual(InventorySnapshot.objects.filter(kind='services').count(), 1)
+        self.assertEqual(TestRun.objects.filter(packages__isnull=True).count(), 0)
+
+    def test_diff(self):
+        testrun = TestRun.objects.create(testplan_id=dataset.TestPlan.objects.create(name='p').id, start_date='2015-05-15T00:00:00Z')
+        other = TestRun.objects.get(pk=testrun.pk)
+        other.pk = None
+        other.save()
+
+        inventory.store(testrun, packages="bash - 4.3\nbusybox - 1.23\nrpm - 5.4", services='')
+        inventory.store(other, packages="bash - 4.3\nbusybox - 1.24\nsmartpm - 1.4", services='')
+
+        response = self.client.get(reverse('charts:inventory_diff', args=[testrun.id, 'packages', other.id]))
+        self.assertEqual(json.loads(response.content), {
+            'added' : [['smartpm', '1.4']],
+            'removed' : [['rpm', '5.4']],
+            'changed' : [['busybox', '1.23', '1.24']],
+        })
+        self.assertEqual(self.client.get(reverse('charts:inventory_diff', args=[testrun.id, 'packages', 0])).status_code, 404)
+
+
+class TransferTest(TestCase):
+
+    def get_results(self, release):
+        return sorted(TestCaseResult.objects.filter(testrun__release=release).values_list(
+            'testrun__start_date', 'testrun__target', 'testrun__hw', 'testrun__testplan__name', 'testrun__packages__digest',
+            'testcase__name', 'result', 'message', 'version', 'signature__signature'))
+
+    def test_dump_and_load(self):
+        dataset.generate(**SMALL_DATASET)
+        release = '1.8_M1.rc1'
+        filters = reports.dumps({'release' : release})
+        TestReport.objects.create(testreport_id='r1', filters=filters, digest=reports.get_digest(filters))
+        results = self.get_results(release)
+        rollup_counts = sorted(ResultRollup.objects.filter(release=release).values_list('bucket', 'result', 'count'))
+        failures = collections.Counter(signature for signature in TestCaseResult.objects.filter(
+            testrun__release=release, result='failed').values_list('signature__signature', flat=True))
+        # Archived results are dumped too
+        archive.archive_testrun(TestRun.objects.filter(release=release).first())
+
+        path = tempfile.mktemp(suffix='.gz')
+        self.addCleanup(os.remove, path)
+        call_command('dump_releases', path, release, stdout=open(os.devnull, 'w'))
+
+        for testrun in TestRun.objects.filter(release=release):
+            rollups.remove_testrun(testrun)
+            testrun.delete()
+        TestReport.objects.all().delete()
+        # The plan now plans a test case the dumped one doesn't
+        testplan = TestRun.objects.first().testplan
+        catalog.plan(testplan, ['extra'])
+        # Signatures already on the instance add the loaded failures to their own counts
+        FailureSignature.objects.update(occurrences=5)
+
+        call_command('load_releases', path, stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.get_results(release), results)
+        self.assertEqual(dict(FailureSignature.objects.values_list('signature', 'occurrences')),
+                         dict((signature, 5 + failures[signature])
+                              for signature in FailureSignature.objects.values_list('signature', flat=True)))
+        self.assertEqual(sorted(Job.objects.filter(kind='update_counts').values_list('key', flat=True)),
+                         sorted(str(pk) for pk in testplan.testrun_set.values_list('pk', flat=True)))
+        self.assertEqual(sorted(ResultRollup.objects.filter(release=release).exclude(count=0)
+                                .values_list('bucket', 'result', 'count')), rollup_counts)
+        self.assertTrue(TestReport.objects.filter(pk='r1').exists())
+        self.assertRaises(transfer.DumpError, transfer.load, path)
+
+    def test_load_reports(self):
+        dataset.generate(**SMALL_DATASET)
+        release = '1.8_M1.rc1'
+        testrun = TestRun.objects.filter(release=release).first()
+        old_testplan = testrun.testplan
+        filters = {'testplan' : str(old_testplan.pk), 'target' : testrun.target}
+        testreport = reports.save(filters)
+        # Matches no run of the release, though its filters hold the release's name
+        reports.save({'release' : release + '0'})
+
+        path = tempfile.mktemp(suffix='.gz')
+        self.addCleanup(os.remove, path)
+        transfer.dump(path, [release])
+
+        for other in TestRun.objects.all():
+            rollups.remove_testrun(other)
+            other.delete()
+        TestReport.objects.all().delete()
+        dataset.TestPlan.objects.all().delete()
+        # The Test Plan gets a new id
+        dataset.TestPlan.objects.create(pk=old_testplan.pk, name='other')
+
+        TestReport.objects.create(testreport_id=testreport.pk, filters='{}', digest=reports.get_digest('{}'))
+        self.assertRaises(transfer.DumpError, transfer.load, path)
+        TestReport.objects.all().delete()
+
+        counts, loaded = transfer.load(path)
+        self.assertEqual(counts['testreport'], 1)
+        testplan = dataset.TestPlan.objects.get(name=old_testplan.name)
+        loaded_report = TestReport.objects.get()
+        self.assertEqual(loaded_report.pk, testreport.pk)
+        self.assertEqual(loaded_report.get_filters(), dict(filters, testplan=str(testplan.pk)))
+        self.assertEqual(sorted(loaded_report.testreportrun_set.values_list('testrun', flat=True)),
+                         sorted(TestRun.objects.filter(testplan=testplan, target=testrun.target).values_list('pk', flat=True)))
+        self.assertTrue(loaded_report.testreportrun_set.exists())
+
+    def test_load_report_of_missing_plan(self):
+        dataset.generate(**SMALL_DATASET)
+        release = '1.8_M1.rc1'
+        reports.save({'release' : release, 'testplan' : '999'})
+        path = tempfile.mktemp(suffix='.gz')
+        self.addCleanup(os.remove, path)
+        transfer.dump(path, [release])
+
+        for testrun in TestRun.objects.filter(release=release):
+            rollups.remove_testrun(testrun)
+            testrun.delete()
+        TestReport.objects.all().delete()
+        with self.assertRaisesRegexp(transfer.DumpError, "Test Plan 999"):
+            transfer.load(path)
+
+class IngestTest(TestCase):
+
+    def setUp(self):
+        self.testrun = TestRun.objects.create(testplan_id=dataset.TestPlan.objects.create(name='p').id, release='r',
+                                              start_date=datetime.datetime(2015, 5, 15, tzinfo=timezone.utc))
+
+    def test_import_in_batches(self):
+        path = tempfile.mktemp()
+        self.addCleanup(os.remove, path)
+        dataset.write_log(path, testcases=50, failure_rate=0.2)
+
+        self.assertEqual(ingest.import_lines(self.testrun, open(path), batch_size=7), 50)
+        counts = self.testrun.get_counts()
+        self.testrun.update_counts()
+        self.assertEqual(counts, self.testrun.get_counts())
+        self.assertEqual(rollups.totals('release', release='r')['r'], dict((r, n) for r, n in counts.items() if n))
+
+        failed = TestCaseResult.objects.filter(testrun=self.testrun, result='failed')
+        self.assertEqual(failed.exclude(signature=None).count(), self.testrun.failed)
+        self.assertNotIn('Testcase', failed[0].message)
+
+    def test_planned_testcases_without_result_are_idle(self):
+        catalog.plan(self.testrun.testplan, ['a', 'b', 'c'])
+        records = [('a', 'passed', ''), ('b', 'idle', ''), ('d', 'failed', 'Error'), ('e', 'idle', '')]
+        self.assertEqual(ingest.import_records(self.testrun, iter(records)), 2)
+
+        self.assertEqual(sorted(self.testrun.testplan.testcases.values_list('name', flat=True)), ['a', 'b', 'c', 'e'])
+        self.assertEqual(sorted(self.testrun.get_missing().values_list('name', flat=True)), ['b', 'c', 'e'])
+        self.assertFalse(TestCaseResult.objects.filter(result='idle').exists())
+
+        counts = self.testrun.get_counts()
+        self.assertEqual((counts['passed'], counts['failed'], counts['idle']), (1, 1, 3))
+        self.testrun.update_counts()
+        self.assertEqual(counts, self.testrun.get_counts())
+
+    def test_tail_follows_rotation_and_truncation(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'log')
+        with open(path, 'w') as log:
+            log.write("a\nb")
+
+        lines = ingest.tail(path, poll_interval=0, idle_timeout=None)
+        self.assertEqual([next(lines), next(lines)], ["a\n", None])
+
+        with open(path, 'a') as log:
+            log.write("c\n")
+        self.assertEqual(next(lines), "bc\n")
+
+        os.rename(path, path + '.1')
+        with open(path, 'w') as log:
+            log.write("dd\n")
+        self.assertEqual(next(lines), "dd\n")
+
+        with open(path, 'w') as log:
+            log.write("e\n")
+        self.assertEqual([next(lines), next(lines)], ["e\n", None])
+
+class ParserTest(TestCase):
+
+    def test_junit(self):
+        log = tempfile.TemporaryFile()
+        log.write('<testsuites><testsuite name="s">')
+        for i in range(1000):
+            log.write('<testcase classname="c" name="test_%d"><system-out>%s</system-out></testcase>' % (i, 'x' * 1000))
+        log.write('<testcase name="test_failed"><failure message="boom">Traceback</failure></testcase>'
+                  '<testcase name="test_skipped"><skipped/></testcase></testsuite></testsuites>')
+        log.seek(0)
+
+        records = list(parsers.parse_junit(log))
+        self.assertEqual(len(records), 1002)
+        self.assertEqual(records[0], ('c.test_0', 'passed', ''))
+        self.assertEqual(records[-2:], [('test_failed', 'failed', 'boom\nTraceback'), ('test_skipped', 'blocked', '')])
+
+        self.assertRaises(parsers.ParseError, list, parsers.parse_junit(tempfile.TemporaryFile()))
+
+    def subunit_packet(self, test_id, status, content=''):
+        def number(value):
+            return chr(value) if value < 0x40 else struct.pack('>H', value | 0x4000)
+
+        flags = 0x2000 | parsers.SUBUNIT_TEST_ID | status
+        body = number(len(test_id)) + test_id
+        if content:
+            flags |= parsers.SUBUNIT_FILE_CONTENT
+            body += number(len('traceback')) + 'traceback' + number(len(content)) + content
+        length = len(body) + 8
+        length += 0 if length < 0x40 else 1
+        packet = '\xb3' + struct.pack('>H', flags) + number(length) + body
+        return packet + struct.pack('>I', zlib.crc32(packet) & 0xffffffff)
+
+    def test_subunit(self):
+        log = tempfile.TemporaryFile()
+        log.write(self.subunit_packet('a', 2) + self.subunit_packet('a', 3) + self.subunit_packet('b', 2, 'Trace' * 20) +
+                  self.subunit_packet('b', 6, 'back') + self.subunit_packet('c', 5))
+        log.seek(0)
+        self.assertEqual(list(parsers.parse_subunit(log)),
+                         [('a', 'passed', ''), ('b', 'failed', 'Trace' * 20 + 'back'), ('c', 'blocked', '')])
+
+        log = tempfile.TemporaryFile()
+        log.write(self.subunit_packet('a', 3)[:-1] + 'x')
+        log.seek(0)
+        self.assertRaises(parsers.ParseError, list, parsers.parse_subunit(log))
+
+    def test_json(self):
+        lines = ['{"testcase": "a", "status": "PASSED"}\n', None, '\n', '{"testcase": "b", "status": "ERROR", "log": "x"}\n']
+        self.assertEqual(list(parsers.parse_json(lines)), [('a', 'passed', ''), None, ('b', 'failed', 'x')])
+        self.assertRaises(parsers.ParseError, list, parsers.parse_json(['{"testcase": "a"}\n']))
+        self.assertRaises(parsers.ParseError, list, parsers.parse_json(['{"testcase": ["a"], "status": "PASSED"}\n']))
+        self.assertRaises(parsers.ParseError, list, parsers.parse_json(['{"testcase": 1, "status": "PASSED"}\n']))
+
+    def test_detect(self):
+        self.assertEqual([parsers.detect(path) for path in ('r.log', 'r.XML', 'r.subunit', 'r.jsonl')],
+                         ['text', 'junit', 'subunit', 'json'])
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PageCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bump_invalidates_release_and_all_releases(self):
+        release, other, all_releases = (pagecache.get_data_version('r'), pagecache.get_data_version('other'),
+                                        pagecache.get_data_version())
+        self.assertEqual(pagecache.get_data_version('r'), release)
+
+        pagecache.bump_data_version('r')
+        self.assertNotEqual(pagecache.get_data_version('r'), release)
+        self.assertNotEqual(pagecache.get_data_version(), all_releases)
+        self.assertEqual(pagecache.get_data_version('other'), other)
+
+        # Versions evicted from the cache don't come back
+        cache.clear()
+        self.assertNotIn(pagecache.get_data_version('r'), (release, other, all_releases))
+
+    def test_cached_page_is_served_without_queries(self):
+        dataset.generate(**SMALL_DATASET)
+        testrun = TestRun.objects.first()
+        url = reverse('charts:testrun', args=[testrun.id])
+        content = self.client.get(url).content
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).content, content)
+
+        # A new import of the release builds the page again
+        pagecache.bump_data_version(testrun.release)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertGreater(len(queries), 0)
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SnapshotTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.output = os.path.join(self.root, 'snapshots')
+        self.release = '1.8_M1.rc1'
+        dataset.generate(**SMALL_DATASET)
+
+    def snapshot(self, **options):
+        out = StringIO.StringIO()
+        call_command('snapshot_release', self.release, output=self.output, stdout=out, **options)
+        return out.getvalue()
+
+    def read(self, url, name):
+        with open(os.path.join(self.output, url.lstrip('/'), name)) as snapshot_file:
+            return snapshot_file.read()
+
+    def test_pages_and_tables_are_written(self):
+        self.snapshot(page_sizes=[3])
+        testrun = TestRun.objects.filter(release=self.release).first()
+
+        self.assertIn(self.release, self.read(reverse('charts:testreport', args=[self.release]), 'index.html'))
+        self.assertIn('index.html', os.listdir(os.path.join(self.output, reverse('charts:testrun', args=[testrun.id]).lstrip('/'))))
+
+        url = reverse('charts:testrunresultstable', args=[testrun.id])
+        total = json.loads(self.read(url, 'all.json'))['total']
+        self.assertGreater(total, 3)
+        pages = (total + 2) // 3
+        self.assertEqual(sorted(os.listdir(os.path.join(self.output, url.lstrip('/')))),
+                         sorted(['all.json'] + ['3-%d.json' % page for page in range(1, pages + 1)]))
+        self.assertEqual(json.loads(self.read(url, '3-%d.json' % pages))['total'], total)
+
+    def test_unchanged_releases_are_skipped(self):
+        self.snapshot()
+        served = os.path.realpath(self.output)
+        self.assertIn("unchanged", self.snapshot())
+        self.assertEqual(os.path.realpath(self.output), served)
+
+        # A run imported into the release changes its fingerprint
+        testrun = TestRun.objects.filter(release=self.release).first()
+        testrun.pk = None
+        testrun.save()
+        self.assertNotIn("unchanged", self.snapshot())
+        self.assertNotEqual(os.path.realpath(self.output), served)
+
+        # So do recounts, e.g. of idle test cases, archiving and other writes
+        TestRun.objects.filter(pk=testrun.pk).update(idle=F('idle') + 1)
+        self.assertNotIn("unchanged", self.snapshot())
+        archive.archive_testrun(testrun)
+        self.assertNotIn("unchanged", self.snapshot())
+        self.assertIn("unchanged", self.snapshot())
+        pagecache.bump_data_version(self.release)
+        self.assertNotIn("unchanged", self.snapshot())
+
+    def test_snapshots_are_swapped(self):
+        # Written in place by an older version, its pages are kept
+        os.makedirs(os.path.join(self.output, 'other'))
+        open(os.path.join(self.output, 'other', 'index.html'), 'w').close()
+        self.snapshot(page_sizes=[3])
+        served = os.path.realpath(self.output)
+        self.assertTrue(os.path.islink(self.output))
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'other', 'index.html')))
+        self.assertEqual(sorted(os.listdir(self.root)), sorted(['snapshots', os.path.basename(served)]))
+
+        testrun = TestRun.objects.filter(release=self.release).first()
+        url = reverse('charts:testrunresultstable', args=[testrun.id])
+        with open(os.path.join(served, url.lstrip('/'), '3-1.json')) as old_page:
+            self.snapshot(force=True)
+            # Files being read are kept until closed
+            self.assertIn('"total"', old_page.read())
+
+        # The previous snapshot is gone, and so are the pages of other sizes
+        self.assertEqual(sorted(os.listdir(self.root)), sorted(['snapshots', os.path.basename(os.path.realpath(self.output))]))
+        self.assertFalse(os.path.exists(served))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.output, url.lstrip('/')))), ['25-1.json', 'all.json'])
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SpoolTest(TestCase):
+
+    def test_daemon_processes_queued_jobs(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        log = os.path.join(root, 'results.log')
+        dataset.write_log(log, testcases=20)
+
+        spool.queue({'command' : 'testplan', 'args' : [ingest.BSP_TESTPLAN, 'BSPs', '1.8']}, root)
+        args = ['1.8', '1.8_rc1', 'Weekly', 'abc', 'master', '2015-05-15 11:39:23', 'genericx86', 'core-image-sato',
+                'x86_64', 'NUC']
+        imported = spool.queue({'command' : 'testrun', 'args' : [log] + args}, root)
+        missing = spool.queue({'command' : 'testrun', 'args' : [log + '.missing'] + args}, root)
+        spool.serve(root, once=True)
+
+        with open(os.path.join(root, 'done', imported)) as outcome:
+            self.assertEqual(json.load(outcome)['status'], 'done')
+        with open(os.path.join(root, 'done', missing)) as outcome:
+            self.assertIn("Cannot find log file", json.load(outcome)['output'])
+        testrun = TestRun.objects.get()
+        self.assertEqual(sum(testrun.get_counts().values()), 20)
+        self.assertEqual(os.listdir(os.path.join(root, 'incoming')) + os.listdir(os.path.join(root, 'processing')), [])
+
+    def test_one_daemon_per_spool(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        name = spool.queue({'command' : 'unknown', 'args' : []}, root)
+        # Claimed by a running daemon
+        os.rename(os.path.join(root, 'incoming', name), os.path.join(spool.get_directory('processing', root), name))
+
+        lock_file = spool.lock(root)
+        self.assertRaises(spool.SpoolLocked, spool.serve, root, once=True)
+        self.assertEqual(os.listdir(os.path.join(root, 'processing')), [name])
+
+        # Once it stopped, its jobs are processed again
+        lock_file.close()
+        spool.serve(root, once=True)
+        self.assertEqual(os.listdir(os.path.join(root, 'done')), [name])
+
+    def test_prune(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        old, new = spool.queue({}, root), spool.queue({}, root)
+        for name in (old, new):
+            os.rename(os.path.join(root, 'incoming', name), os.path.join(spool.get_directory('done', root), name))
+        past = time.time() - spool.KEEP_DONE - 60
+        os.utime(os.path.join(root, 'done', old), (past, past))
+
+        self.assertEqual(spool.prune(root), 1)
+        self.assertEqual(os.listdir(os.path.join(root, 'done')), [new])
+
+    def test_failed_import_leaves_nothing(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        log = os.path.join(root, 'results.log')
+        dataset.write_log(log, testcases=20, failure_rate=0.5)
+        ingest.add_testplan(ingest.BSP_TESTPLAN, 'BSPs', '1.8')
+        reports.save({'release' : '1.8_rc1'})
+
+        # The package list is read once the results are saved
+        fields = dict(zip(spool.TESTRUN_ARGUMENTS, ['1.8', '1.8_rc1', 'Weekly', 'abc', 'master', '2015-05-15 11:39:23',
+                                                    'genericx86', 'core-image-sato', 'x86_64', 'NUC']))
+        self.assertRaises(IOError, ingest.add_testrun, log, fields, packages_file=log + '.missing',
+                          out=open(os.devnull, 'w'))
+        self.assertFalse(TestRun.objects.exists())
+        self.assertFalse(ResultRollup.objects.exclude(count=0).exists())
+        self.assertFalse(releases.get_releases().exists())
+        self.assertFalse(TestReport.objects.get().testreportrun_set.exists())
+        self.assertFalse(FailureSignature.objects.exists())
+
+        # Signatures other runs have keep their occurrences
+        ingest.add_testrun(log, dict(fields, release='1.8_rc2'), out=open(os.devnull, 'w'))
+        occurrences = sorted(FailureSignature.objects.values_list('signature', 'occurrences'))
+        self.assertTrue(occurrences)
+        self.assertRaises(IOError, ingest.add_testrun, log, fields, packages_file=log + '.missing',
+                          out=open(os.devnull, 'w'))
+        self.assertEqual(sorted(FailureSignature.objects.values_list('signature', 'occurrences')), occurrences)
+
+class JobTest(TestCase):
+
+    def setUp(self):
+        self.runs = []
+        self.failures = 1
+        jobs.handler('test')(self.handle)
+        self.addCleanup(jobs.HANDLERS.pop, 'test')
+
+    def handle(self, key):
+        if key == 'failing' and self.failures:
+            self.failures -= 1
+            raise ValueError(key)
+        self.runs.append(key)
+
+    def test_jobs_are_deduplicated_and_prioritized(self):
+        low = jobs.enqueue('test', 'low')
+        self.assertEqual(jobs.enqueue('test', 'low').id, low.id)
+        jobs.enqueue('test', 'high', priority=5)
+        jobs.work(['test'], once=True)
+        self.assertEqual(self.runs, ['high', 'low'])
+
+        # Done jobs don't prevent queuing the same work again
+        self.assertNotEqual(jobs.enqueue('test', 'low').id, low.id)
+
+    def test_failed_jobs_are_retried(self):
+        job = jobs.enqueue('test', 'failing')
+        jobs.work(['test'], once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts, self.runs), (Job.QUEUED, 1, []))
+        self.assertIn('ValueError', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        jobs.work(['test'], once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts, self.runs), (Job.DONE, 2, ['failing']))
+
+    def test_update_counts_skips_archived_runs(self):
+        dataset.generate(**SMALL_DATASET)
+        testrun = TestRun.objects.first()
+        counts = testrun.get_counts()
+        rollup_counts = sorted(ResultRollup.objects.values_list('bucket', 'result', 'count'))
+        archive.archive_testrun(testrun)
+
+        jobs.update_counts(testrun.pk)
+        testrun.refresh_from_db()
+        self.assertEqual(testrun.get_counts(), counts)
+        self.assertEqual(sorted(ResultRollup.objects.values_list('bucket', 'result', 'count')), rollup_counts)
+
+class QueryStatsTest(TestCase):
+
+    def setUp(self):
+        middleware.reset_stats()
+        self.addCleanup(middleware.reset_stats)
+        self.url = reverse('charts:testrun', args=[1])
+
+        # Slow requests are logged to a list rather than the console
+        self.warnings = []
+        handler = logging.Handler()
+        handler.emit = self.warnings.append
+        logger = logging.getLogger('charts.middleware')
+        logger.addHandler(handler)
+        logger.propagate = False
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(setattr, logger, 'propagate', True)
+
+    def serve(self, path, *querysets):
+        """ Runs a request through the middleware, the view evaluating the querysets """
+
+        request = RequestFactory().get(path)
+        reset_queries()
+        query_stats = middleware.QueryStatsMiddleware()
+        query_stats.process_request(request)
+        request.resolver_match = resolve(path)
+        query_stats.process_view(request, request.resolver_match.func, request.resolver_match.args,
+                                 request.resolver_match.kwargs)
+        for queryset in querysets:
+            list(queryset)
+        return query_stats.process_response(request, HttpResponse())
+
+    def test_query_template(self):
+        self.assertEqual(middleware.query_template("SELECT a FROM t WHERE id = 12 AND b = 'x''y' AND c IN (1, 2.5, 3)"),
+                         "SELECT a FROM t WHERE id = ? AND b = ? AND c IN (...)")
+
+    def test_queries_are_aggregated_per_view(self):
+        self.serve(self.url, TestRun.objects.filter(pk=1), TestRun.objects.filter(pk=2), TestRun.objects.filter(pk=3),
+                   TestCaseResult.objects.all())
+        self.serve(self.url)
+        self.assertFalse(connection.force_debug_cursor)
+
+        stats = middleware.get_stats()
+        self.assertEqual(list(stats), ['charts:testrun'])
+        stats = stats['charts:testrun']
+        self.assertEqual((stats['requests'], stats['max_queries'], stats['avg_queries']), (2, 4, 2.0))
+        self.assertEqual((stats['queries_histogram']['0'], stats['queries_histogram']['5']), (1, 1))
+        self.assertEqual(sum(stats['latency_histogram_ms'].values()), 2)
+        # The three lookups differing by their id share one template
+        self.assertEqual(stats['most_repeated_query']['count'], 3)
+
+    def test_stats_page(self):
+        self.serve(self.url)
+        url = reverse('charts:querystats')
+
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1').status_code, 404)
+        self.assertIn('charts:testrun', json.loads(self.client.get(url).content))
+
+        self.client.get(url + '?reset')
+        # Only the request that reset them is left
+        self.assertEqual(list(middleware.get_stats()), ['charts:querystats'])
+
+    def test_slow_requests_are_logged(self):
+        with override_settings(QUERYSTATS_SLOW_REQUEST_MS=None, QUERYSTATS_SLOW_REQUEST_QUERIES=2):
+            self.serve(self.url, TestRun.objects.all(), TestRun.objects.all())
+            self.assertEqual(self.warnings, [])
+            self.serve(self.url, TestRun.objects.all(), TestRun.objects.all(), TestRun.objects.all())
+            self.assertEqual(len(self.warnings), 1)
+            self.assertIn(self.url, self.warnings[0].getMessage())
+            self.assertIn('3 queries', self.warnings[0].getMessage())
+
+        with override_settings(QUERYSTATS_SLOW_REQUEST_MS=-1, QUERYSTATS_SLOW_REQUEST_QUERIES=None):
+            self.serve(self.url)
+        self.assertEqual(len(self.warnings), 2)
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RoutingTest(TestCase):
+    """ The switching between databases, with a reporting database only pretended to be configured """
+
+    def setUp(self):
+        cache.clear()
+        is_configured = routers.is_configured
+        routers.is_configured = lambda: True
+        self.addCleanup(setattr, routers, 'is_configured', is_configured)
+        self.addCleanup(routers.read_from_reporting, False)
+        self.middleware = middleware.ReportingDatabaseMiddleware()
+
+    def test_reads_after_a_write_use_default_database(self):
+        routers.read_from_reporting(True)
+        pagecache.get_data_version('r')
+        self.assertTrue(routers.is_reading_from_reporting())
+
+        pagecache.bump_data_version('r')
+        pagecache.get_data_version('other')
+        self.assertTrue(routers.is_reading_from_reporting())
+        pagecache.get_data_version('r')
+        self.assertFalse(routers.is_reading_from_reporting())
+
+        # Pages spanning releases include the written one
+        routers.read_from_reporting(True)
+        pagecache.get_data_version()
+        self.assertFalse(routers.is_reading_from_reporting())
+
+    def test_writing_clients_read_default_database(self):
+        request = RequestFactory().get('/')
+        self.middleware.process_request(request)
+        self.assertTrue(routers.is_reading_from_reporting())
+        response = self.middleware.process_response(request, HttpResponse())
+        self.assertFalse(routers.is_reading_from_reporting())
+        self.assertNotIn(self.middleware.STICKY_COOKIE, response.cookies)
+
+        request = RequestFactory().post('/')
+        self.middleware.process_request(request)
+        self.assertFalse(routers.is_reading_from_reporting())
+        response = self.middleware.process_response(request, HttpResponse())
+        cookie = response.cookies[self.middleware.STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.REPORTING_DATABASE_LAG)
+
+        request = RequestFactory().get('/')
+        request.COOKIES[self.middleware.STICKY_COOKIE] = cookie.value
+        self.middleware.process_request(request)
+        self.assertFalse(routers.is_reading_from_reporting())
+
+    def test_exceptions_reset_the_database(self):
+        request = RequestFactory().get('/')
+        self.middleware.process_request(request)
+        self.assertTrue(routers.is_reading_from_reporting())
+        self.middleware.process_exception(request, ValueError())
+        self.assertFalse(routers.is_reading_from_reporting())
+
+    def test_router(self):
+        router = routers.ReportingRouter()
+        routers.read_from_reporting(True)
+        self.assertEqual((router.db_for_read(TestRun), router.db_for_write(TestRun)), (routers.REPORTING, 'default'))
+        routers.read_from_reporting(False)
+        self.assertEqual(router.db_for_read(TestRun), 'default')
+
+@skipUnless(routers.is_configured(), "Needs a second database as 'reporting', see the README")
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ReportingDatabaseTest(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        cache.clear()
+        testplan = dataset.TestPlan.objects.create(name='p')
+        self.testrun = TestRun.objects.create(testplan=testplan, release='r', hw='current', start_date='2015-05-15T00:00:00Z')
+        # A reporting database lagging behind
+        dataset.TestPlan.objects.using(routers.REPORTING).create(pk=testplan.pk, name='p')
+        TestRun.objects.using(routers.REPORTING).create(pk=self.testrun.pk, testplan_id=testplan.pk, release='r',
+                                                        hw='stale', start_date='2015-05-15T00:00:00Z')
+        self.url = reverse('charts:testrun', args=[self.testrun.id])
+
+    def test_pages_read_reporting_database(self):
+        self.assertContains(self.client.get(self.url), 'stale')
+        self.assertEqual(TestRun.objects.get().hw, 'current')
+
+    def test_recent_writes_are_read_from_default_database(self):
+        pagecache.bump_data_version('r')
+        self.assertContains(self.client.get(self.url), 'current')
+
+        cache.clear()
+        self.client.post(self.url)
+        self.assertContains(self.client.get(self.url), 'current')
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AttachmentTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.settings = override_settings(ATTACHMENT_ROOT=os.path.join(self.root, 'store'))
+        self.settings.enable()
+        self.testrun = TestRun.objects.create(testplan_id=dataset.TestPlan.objects.create(name='p').id,
+                                              start_date='2015-05-15T00:00:00Z')
+
+        directory = os.path.join(self.root, 'logs')
+        os.makedirs(os.path.join(directory, 'TC1'))
+        for path in ('console.log', 'TC1/console.log'):
+            with open(os.path.join(directory, path), 'w') as log:
+                log.write('0123456789')
+        self.assertEqual(attachments.attach_directory(self.testrun, directory), 2)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.root)
+
+    def get(self, **headers):
+        attachment = self.testrun.testcaseattachment_set.get(testcase__name='TC1')
+        return self.client.get(reverse('charts:attachment', args=[attachment.id, attachment.name]), **headers)
+
+    def test_test_cases_are_matched_by_name(self):
+        self.testrun.refresh_from_db()
+        ingest.import_records(self.testrun, iter([('TC1', 'passed', ''), ('tc2', 'failed', '')]))
+        # Directories of a text log are matched whatever their case
+        directory = os.path.join(self.root, 'text')
+        os.makedirs(os.path.join(directory, 'TC2'))
+        with open(os.path.join(directory, 'TC2', 'dmesg.log'), 'w') as log:
+            log.write('dmesg')
+        self.assertEqual(attachments.attach_directory(self.testrun, directory, lower_case=True), 1)
+
+        response = self.client.get(reverse('charts:testrunresultstable', args=[self.testrun.id]) + '?limit=100')
+        tc1, tc2 = [row['attachments'] for row in json.loads(response.content)['rows']]
+        self.assertIn('console.log', tc1)
+        self.assertIn('dmesg.log', tc2)
+
+    def test_content_is_stored_once(self):
+        self.assertEqual(self.testrun.testcaseattachment_set.count(), 2)
+        self.assertEqual(Attachment.objects.count(), 1)
+
+        path = attachments.path_of(Attachment.objects.get().digest)
+        self.testrun.testcaseattachment_set.all().delete()
+        # Recent ones may be about to be attached
+        self.assertEqual(attachments.prune(), 0)
+        self.assertEqual(attachments.prune(older_than=0), 1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_prune_keeps_recently_used_files(self):
+        path = attachments.path_of(Attachment.objects.get().digest)
+        self.testrun.testcaseattachment_set.all().delete()
+        past = timezone.now() - datetime.timedelta(seconds=attachments.PRUNE_AFTER + 60)
+        Attachment.objects.update(created=past, last_used=past)
+
+        # Stored again by an import about to attach it
+        attachments.store_file(StringIO.StringIO('0123456789'))
+        self.assertEqual(attachments.prune(), 0)
+        self.assertTrue(os.path.exists(path))
+
+        Attachment.objects.update(last_used=past)
+        self.assertEqual(attachments.prune(), 1)
+        self.assertFalse(os.path.exists(path))
+        attachments.store_file(StringIO.StringIO('0123456789'))
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(Attachment.objects.count(), 1)
+
+    def test_prune_keeps_recent_temporary_files(self):
+        tmp_dir = os.path.join(self.root, 'store', 'tmp')
+        old, new = os.path.join(tmp_dir, 'old'), os.path.join(tmp_dir, 'new')
+        for path in (old, new):
+            open(path, 'w').close()
+        past = time.time() - attachments.PRUNE_AFTER - 60
+        os.utime(old, (past, past))
+
+        self.assertEqual(attachments.prune(), 0)
+        self.assertEqual(os.listdir(tmp_dir), ['new'])
+        self.assertEqual(Attachment.objects.count(), 1)
+
+    def test_ranges(self):
+        response = self.get()
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Content-Length'], '10')
+
+        response = self.get(HTTP_RANGE='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+
+        self.assertEqual(b''.join(self.get(HTTP_RANGE='bytes=-3').streaming_content), b'789')
+        self.assertEqual(self.get(HTTP_RANGE='bytes=10-').status_code, 416)
+        self.assertEqual(self.get(HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"other"').status_code, 200)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
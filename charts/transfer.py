@@ -0,0 +1,396 @@
+"""
+Copies of releases between instances. A dump is a gzipped text file holding,
+for each table, the rows of the releases in the text format of PostgreSQL
+COPY. On PostgreSQL rows are written and Test Case Results read with COPY,
+streamed so that memory use doesn't grow with the size of the releases.
+
+Loading gives the rows new primary keys. Test Plans, test cases, failure
+signatures and inventory snapshots already on the instance are reused,
+signatures counting the loaded failures on top of their own. Archived
+results are dumped with the live ones and loaded unarchived, rollups and
+saved reports are rebuilt and attached files are not copied. Saved reports
+of the releases, or matching their runs, keep their id, their Test Plan
+filter being given the plan's new id.
+"""
+
+from django.db import connection, transaction
+from django.db.models import Count, DateTimeField, Max, Min
+from django.utils import timezone
+from django.utils.encoding import force_text
+import collections
+import gzip
+import json
+
+from .models import (TestCase, TestPlan, InventorySnapshot, InventoryItem, FailureSignature, TestRun, TestCaseResult,
+                     ArchivedTestRun, TestReport)
+from . import archive
+from . import jobs
+from . import partitions
+from . import reports
+from . import rollups
+from . import signatures
+
+FORMAT = 3
+
+# Test cases planned by the Test Plans
+PlannedTestCase = TestPlan.testcases.through
+
+# In the order they are dumped and loaded, tables come after the ones they refer to
+MODELS = collections.OrderedDict((model._meta.model_name, model) for model in
+                                 (TestCase, TestPlan, PlannedTestCase, InventorySnapshot, InventoryItem,
+                                  FailureSignature, TestRun, TestCaseResult, TestReport))
+
+END_OF_TABLE = '\\.'
+
+BATCH_SIZE = 1000
+
+ESCAPES = (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r'), ('\b', '\\b'), ('\f', '\\f'),
+           ('\v', '\\v'))
+UNESCAPES = dict((escaped[1], char) for char, escaped in ESCAPES)
+
+class DumpError(Exception):
+    pass
+
+def escape(text):
+    for char, escaped in ESCAPES:
+        text = text.replace(char, escaped)
+    return text
+
+def unescape(text):
+    if text == '\\N':
+        return None
+    if '\\' not in text:
+        return text
+
+    chars = []
+    position = 0
+    while position < len(text):
+        if text[position] == '\\' and position + 1 < len(text):
+            chars.append(UNESCAPES.get(text[position + 1], text[position + 1]))
+            position += 2
+        else:
+            chars.append(text[position])
+            position += 1
+    return ''.join(chars)
+
+def get_fields(model):
+    return list(model._meta.concrete_fields)
+
+def format_row(fields, values):
+    line = []
+    for field, value in zip(fields, values):
+        value = field.get_db_prep_value(value, connection)
+        line.append('\\N' if value is None else escape(force_text(value)))
+    return ('\t'.join(line) + '\n').encode('utf-8')
+
+def write_table(out, model, queryset, extra_rows=()):
+    """ Writes the rows of the queryset, then extra_rows, value lists in the
+        order of the model's fields """
+
+    fields = get_fields(model)
+    out.write("%s\t%s\n" % (model._meta.model_name, ','.join(field.column for field in fields)))
+
+    queryset = queryset.order_by('pk').values_list(*[field.attname for field in fields])
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            sql, params = queryset.query.sql_with_params()
+            # Django's cursor wraps the psycopg2 one
+            cursor.cursor.copy_expert("COPY (%s) TO STDOUT" % cursor.cursor.mogrify(sql, params), out)
+    else:
+        for values in queryset.iterator():
+            out.write(format_row(fields, values))
+
+    for values in extra_rows:
+        out.write(format_row(fields, values))
+    out.write(END_OF_TABLE + '\n')
+
+def archived_rows(testruns):
+    """ Value lists of the archived results of the Test Runs, one run at a time """
+
+    fields = get_fields(TestCaseResult)
+    for archived in ArchivedTestRun.objects.filter(testrun__in=testruns).select_related('testrun').order_by('pk'):
+        for result in archive.decode(archived):
+            result.version = archived.testrun.version
+            yield [getattr(result, field.attname) for field in fields]
+
+def dump(path, releases):
+    """ Writes the releases to a dump file, returns how many Test Runs it holds """
+
+    testruns = TestRun.objects.filter(release__in=releases)
+    results = TestCaseResult.objects.filter(testrun__in=testruns)
+
+    # Reports of the releases, and the ones matching their runs
+    report_ids = set(TestReport.objects.filter(testreportrun__testrun__in=testruns).values_list('pk', flat=True))
+    testplan_ids = set(testruns.values_list('testplan', flat=True).distinct())
+    for testreport in TestReport.objects.all():
+        filters = testreport.get_filters()
+        if filters.get('release') in releases or testreport.pk in report_ids:
+            report_ids.add(testreport.pk)
+            if filters.get('testplan', '').isdigit():
+                testplan_ids.add(int(filters['testplan']))
+
+    testplans = TestPlan.objects.filter(pk__in=testplan_ids)
+    planned = PlannedTestCase.objects.filter(testplan__in=testplans)
+
+    testcase_ids = set(results.values_list('testcase', flat=True).distinct())
+    testcase_ids.update(planned.values_list('testcase', flat=True))
+    signature_ids = set(results.exclude(signature=None).values_list('signature', flat=True).distinct())
+    for testrun_id in ArchivedTestRun.objects.filter(testrun__in=testruns).values_list('pk', flat=True):
+        for result in archive.results_of(testrun_id):
+            testcase_ids.add(result.testcase_id)
+            signature_ids.add(result.signature_id)
+    signature_ids.discard(None)
+
+    snapshots = InventorySnapshot.objects.filter(pk__in=set(testruns.exclude(packages=None).values_list('packages', flat=True))
+                                                 | set(testruns.exclude(services=None).values_list('services', flat=True)))
+
+    with gzip.open(path, 'wb') as out:
+        out.write(json.dumps({'format' : FORMAT, 'releases' : sorted(releases)}) + '\n')
+        write_table(out, TestCase, TestCase.objects.filter(pk__in=testcase_ids))
+        write_table(out, TestPlan, testplans)
+        write_table(out, PlannedTestCase, planned)
+        write_table(out, InventorySnapshot, snapshots)
+        write_table(out, InventoryItem, InventoryItem.objects.filter(snapshot__in=snapshots))
+        write_table(out, FailureSignature, FailureSignature.objects.filter(pk__in=signature_ids))
+        write_table(out, TestRun, testruns)
+        write_table(out, TestCaseResult, results, archived_rows(testruns))
+        write_table(out, TestReport, TestReport.objects.filter(pk__in=report_ids))
+
+    return testruns.count()
+
+def read_rows(lines):
+    """ Yields the rows of a table as lists of escaped values """
+
+    for line in lines:
+        line = line.decode('utf-8').rstrip('\n')
+        if line == END_OF_TABLE:
+            return
+        yield line.split('\t')
+    raise DumpError("Unexpected end of file")
+
+def read_tables(lines):
+    """ Yields (model, columns, rows) of each table, rows must be consumed in turn """
+
+    for name in MODELS:
+        header = next(lines, None)
+        if header is None:
+            raise DumpError("Missing table %s" % name)
+        table, columns = header.decode('utf-8').rstrip('\n').split('\t')
+        if table != name:
+            raise DumpError("Expected table %s, found %s" % (name, table))
+        yield MODELS[name], columns.split(','), read_rows(lines)
+
+def to_objects(model, columns, rows):
+    """ Yields unsaved instances of the model from rows, keeping their old primary key """
+
+    fields = dict((field.column, field) for field in get_fields(model))
+    for row in rows:
+        values = {}
+        for column, text in zip(columns, row):
+            field = fields[column]
+            # Foreign keys don't convert their values
+            value = (field.rel.get_related_field() if field.rel else field).to_python(unescape(text))
+            if isinstance(field, DateTimeField) and value is not None and timezone.is_naive(value):
+                value = timezone.make_aware(value, timezone.utc)
+            values[field.attname] = value
+        yield model(**values)
+
+def load_by_key(objects, key, ids):
+    """ Saves the objects not on the instance yet, looking them up by key,
+        and maps their old primary keys to the ones on the instance. Returns
+        the old primary keys of the saved ones. """
+
+    created = set()
+    for obj in objects:
+        old_id = obj.pk
+        existing = type(obj).objects.filter(**dict((field, getattr(obj, field)) for field in key)).first()
+        if existing is None:
+            obj.pk = None
+            obj.save(force_insert=True)
+            created.add(old_id)
+        ids[old_id] = (existing or obj).pk
+    return created
+
+def load_reports(objects, ids):
+    """ Saves the reports not on the instance yet, with the Test Plan of
+        their filters remapped, and maps their ids to the ones on the
+        instance. A report of the same filters is reused, one of the same
+        id and other filters is refused. Returns the ids of the saved ones. """
+
+    created = set()
+    for testreport in objects:
+        filters = testreport.get_filters()
+        if filters.get('testplan', '').isdigit():
+            if int(filters['testplan']) not in ids['testplan']:
+                raise DumpError("Report %s filters on Test Plan %s, which isn't in the dump"
+                                % (testreport.pk, filters['testplan']))
+            filters['testplan'] = str(ids['testplan'][int(filters['testplan'])])
+        testreport.filters = reports.dumps(filters)
+        testreport.digest = reports.get_digest(testreport.filters)
+
+        existing = TestReport.objects.filter(pk=testreport.pk).first()
+        if existing is not None and existing.digest != testreport.digest:
+            raise DumpError("Report %s already on this instance with other filters" % testreport.pk)
+        existing = existing or TestReport.objects.filter(digest=testreport.digest).first()
+        if existing is None:
+            testreport.save(force_insert=True)
+            created.add(testreport.pk)
+        ids['testreport'][testreport.pk] = (existing or testreport).pk
+    return created
+
+def insert_rows(model, columns, rows):
+    """ Inserts rows of escaped values, returns how many there were """
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    column_list = ', '.join(connection.ops.quote_name(column) for column in columns)
+    count = [0]
+
+    def lines():
+        for row in rows:
+            count[0] += 1
+            yield ('\t'.join(row) + '\n').encode('utf-8')
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.cursor.copy_expert("COPY %s (%s) FROM STDIN" % (table, column_list), LineReader(lines()))
+        else:
+            sql = "INSERT INTO %s (%s) VALUES (%s)" % (table, column_list, ', '.join(['%s'] * len(columns)))
+            batch = []
+            for line in lines():
+                batch.append([unescape(text) for text in line.decode('utf-8').rstrip('\n').split('\t')])
+                if len(batch) == BATCH_SIZE:
+                    cursor.executemany(sql, batch)
+                    batch = []
+            if batch:
+                cursor.executemany(sql, batch)
+
+    return count[0]
+
+class LineReader(object):
+    """ File object reading from an iterator of lines, for COPY FROM """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+def remapped(columns, rows, remaps):
+    """ Rows without their primary key and with foreign keys remapped,
+        remaps is {column: {old id: new id}} """
+
+    positions = [(columns.index(column), ids) for column, ids in remaps.items()]
+    for row in rows:
+        for position, ids in positions:
+            if row[position] != '\\N':
+                row[position] = str(ids[int(row[position])])
+        yield row[1:]
+
+def load(path):
+    """ Loads a dump file, returns ({table: number of rows loaded}, releases).
+        Fails if the instance already has one of the releases. """
+
+    counts = collections.OrderedDict()
+    lines = iter(gzip.open(path, 'rb'))
+    header = json.loads(next(lines))
+    if header.get('format') != FORMAT:
+        raise DumpError("Unsupported dump format %s" % header.get('format'))
+    existing = sorted(set(TestRun.objects.filter(release__in=header['releases']).values_list('release', flat=True)))
+    if existing:
+        raise DumpError("Releases already on this instance: %s" % ', '.join(existing))
+
+    ids = collections.defaultdict(dict)
+    new_testplans = set()
+    recounted = set()
+    new_snapshots = set()
+    new_reports = set()
+    testruns = []
+    with transaction.atomic():
+        for model, columns, rows in read_tables(lines):
+            name = model._meta.model_name
+            if columns[0] != model._meta.pk.column:
+                raise DumpError("Table %s must start with its primary key" % name)
+
+            if model is TestCase:
+                count = len(load_by_key(to_objects(model, columns, rows), ('name',), ids[name]))
+            elif model is TestPlan:
+                new_testplans = load_by_key(to_objects(model, columns, rows), ('name', 'product', 'product_version'), ids[name])
+                count = len(new_testplans)
+            elif model is PlannedTestCase:
+                planned = set((ids['testplan'][obj.testplan_id], ids['testcase'][obj.testcase_id])
+                              for obj in to_objects(model, columns, rows))
+                # Test Plans already on the instance may plan other test cases,
+                # changing the idle counts of their runs and of the loaded ones
+                reused = set(ids['testplan'][old_id] for old_id in ids['testplan'] if old_id not in new_testplans)
+                existing = set(PlannedTestCase.objects.filter(testplan__in=reused).values_list('testplan', 'testcase'))
+                recounted = set(testplan for testplan, testcase in
+                                existing ^ set(row for row in planned if row[0] in reused))
+                planned -= existing
+                PlannedTestCase.objects.bulk_create([PlannedTestCase(testplan_id=testplan, testcase_id=testcase)
+                                                     for testplan, testcase in planned])
+                count = len(planned)
+            elif model is InventorySnapshot:
+                new_snapshots = load_by_key(to_objects(model, columns, rows), ('digest',), ids[name])
+                count = len(new_snapshots)
+            elif model is InventoryItem:
+                # Snapshots already on the instance have their items
+                snapshot = columns.index('snapshot_id')
+                count = insert_rows(model, columns[1:], remapped(
+                    columns, (row for row in rows if int(row[snapshot]) in new_snapshots),
+                    {'snapshot_id' : ids['inventorysnapshot']}))
+            elif model is FailureSignature:
+                # Counted from the loaded results, the dumped counts are the source instance's
+                failure_signatures = list(to_objects(model, columns, rows))
+                for failure_signature in failure_signatures:
+                    failure_signature.occurrences, failure_signature.first_seen, failure_signature.last_seen = 0, None, None
+                count = len(load_by_key(failure_signatures, ('signature',), ids[name]))
+            elif model is TestRun:
+                for testrun in to_objects(model, columns, rows):
+                    old_id = testrun.pk
+                    testrun.pk = None
+                    testrun.testplan_id = ids['testplan'][testrun.testplan_id]
+                    for field in ('packages_id', 'services_id'):
+                        if getattr(testrun, field) is not None:
+                            setattr(testrun, field, ids['inventorysnapshot'][getattr(testrun, field)])
+                    testrun.save(force_insert=True)
+                    ids[name][old_id] = testrun.pk
+                    testruns.append(testrun)
+                    partitions.ensure_partition(testrun.version)
+                count = len(testruns)
+            elif model is TestCaseResult:
+                count = insert_rows(model, columns[1:], remapped(
+                    columns, rows, {'testcase_id' : ids['testcase'], 'testrun_id' : ids['testrun'],
+                                    'signature_id' : ids['failuresignature']}))
+            elif model is TestReport:
+                new_reports = load_reports(to_objects(model, columns, rows), ids)
+                count = len(new_reports)
+
+            counts[name] = count
+
+        for testrun in testruns:
+            rollups.add_testrun(testrun)
+        reports.add_testruns(testruns)
+        # Added to the counts of the signatures, whether new or already on the instance
+        failures = TestCaseResult.objects.filter(testrun__release__in=header['releases'], result='failed',
+                                                 signature__isnull=False)
+        for signature_id, count, first_seen, last_seen in (failures.order_by().values_list('signature')
+                                                           .annotate(Count('id'), Min('testrun__start_date'),
+                                                                     Max('testrun__start_date'))):
+            signatures.add_occurrences(signature_id, count, first_seen, last_seen)
+        # Reports new to the instance may match its other runs too
+        for testreport in TestReport.objects.filter(pk__in=new_reports):
+            reports.refresh(testreport)
+        # Archived runs have no results to count
+        for testrun in TestRun.objects.filter(testplan__in=recounted, archivedtestrun=None).values_list('id', flat=True):
+            jobs.enqueue('update_counts', testrun)
+
+    return counts, header['releases']
@@ -6,13 +6,21 @@ from . import views
 urlpatterns = [
     url(r'^$', views.index, name='index'),
     url(r'^(?P<latest_version>[0-9.]+)$', views.index, name='index_2'),
+    url(r'^heatmap/(?P<version>[0-9.]+)$', views.version_heatmap, name='heatmap'),
     url(r'^search/$', views.search, name='search'),
     url(r'^testrun_filter/$', views.testrun_filter, name='testrun_filter'),
     url(r'^testcase_filter/$', views.testcase_filter, name='testcase_filter'),
     url(r'^testrun/(?P<id>[0-9]+)$', views.testrun, name='testrun'),
+    url(r'^testrun/(?P<id>[0-9]+)/(?P<kind>packages|services)/diff/(?P<other>[0-9]+)$', views.inventory_diff, name='inventory_diff'),
     url(r'^testrun/', lambda x: HttpResponseBadRequest(), name='base_testrun'),
+    url(r'^testcase/(?P<testcase>[^/]+)/first_bad/(?P<testplan>[0-9]+)/(?P<target>[\w.-]+)/(?P<hw>[\w.-]+)$', views.first_bad_commit, name='first_bad_commit'),
+    url(r'^attachment/(?P<id>[0-9]+)/(?P<name>[^/]+)$', views.attachment, name='attachment'),
+    url(r'^testcaseresult/(?P<id>[0-9]+)/message$', views.testcaseresult_message, name='testcaseresult_message'),
     url(r'^testreport/(?P<release>[\w.]+)$', views.testreport, name='testreport'),
     url(r'^testreport/(?P<release>[\w.]+)/(?P<testplan>[0-9]+)/(?P<target>[\w.-]+)/(?P<hw>[\w.-]+)$', views.planenv, name='plan_env'),
     url(r'^testreport/', lambda x: HttpResponseBadRequest(), name='base_testreport'),
-    url(r'^xhr_tables/', include('charts.tables'))
+    url(r'^report/$', views.save_report, name='save_report'),
+    url(r'^report/(?P<testreport_id>\w+)$', views.saved_report, name='saved_report'),
+    url(r'^xhr_tables/', include('charts.tables')),
+    url(r'^querystats/$', views.querystats, name='querystats')
 ]
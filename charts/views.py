@@ -1,10 +1,32 @@
-from django.shortcuts import get_object_or_404, render
+from django.shortcuts import get_object_or_404, redirect, render
+from django.http import HttpResponse, HttpResponseBadRequest, Http404
+from django.db.models import Max, Min, Prefetch
+from django.core.urlresolvers import reverse
 from django.template.defaulttags import register
 from django import forms
+from django.conf import settings
+from django.utils.http import urlencode
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import require_POST
 import collections
+import datetime
+import json
 
-from .models import TestPlan, TestRun, TestCaseResult
+from .models import TestPlan, TestRun, TestCaseResult, TestCaseAttachment, TestReport, Version, sum_counts
 from . import tables
+from . import signatures
+from . import pagecache
+from . import middleware
+from . import rollups
+from . import analytics
+from . import archive
+from . import partitions
+from . import inventory
+from . import attachments
+from . import heatmap
+from . import commits
+from . import reports
+from . import releases
 
 # Template filter to get the value given its coresponding key in a dictionary
 @register.filter
@@ -12,7 +34,7 @@ def get_item(dictionary, key):
     return dictionary.get(key)
 
 class ReleaseForm(forms.Form):
-    versions = forms.ModelChoiceField(queryset=TestRun.objects.all().order_by('-version').distinct('version'), to_field_name='version')
+    versions = forms.ModelChoiceField(queryset=Version.objects.order_by('-sort_key'), to_field_name='name')
 
 
 def search(request):
@@ -27,39 +49,46 @@ def search(request):
         'table_name' : tables.SearchTable.__name__.lower()
         })
 
+@pagecache.cache_release_page(lambda **kwargs: None)
 def index(request, latest_version=None):
 
-    version_form = ReleaseForm()
+    # Evaluated once, iterating a ModelChoiceField in the template queries it several times
+    versions = list(ReleaseForm.base_fields['versions'].queryset.values_list('name', flat=True))
 
     start = True
 
     if not latest_version:
-        version = TestRun.objects.order_by('-version').distinct('version').values_list('version')[0][0]
+        version = versions[0]
     else:
         start = False
         version = latest_version
 
-    testruns = {}
-
-    all_releases = TestRun.objects.filter(version=version).distinct('release').values_list('release', flat=True)
-
-    for release in all_releases:
-        passed = failed = 0
-        testruns_in_release = TestRun.objects.filter(release=release)
-        for testrun_in_release in testruns_in_release:
-            passed += testrun_in_release.testcaseresult_set.filter(result='passed').count()
-            failed += testrun_in_release.testcaseresult_set.filter(result='failed').count()
-
+    # Counts kept per release rather than counted over every result of the version
+    testruns = collections.OrderedDict()
+    for release, passed, failed in releases.get_releases(version).values_list('name', 'passed', 'failed'):
         testruns[release.encode('ascii', 'ignore')] = {
             'passed' : passed,
             'failed' : failed
         }
 
     return render(request, 'charts/index.html', {
-        'version_form' : version_form,
+        'versions' : versions,
         'start' : start,
         'version' : version,
-        'testruns' : collections.OrderedDict(sorted(testruns.items(), reverse=True))
+        'testruns' : testruns
+        })
+
+@pagecache.cache_release_page(lambda **kwargs: None)
+def version_heatmap(request, version):
+
+    releases, rows = heatmap.build(version)
+    if not releases:
+        raise Http404("No Test Runs found")
+
+    return render(request, 'charts/heatmap.html', {
+        'version' : version,
+        'releases' : releases,
+        'rows' : rows
         })
 
 # returns a list used for creating a form with all distinct entries of given field name from Test Runs
@@ -67,30 +96,62 @@ def get_field_form(fieldname):
 
 	return [entry.encode("utf8") for entry in TestRun.objects.distinct(fieldname).values_list(fieldname, flat=True)]
 
+def json_for_script(data):
+    """ JSON that is safe to write inside a <script> element """
+    return mark_safe(json.dumps(data).replace('<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026'))
+
 def testrun_filter(request):
 
     results = None
-    results_dict = collections.OrderedDict()
+    chart_rows = []
     draw_chart = False
     testplan_name = ''
+    bucket = None
+    filters = {}
+    date_from = reports.parse_date(request.GET.get('from'))
+    date_to = reports.parse_date(request.GET.get('to'))
     if request.GET:
-        search_by = ('testplan', 'release', 'test_type', 'poky_commit', 'target', 'image_type', 'hw_arch', 'hw')
-        query_attrs = dict([(param, val) for param, val in request.GET.iteritems() if param in search_by and val])
-        results = TestRun.objects.filter(**query_attrs).order_by('start_date')
+        filters = reports.clean_filters(request.GET)
+        query_attrs = dict((field, value) for field, value in filters.items() if field in reports.FIELDS)
+        results = reports.get_testruns(filters).order_by('start_date')
 
         draw_chart = True
-        for testrun in results:
-            results_dict[testrun.id] = {
-                'date' : '%s' % testrun.start_date.strftime('%-d %b %H:%M %p'),
-                'passed' : testrun.testcaseresult_set.filter(result='passed').count(),
-                'failed' : testrun.testcaseresult_set.filter(result='failed').count()
-            }
+
+        # Long periods are drawn from the rollups, when they are broken down by every filtered field
+        if all(param in rollups.DIMENSIONS for param in query_attrs):
+            start, end = date_from, date_to
+            if not (start and end):
+                first_last = results.aggregate(Min('start_date'), Max('start_date'))
+                start = start or (first_last['start_date__min'] and first_last['start_date__min'].date())
+                end = end or (first_last['start_date__max'] and first_last['start_date__max'].date())
+            bucket = rollups.pick_bucket(start, end)
+
+        labels, links, passed, failed = [], [], [], []
+        if bucket:
+            length = datetime.timedelta(days=rollups.BUCKET_DAYS[bucket] - 1)
+            for day, counts in rollups.series(bucket, date_from, date_to, **query_attrs):
+                # Clicking a bucket zooms into its days
+                zoom = request.GET.copy()
+                zoom['from'], zoom['to'] = day.isoformat(), (day + length).isoformat()
+                labels.append(('Week of %s' if bucket == 'week' else '%s') % day.strftime('%-d %b %Y'))
+                links.append('?' + zoom.urlencode())
+                passed.append(counts.get('passed', 0))
+                failed.append(counts.get('failed', 0))
+        else:
+            testrun_url = reverse('charts:base_testrun')
+            for id, start_date, testrun_passed, testrun_failed in results.values_list('id', 'start_date', 'passed', 'failed'):
+                labels.append(start_date.strftime('%-d %b %H:%M %p'))
+                links.append(testrun_url + str(id))
+                passed.append(testrun_passed)
+                failed.append(testrun_failed)
+
+        chart_rows = analytics.chart_rows(labels, links, passed, failed)
 
         if request.GET.get('testplan'):
             testplan_name = TestPlan.objects.get(id=request.GET.get('testplan')).name
 
     return render(request, 'charts/testrun_filter.html', {
-        'release_form' : get_field_form('release'),
+        'release_form' : list(releases.get_releases().values_list('name', flat=True)),
         'plan_form' : TestPlan.objects.distinct('name').all(),
         'type_form' : get_field_form('test_type'),
         'commit_form' : get_field_form('poky_commit'),
@@ -101,8 +162,40 @@ def testrun_filter(request):
         'query' : request.GET.get('release', '') + " " + testplan_name + " " + request.GET.get('test_type', '') + " " +
                   request.GET.get('poky_commit', '') + " " + request.GET.get('target', '') + " " + request.GET.get('image_type', '') + " " +
                   request.GET.get('hw_arch', '') + " " + request.GET.get('hw', ''),
+        'date_from' : date_from,
+        'date_to' : date_to,
+        'bucket' : bucket,
         'draw_chart' : draw_chart,
-        'results_dict' : results_dict
+        'filters' : filters,
+        'chart_rows' : json_for_script(chart_rows)
+        })
+
+@require_POST
+def save_report(request):
+
+    filters = reports.clean_filters(request.POST)
+    if not filters:
+        return HttpResponseBadRequest("No filters to save")
+
+    return redirect('charts:saved_report', testreport_id=reports.save(filters).testreport_id)
+
+def saved_report(request, testreport_id):
+
+    testreport = get_object_or_404(TestReport, pk=testreport_id)
+    series = reports.get_series(testreport)
+
+    testrun_url = reverse('charts:base_testrun')
+    chart_rows = analytics.chart_rows([start_date.strftime('%-d %b %H:%M %p') for id, start_date, counts in series],
+                                      [testrun_url + str(id) for id, start_date, counts in series],
+                                      [counts['passed'] for id, start_date, counts in series],
+                                      [counts['failed'] for id, start_date, counts in series])
+
+    return render(request, 'charts/saved_report.html', {
+        'testreport' : testreport,
+        'query' : urlencode(sorted(testreport.get_filters().items())),
+        'testruns' : len(series),
+        'counts' : dict((result, sum(counts[result] for id, start_date, counts in series)) for result in TestRun.COUNTERS),
+        'chart_rows' : json_for_script(chart_rows)
         })
 
 
@@ -110,54 +203,118 @@ def testcase_filter(request):
 
     draw_chart = False
     is_empty = False
+    chart_rows = []
     if request.GET:
         if request.GET['name']:
             draw_chart = True
-            if TestCaseResult.objects.filter(testcase_id=request.GET['name']).count() == 0:
+            history = list(TestCaseResult.objects.filter(testcase__name=request.GET['name'])
+                           .order_by('testrun__start_date', 'testrun_id')
+                           .values_list('testrun_id', 'testrun__start_date', 'result'))
+            if not history:
                 is_empty = True
+            else:
+                # One point per Test Run, 1 for its status of the test case
+                testrun_url = reverse('charts:base_testrun')
+                ids, dates, results = zip(*history)
+                chart_rows = analytics.chart_rows([date.strftime('%-d %b %Y %H:%M') for date in dates],
+                                                  [testrun_url + str(id) for id in ids],
+                                                  [int(result == 'passed') for result in results],
+                                                  [int(result == 'failed') for result in results])
 
     return render(request, 'charts/testcase_filter.html', {
         'draw_chart' : draw_chart,
         'is_empty' : is_empty,
+        'testcase' : request.GET.get('name', ''),
+        'chart_rows' : json_for_script(chart_rows),
         'table_name' : tables.TestCaseTable.__name__.lower()
         })
 
+@pagecache.cache_release_page(lambda **kwargs: pagecache.release_of_testrun(kwargs['id']))
 def testrun(request, id):
 
-    testrun = get_object_or_404(TestRun, pk=id)
-    testcaseresults = testrun.testcaseresult_set.all()
+    testrun = get_object_or_404(TestRun.objects.select_related('testplan'), pk=id)
 
     return render(request, 'charts/testrun.html', {
         'testrun'     : testrun,
-        'passed'      : testcaseresults.filter(result='passed').count(),
-        'failed'      : testcaseresults.filter(result='failed').count(),
-        'blocked'     : testcaseresults.filter(result='blocked').count(),
-        'idle'        : testcaseresults.filter(result='idle').count(),
-        'testcaseresults' : testcaseresults
+        'passed'      : testrun.passed,
+        'failed'      : testrun.failed,
+        'blocked'     : testrun.blocked,
+        'idle'        : testrun.idle,
+        'attachments' : testrun.testcaseattachment_set.filter(testcase=None).order_by('name'),
+        'table_name'  : tables.TestRunResultsTable.__name__.lower()
         })
 
-def testreport(request, release):
+def inventory_diff(request, id, kind, other):
 
-    testreport = TestRun.objects.filter(release=release)
+    diff = inventory.diff_testruns(int(id), int(other), kind)
+    if diff is None:
+        raise Http404("No Test Run found")
 
-    passes = fails = 0
-    for testrun in testreport:
-        passes += testrun.testcaseresult_set.filter(result='passed').count()
-        fails += testrun.testcaseresult_set.filter(result='failed').count()
+    return HttpResponse(json.dumps(diff, indent=2), content_type="application/json")
+
+@pagecache.cache_release_page(lambda **kwargs: None)
+def first_bad_commit(request, testcase, testplan, target, hw):
+
+    found = commits.find_first_bad(testcase, testplan, target, hw)
+    if found is None:
+        raise Http404("No result found")
+
+    return HttpResponse(json.dumps(found, indent=2), content_type="application/json")
+
+def attachment(request, id, name):
+
+    testcase_attachment = get_object_or_404(TestCaseAttachment.objects.select_related('attachment'), pk=id, name=name)
+
+    return attachments.serve(request, testcase_attachment)
+
+def testcaseresult_message(request, id):
+
+    message = TestCaseResult.objects.filter(pk=id).values_list('message', flat=True).first()
+    if message is None:
+        result = archive.get_result(int(id))
+        if result is None:
+            raise Http404("No Test Case Result found")
+        message = result.message
+
+    return HttpResponse(message, content_type="text/plain; charset=utf-8")
+
+@pagecache.cache_release_page()
+def testreport(request, release):
+
+    counts = sum_counts(TestRun.objects.filter(release=release))
 
     return render(request, 'charts/testreport.html', {
-        'fails' : fails,
-        'passes': passes,
+        'fails' : counts.get('failed', 0),
+        'passes': counts.get('passed', 0),
         'release' : release,
+        'signatures' : signatures.top_for_release(release),
         'table_name' : tables.TestReportTable.__name__.lower()
         })
 
+@pagecache.cache_release_page()
 def planenv(request, release, testplan, target, hw):
 
-    failed = {}
-    testruns = TestRun.objects.filter(release=release).filter(testplan_id=testplan, target=target, hw=hw)
-    for testrun in testruns:
-        failed[testrun.id] = testrun.testcaseresult_set.filter(result='failed').all()
+    # All failures of the plan-environment in one query, messages are loaded on demand
+    failed = Prefetch('testcaseresult_set', to_attr='failed_results',
+                      queryset=partitions.for_release(TestCaseResult.objects.filter(result='failed'), release)
+                      .select_related('testcase').defer('message').order_by('id'))
+    testruns = list(TestRun.objects.filter(release=release).filter(testplan_id=testplan, target=target, hw=hw)
+                    .select_related('testplan').prefetch_related(failed).order_by('start_date', 'id'))
+
+    if not testruns:
+        raise Http404("No Test Runs found")
+
+    # Runs of archived releases have their failures in the archive
+    missing = [testrun.id for testrun in testruns if testrun.failed and not testrun.failed_results]
+    if missing:
+        archived = archive.failed_results_of(missing)
+        for testrun in testruns:
+            testrun.failed_results = archived.get(testrun.id, testrun.failed_results)
+
+    # Links to what changed in the packages between consecutive runs
+    for previous, testrun in zip(testruns, testruns[1:]):
+        if previous.packages_id and testrun.packages_id and previous.packages_id != testrun.packages_id:
+            testrun.packages_changed_since = previous.id
 
     testplan_name = testruns[0].testplan.name
 
@@ -166,5 +323,16 @@ def planenv(request, release, testplan, target, hw):
         'target' : target,
         'hw' : hw,
         'testruns' : testruns,
-        'failed' : failed
+        'signatures' : signatures.top_for_plan_env(release, testplan, target, hw)
         })
+
+def querystats(request):
+
+    # Only for the people running the server
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        raise Http404
+
+    if 'reset' in request.GET:
+        middleware.reset_stats()
+
+    return HttpResponse(json.dumps(middleware.get_stats(), indent=2), content_type="application/json")
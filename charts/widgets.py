@@ -34,6 +34,7 @@ from django.conf.urls import url, patterns
 from HTMLParser import HTMLParser
 
 import charts.urls
+from charts import pagecache
 import types
 import json
 import collections
@@ -135,6 +136,14 @@ class ToasterTable(View):
     def setup_queryset(self, *args, **kwargs):
         """ function to implement in the subclass which sets up the queryset"""
         pass
+    def prepare_rows(self, rows):
+        """ function to implement in the subclass which annotates the rows of
+            a page, e.g. with aggregates computed for all of them at once """
+        return rows
+    def get_release(self, *args, **kwargs):
+        """ function to override in the subclass when the release of the data
+            isn't in the url, None means the data spans releases """
+        return kwargs.get('release')
 
     def add_filter(self, name, title, filter_actions):
         """Add a filter to the table.
@@ -263,13 +272,14 @@ class ToasterTable(View):
         filters = request.GET.get("filter", None)
         orderby = request.GET.get("orderby", None)
 
-        # Make a unique cache name
-        cache_name = self.__class__.__name__
+        # Make a unique cache name, which changes when new data is ingested
+        cache_name = self.__class__.__name__ + str(pagecache.get_data_version(self.get_release(**kwargs)))
 
-        for key, val in request.GET.iteritems():
+        # Sorted, so that the same parameters in any order share the cache entry
+        for key, val in sorted(request.GET.iteritems()):
             cache_name = cache_name + str(key) + str(val)
 
-        for key, val in kwargs.iteritems():
+        for key, val in sorted(kwargs.iteritems()):
             cache_name = cache_name + str(key) + str(val)
 
         data = cache.get(cache_name)
@@ -302,7 +312,7 @@ class ToasterTable(View):
 
 
         try:
-            for row in page.object_list:
+            for row in self.prepare_rows(list(page.object_list)):
                 #Use collection to maintain the order
                 required_data = collections.OrderedDict()
 
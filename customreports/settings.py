@@ -26,6 +26,14 @@ TEMPLATE_DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# Clients allowed to read the per-view query and latency stats at /querystats/
+INTERNAL_IPS = ('127.0.0.1',)
+
+# Requests slower than this, or running more queries than this, are logged
+# by charts.middleware.QueryStatsMiddleware. None disables the check.
+QUERYSTATS_SLOW_REQUEST_MS = 2000
+QUERYSTATS_SLOW_REQUEST_QUERIES = 100
+
 
 # Application definition
 
@@ -40,6 +48,8 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'charts.middleware.QueryStatsMiddleware',
+    'charts.middleware.ReportingDatabaseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -67,6 +77,48 @@ DATABASES = {
     }
 }
 
+# Pages read from the 'reporting' database when there is one, e.g. a
+# streaming replica of the default one, writes and ingestion use the default
+# one. Pages of releases written in the last REPORTING_DATABASE_LAG seconds
+# are read from the default database, set it above the replica's lag.
+#
+# DATABASES['reporting'] = dict(DATABASES['default'], HOST='replica.example.com', TEST={'MIRROR' : 'default'})
+
+DATABASE_ROUTERS = ['charts.routers.ReportingRouter']
+
+REPORTING_DATABASE_LAG = 30
+
+# Logging
+# https://docs.djangoproject.com/en/1.8/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'charts': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
+# Cache
+# https://docs.djangoproject.com/en/1.8/topics/cache/
+# It must be shared between the web server and the ingestion scripts so that
+# importing a Test Run invalidates the cached pages of its release.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    }
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.6/topics/i18n/
 
@@ -86,6 +138,23 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Where snapshot_release writes the static copies of finished releases
+
+SNAPSHOT_ROOT = os.path.join(BASE_DIR, 'snapshots')
+
+# Where the files attached to Test Runs are stored
+
+ATTACHMENT_ROOT = os.path.join(BASE_DIR, 'attachments')
+
+# Where queue_ingest.py leaves the imports for the ingest_daemon command,
+# $CUSTOMREPORTS_SPOOL for queue_ingest.py if it isn't the default one
+
+INGEST_SPOOL_ROOT = os.path.join(BASE_DIR, 'spool')
+
+# Releases with no Test Run newer than this have their results archived by archive_releases
+
+ARCHIVE_AFTER_DAYS = 365
+
 # Template engines
 
 TEMPLATES = [
@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+
+# Command line utility that queues a Test Run, or a Test Plan, for the
+# ingest_daemon command to import. It doesn't load Django, so it returns
+# in milliseconds where add_testrun.py takes seconds to start.
+#
+# Usage:
+#       queue_ingest.py [--wait] testrun [--follow] [--format=<format>] <add_testrun.py arguments>
+#       queue_ingest.py [--wait] testplan <add_testplan.py arguments>
+#
+# With --wait, it waits for the import to finish, prints its output and
+# exits with an error if it failed. The spool directory is $CUSTOMREPORTS_SPOOL,
+# by default the spool directory next to this script.
+
+import json
+import os, sys
+import time
+
+# Arguments of add_testrun.py and add_testplan.py which are paths, relative to the current directory
+TESTRUN_PATHS = (0, 11, 12, 13)
+TESTPLAN_PATHS = (3,)
+
+spool = os.environ.get('CUSTOMREPORTS_SPOOL', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool'))
+
+args = sys.argv[1:]
+wait = '--wait' in args
+if wait:
+    args.remove('--wait')
+follow = '--follow' in args
+if follow:
+    args.remove('--follow')
+log_format = None
+for arg in args[:]:
+    if arg.startswith('--format='):
+        log_format = arg[len('--format='):]
+        args.remove(arg)
+
+if len(args) < 2 or args[0] not in ('testrun', 'testplan'):
+    print "Usage: queue_ingest.py [--wait] testrun [--follow] [--format=<format>] <add_testrun.py arguments>"
+    print "       queue_ingest.py [--wait] testplan <add_testplan.py arguments>"
+    sys.exit(1)
+
+command, args = args[0], args[1:]
+if command == 'testrun':
+    if args[0] == '-':
+        print "Error: the daemon can't read the log from the standard input, use add_testrun.py"
+        sys.exit(1)
+for index in TESTRUN_PATHS if command == 'testrun' else TESTPLAN_PATHS:
+    if index < len(args) and args[index]:
+        args[index] = os.path.abspath(args[index])
+
+incoming = os.path.join(spool, 'incoming')
+if not os.path.isdir(incoming):
+    os.makedirs(incoming)
+
+# Named so that jobs sort in the order they were queued
+name = '%d-%d.json' % (time.time() * 1000000, os.getpid())
+with open(os.path.join(incoming, name + '.tmp'), 'w') as job:
+    json.dump({'command' : command, 'args' : args, 'follow' : follow, 'format' : log_format}, job)
+os.rename(os.path.join(incoming, name + '.tmp'), os.path.join(incoming, name))
+
+if not wait:
+    print "Queued %s" % name
+    sys.exit(0)
+
+done = os.path.join(spool, 'done', name)
+while not os.path.exists(done):
+    time.sleep(0.05)
+
+with open(done) as outcome:
+    outcome = json.load(outcome)
+sys.stdout.write(outcome['output'])
+sys.exit(0 if outcome['status'] == 'done' else 1)